@@ -0,0 +1,316 @@
+"""GUIを起動せずにフィルタのxmlを処理するコマンドラインツール
+PyQt5はimportしないため、GUIの無い環境(CI等)でも実行できる。
+
+使い方:
+    python -m app.cli reorder --sort-key label --sort-key from xml_file/*.xml
+    python -m app.cli reorder --order ids.txt --output-dir out xml_file/*.xml
+    python -m app.cli diff xml_file/mine.xml xml_file/fresh.xml
+    python -m app.cli merge xml_file/mine.xml xml_file/fresh.xml -o merged.xml
+    python -m app.cli replay xml_file/mine.xml ~/mail/archive.mbox -j 4
+    python -m app.cli consolidate xml_file/mine.xml -o consolidated.xml
+    python -m app.cli --trace trace.json reorder -j 1 --sort-key label xml_file/*.xml
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterator, Union
+
+from app.common.trace import TRACER
+from app.data.consolidate import MAX_CRITERIA_LENGTH, consolidated_data, plan_consolidation
+from app.data.filter_data import FilterData, render_entry
+from app.data.filter_diff import diff_xml, merge_xml
+from app.data.filter_entry import FilterEntry
+from app.data.filter_reorder import (
+    SORT_KEYS,
+    ReorderResult,
+    ReorderSpec,
+    read_id_order,
+    reorder_xml,
+)
+from app.data.filter_writer import export_xml_path
+from app.data.mail_replay import MailboxReplayer
+
+
+def _output_path(input_path: str, output_dir: Union[str, None]) -> str:
+    if output_dir is None:
+        return export_xml_path(input_path)
+    return os.path.join(output_dir, os.path.basename(input_path))
+
+
+def _iter_reorder(
+    input_paths: list[str], spec: ReorderSpec, output_dir: Union[str, None], n_jobs: int
+) -> Iterator[tuple[str, Union[ReorderResult, Exception]]]:
+    """各xmlを並び替え、(入力パス, 結果または例外)を入力の順に返す"""
+    output_paths = [_output_path(path, output_dir) for path in input_paths]
+    if n_jobs <= 1 or len(input_paths) <= 1:
+        # NOTE: 1ファイルだけの場合はプロセスの起動時間の方が長いため、同じプロセスで処理する
+        for input_path, output_path in zip(input_paths, output_paths):
+            try:
+                yield input_path, reorder_xml(input_path, spec, output_path)
+            except Exception as e:
+                yield input_path, e
+        return
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures: list[Future] = [
+            executor.submit(reorder_xml, input_path, spec, output_path)
+            for input_path, output_path in zip(input_paths, output_paths)
+        ]
+        for input_path, future in zip(input_paths, futures):
+            try:
+                yield input_path, future.result()
+            except Exception as e:
+                yield input_path, e
+
+
+def _reorder(args: argparse.Namespace) -> int:
+    if args.order is None and not args.sort_key:
+        print("error: --order or --sort-key is required", file=sys.stderr)
+        return 2
+    spec = ReorderSpec(
+        id_order=None if args.order is None else read_id_order(args.order),
+        sort_keys=tuple(args.sort_key or ()),
+        reverse=args.reverse,
+    )
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    n_failed = 0
+    n_entries = 0
+    for input_path, result in _iter_reorder(args.xml, spec, args.output_dir, args.jobs):
+        if isinstance(result, Exception):
+            n_failed += 1
+            print(f"{input_path}: {type(result).__name__}: {result}", file=sys.stderr)
+            continue
+        n_entries += result.n_entries
+        unmatched = f", {result.n_unmatched} ids not found" if result.n_unmatched else ""
+        print(
+            f"{input_path} -> {result.output_path}: {result.n_entries} entries{unmatched} "
+            f"(load {result.load_time:.3f}s, reorder {result.reorder_time:.3f}s, "
+            f"export {result.export_time:.3f}s, total {result.total_time:.3f}s)"
+        )
+
+    elapsed = time.perf_counter() - start
+    n_succeeded = len(args.xml) - n_failed
+    print(
+        f"{n_succeeded}/{len(args.xml)} files, {n_entries} entries in {elapsed:.3f}s "
+        f"({args.jobs} jobs)"
+    )
+    return 1 if n_failed else 0
+
+
+def _describe_entry(entry_list: list[FilterEntry], index: int) -> str:
+    entry = entry_list[index]
+    return f"#{index + 1} {entry.id} {render_entry(entry)[0]}"
+
+
+def _diff(args: argparse.Namespace) -> int:
+    start = time.perf_counter()
+    try:
+        base, target, diff = diff_xml(args.base, args.target)
+    except Exception as e:
+        print(f"{type(e).__name__}: {e}", file=sys.stderr)
+        return 2
+    elapsed = time.perf_counter() - start
+
+    if not args.summary:
+        for index in diff.added:
+            print(f"+ {_describe_entry(target.entry_list, index)}")
+        for index in diff.removed:
+            print(f"- {_describe_entry(base.entry_list, index)}")
+        for base_index, target_index in diff.changed:
+            print(f"~ #{base_index + 1} -> {_describe_entry(target.entry_list, target_index)}")
+        for move in diff.moves:
+            after = "top" if move.after is None else f"after #{move.after + 1}"
+            print(f"> {_describe_entry(target.entry_list, move.index)} ({after})")
+    print(
+        f"{len(diff.added)} added, {len(diff.removed)} removed, {len(diff.changed)} changed, "
+        f"{len(diff.moves)} moves ({len(base.entry_list)} -> {len(target.entry_list)} entries) "
+        f"in {elapsed:.3f}s"
+    )
+    return 0 if diff.is_same else 1
+
+
+def _merge(args: argparse.Namespace) -> int:
+    try:
+        result = merge_xml(args.mine, args.fresh, args.output)
+    except Exception as e:
+        print(f"{type(e).__name__}: {e}", file=sys.stderr)
+        return 1
+    print(
+        f"{result.fresh_path} -> {result.output_path}: {result.n_entries} entries "
+        f"in the order of {result.mine_path} ({result.n_added} added, {result.n_removed} removed) "
+        f"(load {result.load_time:.3f}s, merge {result.merge_time:.3f}s, "
+        f"export {result.export_time:.3f}s, total {result.total_time:.3f}s)"
+    )
+    return 0
+
+
+def _replay(args: argparse.Namespace) -> int:
+    try:
+        entry_list = FilterData(args.xml).entry_list
+        replayer = MailboxReplayer(entry_list, args.mailbox, args.jobs)
+        result = replayer.replay()
+    except Exception as e:
+        print(f"{type(e).__name__}: {e}", file=sys.stderr)
+        return 1
+
+    if not args.summary:
+        hit_counts = result.hit_counts()
+        first_match_counts = result.first_match_counts(range(len(entry_list)))
+        print("priority\thits\tfirst\tcondition")
+        for index, entry in enumerate(entry_list):
+            if index in result.unsupported:
+                hits = first = "?"
+            else:
+                hits, first = hit_counts[index], first_match_counts[index]
+            print(f"{index + 1}\t{hits}\t{first}\t{render_entry(entry)[0]}")
+    rate = result.n_messages / result.elapsed if result.elapsed > 0 else 0
+    print(
+        f"{result.n_messages} messages, {result.n_messages - result.n_unmatched} matched, "
+        f"{len(result.unsupported)}/{result.n_entries} filters skipped (unsupported criteria) "
+        f"in {result.elapsed:.3f}s ({rate:,.0f} messages/s, {args.jobs} jobs)"
+    )
+    return 0
+
+
+def _consolidate(args: argparse.Namespace) -> int:
+    output_path = export_xml_path(args.xml) if args.output is None else args.output
+    start = time.perf_counter()
+    try:
+        filter_data = FilterData(args.xml)
+        loaded = time.perf_counter()
+        plan = plan_consolidation(filter_data.entry_list, max_length=args.max_length)
+        planned = time.perf_counter()
+        if not args.dry_run:
+            consolidated_data(filter_data, plan).export_xml(output_path)
+    except Exception as e:
+        print(f"{type(e).__name__}: {e}", file=sys.stderr)
+        return 1
+    exported = time.perf_counter()
+
+    if not args.summary:
+        for merge in plan.merges:
+            rows = ", ".join(f"#{row + 1}" for row in merge.rows[1:])
+            print(f"#{merge.rows[0] + 1} <- {rows}: from:({merge.value})")
+    destination = "(dry run)" if args.dry_run else f"-> {output_path}"
+    print(
+        f"{args.xml} {destination}: {plan.n_entries} -> {len(plan.entry_list)} entries "
+        f"({len(plan.merges)} merged filters, {plan.n_blocked} kept apart by priority, "
+        f"{plan.n_split} split by length) (load {loaded - start:.3f}s, "
+        f"plan {planned - loaded:.3f}s, export {exported - planned:.3f}s)"
+    )
+    return 0
+
+
+def _create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="処理時間をChrome trace形式のjsonで出力し、集計表を表示する"
+        "(別プロセスで処理した分は含まない)",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    reorder = subparsers.add_parser("reorder", help="フィルタの優先度(並び順)を変更して出力する")
+    reorder.add_argument("xml", nargs="+", help="Gmailから出力したフィルタのxml")
+    spec = reorder.add_mutually_exclusive_group()
+    spec.add_argument("--order", help="並び順を1行に1つidで記載したファイル")
+    spec.add_argument(
+        "--sort-key",
+        action="append",
+        choices=SORT_KEYS,
+        help="ソートのキー(複数指定した場合は先に指定したキーを優先する)",
+    )
+    reorder.add_argument("--reverse", action="store_true", help="--sort-keyで降順にソートする")
+    reorder.add_argument(
+        "--output-dir",
+        help="出力先のディレクトリ(省略時は入力と同じディレクトリに日時付きの名前で出力する)",
+    )
+    reorder.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count() or 1, help="並列に処理するプロセス数"
+    )
+    reorder.set_defaults(func=_reorder)
+
+    diff = subparsers.add_parser(
+        "diff",
+        help="2つのxmlの差分(追加・削除・変更・並び順を揃える最小の移動)を表示する",
+        description="差分が無い場合は0、ある場合は1、読み込みに失敗した場合は2を返す。",
+    )
+    diff.add_argument("base", help="比較元のxml")
+    diff.add_argument("target", help="比較先のxml")
+    diff.add_argument("--summary", action="store_true", help="件数のみ表示する")
+    diff.set_defaults(func=_diff)
+
+    merge = subparsers.add_parser(
+        "merge", help="Gmailから出力し直したxmlを、編集済みのxmlの並び順に並べて出力する"
+    )
+    merge.add_argument("mine", help="並び順を編集済みのxml")
+    merge.add_argument("fresh", help="Gmailから出力し直したxml")
+    merge.add_argument(
+        "-o",
+        "--output",
+        help="出力先のパス(省略時はfreshと同じディレクトリに日時付きの名前で出力する)",
+    )
+    merge.set_defaults(func=_merge)
+
+    replay = subparsers.add_parser(
+        "replay",
+        help="mbox・Maildirの全てのメールをフィルタで判定し、フィルタごとの一致件数を表示する",
+        description="firstはxmlの並び順で最初に一致したメール数。ラベル・日付等の条件を含む"
+        "フィルタは判定できないため?を表示する。",
+    )
+    replay.add_argument("xml", help="Gmailから出力したフィルタのxml")
+    replay.add_argument("mailbox", help="mboxのファイル、またはMaildirのディレクトリ")
+    replay.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count() or 1, help="並列に処理するプロセス数"
+    )
+    replay.add_argument("--summary", action="store_true", help="件数のみ表示する")
+    replay.set_defaults(func=_replay)
+
+    consolidate = subparsers.add_parser(
+        "consolidate",
+        help="fromだけが異なるフィルタを、fromをOR条件にした1件にまとめて出力する",
+        description="まとめたフィルタはグループの一番上の位置に置く。間に処理が矛盾し送信元が"
+        "重なるフィルタがある(優先度が変わる)場合と、条件が長くなりすぎる場合は別のフィルタに分ける。",
+    )
+    consolidate.add_argument("xml", help="Gmailから出力したフィルタのxml")
+    consolidate.add_argument(
+        "-o",
+        "--output",
+        help="出力先のパス(省略時は入力と同じディレクトリに日時付きの名前で出力する)",
+    )
+    consolidate.add_argument(
+        "--max-length",
+        type=int,
+        default=MAX_CRITERIA_LENGTH,
+        help="まとめたfromの値の長さの上限",
+    )
+    consolidate.add_argument(
+        "--dry-run", action="store_true", help="まとめるフィルタを表示し、出力はしない"
+    )
+    consolidate.add_argument("--summary", action="store_true", help="件数のみ表示する")
+    consolidate.set_defaults(func=_consolidate)
+    return parser
+
+
+def main(argv: Union[list[str], None] = None) -> int:
+    args = _create_parser().parse_args(argv)
+    if args.trace is None:
+        return args.func(args)
+
+    TRACER.enable()
+    try:
+        return args.func(args)
+    finally:
+        TRACER.write_chrome_trace(args.trace)
+        print(TRACER.format_summary(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,7 @@
+from app.common.decorator import traced
+from app.common.trace import TRACER
+
+
 class FilterXmlAdjuster:
 
     def __init__(self):
@@ -36,7 +40,9 @@ class FilterXmlAdjuster:
         line = self._add_close_tag(line)
         return line
 
+    @traced
     def minor_adjustment(self, xml_path: str) -> None:
         lines = self._read(xml_path)
         update_lines = [self._update_line(line) for line in lines]
         self._write(xml_path, update_lines)
+        TRACER.add_rows(len(lines))
@@ -1,5 +1,25 @@
+import functools
+
+from app.common.trace import TRACER
+
+
 def override(method):
+    @functools.wraps(method)
     def _override(*args, **kwargs):
-        method(*args, **kwargs)
+        return method(*args, **kwargs)
 
     return _override
+
+
+def traced(method):
+    """TRACERが有効な場合に、メソッドの処理を__qualname__の名前のspanとして記録する"""
+    name = method.__qualname__
+
+    @functools.wraps(method)
+    def _traced(*args, **kwargs):
+        if not TRACER.enabled:
+            return method(*args, **kwargs)
+        with TRACER.span(name):
+            return method(*args, **kwargs)
+
+    return _traced
@@ -0,0 +1,12 @@
+import hashlib
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_content_hash(path: str) -> str:
+    """ファイルの内容のハッシュ値(blake2b, 128bit)を16進数の文字列で返す"""
+    content_hash = hashlib.blake2b(digest_size=16)
+    with open(path, mode="rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            content_hash.update(block)
+    return content_hash.hexdigest()
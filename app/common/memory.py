@@ -0,0 +1,17 @@
+import gc
+from contextlib import contextmanager
+from typing import Iterator
+
+
+@contextmanager
+def paused_gc() -> Iterator[None]:
+    """大量のオブジェクトをまとめて作成する間、循環参照GCを止める
+    (作成中に何度もGCが走り、全オブジェクトを走査するのを避ける)
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
@@ -0,0 +1,233 @@
+"""処理時間の計測(トレース)
+spanで囲んだ処理の経過時間・確保したメモリブロック数・処理した行数を記録し、
+Chrome trace形式のjson(chrome://tracing, https://ui.perfetto.dev で表示できる)と集計表で出力する。
+無効の間(既定)は有効かどうかの確認だけで、記録はしない。
+有効の間はspan1つにつき数μs〜数十μs(メモリブロック数の取得がヒープの大きさに比例する)かかるため、
+1行ごとの処理ではなく、読み込み・描画・操作等の単位で囲む。
+
+環境変数GMAIL_FILTER_TRACEに出力先のパスを指定すると起動時から記録し、終了時に出力する。
+"""
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Union
+
+TRACE_ENV = "GMAIL_FILTER_TRACE"
+# 記録するspanの上限(超えた場合は古いspanから捨てる)
+MAX_SPANS = 1_000_000
+
+
+@dataclass
+class Span:
+    name: str
+    thread_id: int
+    start_ns: int
+    duration_ns: int
+    # 処理中に増えたメモリブロック数(sys.getallocatedblocksの差分。プロセス全体の値)
+    n_blocks: int
+    # 処理した行(entry)数(不明な場合はNone)
+    n_rows: Union[int, None]
+    # 同じスレッドで囲んでいるspanの数
+    depth: int
+
+
+@dataclass
+class SpanStats:
+    name: str
+    count: int
+    total_ns: int
+    max_ns: int
+    n_blocks: int
+    n_rows: Union[int, None]
+
+    @property
+    def mean_ns(self) -> float:
+        return self.total_ns / self.count
+
+
+class _NullSpan:
+    """無効の間にspanの代わりに返す、何もしないspan"""
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def add_rows(self, n_rows: int) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _ActiveSpan:
+    """計測中のspan(終了時にTracerへ記録する)"""
+
+    __slots__ = ("_tracer", "_name", "_stack", "_start_ns", "_start_blocks", "n_rows")
+
+    def __init__(self, tracer: "Tracer", name: str):
+        self._tracer = tracer
+        self._name = name
+        self.n_rows: Union[int, None] = None
+
+    def __enter__(self) -> "_ActiveSpan":
+        self._stack = self._tracer._thread_stack()
+        self._stack.append(self)
+        self._start_blocks = sys.getallocatedblocks()
+        self._start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        end_ns = time.perf_counter_ns()
+        n_blocks = sys.getallocatedblocks() - self._start_blocks
+        # NOTE: ジェネレータ内のspanは、外側のspanより後に終わる場合があるため位置を問わず取り除く
+        self._stack.remove(self)
+        self._tracer._record(
+            Span(
+                self._name,
+                threading.get_ident(),
+                self._start_ns,
+                end_ns - self._start_ns,
+                n_blocks,
+                self.n_rows,
+                len(self._stack),
+            )
+        )
+
+    def add_rows(self, n_rows: int) -> None:
+        self.n_rows = n_rows if self.n_rows is None else self.n_rows + n_rows
+
+
+class Tracer:
+    """spanを記録する(複数スレッドから使用できる)"""
+
+    def __init__(self, max_spans: int = MAX_SPANS):
+        self._enabled = False
+        self._spans: deque[Span] = deque(maxlen=max_spans)
+        self._thread_names: dict[int, str] = {}
+        self._local = threading.local()
+        self._origin_ns = time.perf_counter_ns()
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    @property
+    def spans(self) -> list[Span]:
+        return list(self._spans)
+
+    def enable(self) -> None:
+        self._enabled = True
+
+    def disable(self) -> None:
+        self._enabled = False
+
+    def clear(self) -> None:
+        self._spans.clear()
+        self._origin_ns = time.perf_counter_ns()
+
+    def span(self, name: str) -> Union[_ActiveSpan, _NullSpan]:
+        """withで囲んだ処理を記録するspanを返す(無効の場合は何もしないspanを返す)"""
+        if not self._enabled:
+            return _NULL_SPAN
+        return _ActiveSpan(self, name)
+
+    def add_rows(self, n_rows: int) -> None:
+        """このスレッドで計測中の一番内側のspanに、処理した行数を加える"""
+        if not self._enabled:
+            return
+        stack = self._thread_stack()
+        if stack:
+            stack[-1].add_rows(n_rows)
+
+    def _thread_stack(self) -> list[_ActiveSpan]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+            self._thread_names[threading.get_ident()] = threading.current_thread().name
+        return stack
+
+    def _record(self, span: Span) -> None:
+        self._spans.append(span)
+
+    def summary(self) -> list[SpanStats]:
+        """span名ごとの集計を、合計時間の長い順に返す"""
+        stats: dict[str, SpanStats] = {}
+        for span in self.spans:
+            s = stats.get(span.name)
+            if s is None:
+                s = stats[span.name] = SpanStats(span.name, 0, 0, 0, 0, None)
+            s.count += 1
+            s.total_ns += span.duration_ns
+            s.max_ns = max(s.max_ns, span.duration_ns)
+            s.n_blocks += span.n_blocks
+            if span.n_rows is not None:
+                s.n_rows = span.n_rows + (s.n_rows or 0)
+        return sorted(stats.values(), key=lambda s: s.total_ns, reverse=True)
+
+    def format_summary(self) -> str:
+        """集計表の文字列"""
+        stats = self.summary()
+        width = max((len(s.name) for s in stats), default=4)
+        lines = [
+            f"{'span':<{width}} {'count':>8} {'total ms':>10} {'mean ms':>9} {'max ms':>9}"
+            f" {'rows':>10} {'blocks':>10}"
+        ]
+        for s in stats:
+            n_rows = "-" if s.n_rows is None else s.n_rows
+            lines.append(
+                f"{s.name:<{width}} {s.count:>8} {s.total_ns / 1e6:>10.2f} {s.mean_ns / 1e6:>9.3f}"
+                f" {s.max_ns / 1e6:>9.3f} {n_rows:>10} {s.n_blocks:>10}"
+            )
+        return "\n".join(lines)
+
+    def to_chrome_trace(self) -> dict:
+        """Chrome trace形式(Trace Event Format)のデータ"""
+        pid = os.getpid()
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in list(self._thread_names.items())
+        ]
+        for span in self.spans:
+            args = {"blocks": span.n_blocks}
+            if span.n_rows is not None:
+                args["rows"] = span.n_rows
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": "app",
+                    "ph": "X",
+                    "ts": (span.start_ns - self._origin_ns) / 1000,
+                    "dur": span.duration_ns / 1000,
+                    "pid": pid,
+                    "tid": span.thread_id,
+                    "args": args,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, trace_path: str) -> None:
+        with open(trace_path, mode="w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+
+TRACER = Tracer()
+
+
+def _write_trace_at_exit(trace_path: str) -> None:
+    TRACER.write_chrome_trace(trace_path)
+    print(TRACER.format_summary(), file=sys.stderr)
+
+
+if os.environ.get(TRACE_ENV):
+    TRACER.enable()
+    atexit.register(_write_trace_at_exit, os.environ[TRACE_ENV])
@@ -1,31 +1,197 @@
-from typing import Any
+import sys
+from array import array
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Iterable, Union
+
+from app.common.decorator import traced
+
+DEFAULT_MAX_DEPTH = 1000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# ソート情報(列番号, 昇順/降順)。列番号が-1の場合はソートなし
+SortIndicator = tuple[int, int]
+NO_SORT_INDICATOR: SortIndicator = (-1, 0)
+
+# 操作1件あたりの固定サイズ(インスタンス+属性)の概算値
+OPERATION_BASE_BYTES = 128
+
+
+@dataclass(frozen=True)
+class SwapOperation:
+    """2行の入れ替え操作"""
+
+    source_row: int
+    target_row: int
+
+    @property
+    def nbytes(self) -> int:
+        return OPERATION_BASE_BYTES
+
+    def inverse(self) -> "SwapOperation":
+        return self
+
+    def apply(self, rows: list[Any]) -> None:
+        rows[self.source_row], rows[self.target_row] = rows[self.target_row], rows[self.source_row]
+
+
+@dataclass(frozen=True)
+class MoveOperation:
+    """1行をsource_rowからtarget_rowへ移動する操作"""
+
+    source_row: int
+    target_row: int
+
+    @property
+    def nbytes(self) -> int:
+        return OPERATION_BASE_BYTES
+
+    def inverse(self) -> "MoveOperation":
+        return MoveOperation(self.target_row, self.source_row)
+
+    def apply(self, rows: list[Any]) -> None:
+        rows.insert(self.target_row, rows.pop(self.source_row))
+
+
+@dataclass(frozen=True)
+class PermutationOperation:
+    """並び替え操作
+    order[新しい行番号] = 元の行番号 の整数配列で保持する。
+    ソートによる並び替えの場合は前後のソート情報も保持する。
+    """
+
+    order: array
+    sort_indicator: SortIndicator = NO_SORT_INDICATOR
+    prev_sort_indicator: SortIndicator = NO_SORT_INDICATOR
+
+    @property
+    def nbytes(self) -> int:
+        return OPERATION_BASE_BYTES + sys.getsizeof(self.order)
+
+    def inverse(self) -> "PermutationOperation":
+        inverse_order = array(self.order.typecode, bytes(len(self.order) * self.order.itemsize))
+        for new_row, old_row in enumerate(self.order):
+            inverse_order[old_row] = new_row
+        return PermutationOperation(inverse_order, self.prev_sort_indicator, self.sort_indicator)
+
+    def apply(self, rows: list[Any]) -> None:
+        rows[:] = [rows[old_row] for old_row in self.order]
+
+
+@dataclass(frozen=True)
+class BlockMoveOperation:
+    """複数行(連続していなくてもよい)をまとめて移動する操作
+    source_rows[i]の行をdestination_rows[i]へ移動し、残りの行は元の順で空いた位置に詰める。
+    source_rows・destination_rowsはどちらも昇順で、移動する行同士の順番は変わらない。
+    """
+
+    source_rows: array
+    destination_rows: array
+
+    @classmethod
+    def to_position(cls, rows: Iterable[int], position: int) -> "BlockMoveOperation":
+        """rowsをposition行目から連続して並べる操作を作成する"""
+        source_rows = array("i", sorted(set(rows)))
+        destination_rows = array("i", range(position, position + len(source_rows)))
+        return cls(source_rows, destination_rows)
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            OPERATION_BASE_BYTES
+            + sys.getsizeof(self.source_rows)
+            + sys.getsizeof(self.destination_rows)
+        )
+
+    @property
+    def is_identity(self) -> bool:
+        return self.source_rows == self.destination_rows
+
+    def inverse(self) -> "BlockMoveOperation":
+        return BlockMoveOperation(self.destination_rows, self.source_rows)
+
+    def apply(self, rows: list[Any]) -> None:
+        # NOTE: 行の削除は後ろから、挿入は前から行うことで、行番号を計算し直さずに済む
+        moved = [rows[row] for row in self.source_rows]
+        for row in reversed(self.source_rows):
+            del rows[row]
+        for row, item in zip(self.destination_rows, moved):
+            rows.insert(row, item)
+
+    def permutation(self, n_rows: int) -> array:
+        """order[新しい行番号] = 元の行番号 の整数配列に変換する"""
+        order = list(range(n_rows))
+        self.apply(order)
+        return array("i", order)
+
+
+Operation = Union[SwapOperation, MoveOperation, PermutationOperation, BlockMoveOperation]
 
 
 class CheckPoint:
-    def __init__(self):
-        self._undo_states: list[Any] = []
-        self._redo_states: list[Any] = []
+    """Undo/Redo用の操作履歴
+    テーブル全体のスナップショットではなく、行の入れ替え・移動・並び替えの操作を保持する。
+    履歴の件数(max_depth)・メモリ量(max_bytes)の上限を超えた場合は古い履歴から破棄する。
+    """
+
+    def __init__(
+        self,
+        max_depth: Union[int, None] = DEFAULT_MAX_DEPTH,
+        max_bytes: Union[int, None] = DEFAULT_MAX_BYTES,
+    ):
+        self._undo_operations: deque[Operation] = deque()
+        self._redo_operations: list[Operation] = []
+        self._max_depth = max_depth
+        self._max_bytes = max_bytes
+        self._n_bytes = 0
 
     @property
     def n_undo(self) -> int:
-        return len(self._undo_states)
+        return len(self._undo_operations)
 
     @property
     def n_redo(self) -> int:
-        return len(self._redo_states)
+        return len(self._redo_operations)
+
+    @property
+    def n_bytes(self) -> int:
+        return self._n_bytes
+
+    def _evict(self) -> None:
+        """上限を超えた分の履歴を古いものから破棄する"""
+        while self._undo_operations and (
+            (self._max_depth is not None and self.n_undo > self._max_depth)
+            or (self._max_bytes is not None and self._n_bytes > self._max_bytes)
+        ):
+            self._n_bytes -= self._undo_operations.popleft().nbytes
+
+    def clear(self) -> None:
+        self._undo_operations.clear()
+        self._redo_operations = []
+        self._n_bytes = 0
 
-    def resist_state(self, curr_state: Any) -> None:
-        self._undo_states.append(curr_state)
-        self._redo_states = []
+    @traced
+    def resist_operation(self, operation: Operation) -> None:
+        self._n_bytes -= sum(redo_operation.nbytes for redo_operation in self._redo_operations)
+        self._redo_operations = []
+        self._undo_operations.append(operation)
+        self._n_bytes += operation.nbytes
+        self._evict()
 
-    def undo_state(self, curr_state: Any) -> Any:
+    @traced
+    def undo_operation(self) -> Union[Operation, None]:
+        """Undoで適用する操作(直前の操作の逆操作)を返す"""
         if self.n_undo == 0:
-            return curr_state
-        self._redo_states.append(curr_state)
-        return self._undo_states.pop()
+            return None
+        operation = self._undo_operations.pop()
+        self._redo_operations.append(operation)
+        return operation.inverse()
 
-    def redo_state(self, curr_state: Any) -> Any:
+    @traced
+    def redo_operation(self) -> Union[Operation, None]:
+        """Redoで適用する操作を返す"""
         if self.n_redo == 0:
-            return curr_state
-        self._undo_states.append(curr_state)
-        return self._redo_states.pop()
+            return None
+        operation = self._redo_operations.pop()
+        self._undo_operations.append(operation)
+        return operation
@@ -0,0 +1,274 @@
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from typing import Hashable, Iterable, Sequence, Union
+
+from app.data.filter_data import FilterData
+from app.data.filter_entry import FilterEntry
+from app.data.overlap import (
+    CONFLICTING_ACTIONS,
+    SENDER_PROPERTY_NAME,
+    UNSUPPORTED_PATTERN,
+    domain_of,
+    iter_addresses,
+    normalize_address,
+    parent_domains,
+    parse_actions,
+)
+
+# まとめた条件(fromの値)の長さの上限。Gmailはフィルタの条件が長すぎると保存できないため、
+# 上限の目安(1500文字程度)より短くしておく
+MAX_CRITERIA_LENGTH = 1400
+# 矛盾する処理の組み合わせの向き(上のフィルタの処理, 下のフィルタの処理)
+# 処理の名前の集合namesとother_namesが矛盾するのは、upperがnamesだけに、lowerがother_namesだけに
+# 含まれる向きがある場合(overlap.conflicting_actionsと同じ)
+CONFLICT_DIRECTIONS = tuple(
+    direction
+    for name, other_name in CONFLICTING_ACTIONS
+    for direction in ((name, other_name), (other_name, name))
+)
+
+
+@dataclass(frozen=True)
+class FilterMerge:
+    """1件にまとめたフィルタ"""
+
+    # まとめたentryの行番号(先頭がまとめた後の位置)
+    rows: tuple[int, ...]
+    # まとめた後のfromの値
+    value: str
+
+
+@dataclass
+class ConsolidationPlan:
+    """fromだけが異なるフィルタをまとめた結果"""
+
+    # まとめた後のentry(まとめた後の並び順)
+    entry_list: list[FilterEntry]
+    # まとめる前のentry数
+    n_entries: int
+    merges: list[FilterMerge] = field(default_factory=list)
+    # 間にあるフィルタの優先度が変わるため、上のフィルタにまとめなかったentryの数
+    n_blocked: int = 0
+    # 条件の長さの上限を超えるため、上のフィルタにまとめなかったentryの数
+    n_split: int = 0
+
+    @property
+    def n_removed(self) -> int:
+        return self.n_entries - len(self.entry_list)
+
+
+def merge_key(entry: FilterEntry) -> Hashable:
+    """from以外の条件・処理(まとめられるentryはこれが等しい)"""
+    return entry.category, tuple(
+        sorted((name, value) for name, value in entry.items() if name != SENDER_PROPERTY_NAME)
+    )
+
+
+def _split_senders(entry: FilterEntry) -> Union[dict[str, str], None]:
+    """entryのfromの値を、比較用の表記 -> 元の表記に変換する(まとめられない場合はNone)"""
+    if entry.property_names.count(SENDER_PROPERTY_NAME) != 1:
+        return None
+    value = entry.get(SENDER_PROPERTY_NAME)
+    if value is None or UNSUPPORTED_PATTERN.search(value):
+        return None
+    senders = {}
+    for address in iter_addresses(value):
+        senders.setdefault(normalize_address(address), address)
+    return senders or None
+
+
+def join_senders(senders: Iterable[str]) -> str:
+    """アドレス・ドメインをいずれかに一致するfromの値にする"""
+    return "{" + " ".join(senders) + "}"
+
+
+def _merged_entry(entry: FilterEntry, value: str) -> FilterEntry:
+    """entryのfromの値を置き換えたentry(出力時は元のバイト列を使わない)"""
+    return FilterEntry.from_items(
+        entry.category,
+        entry.title,
+        entry.id,
+        entry.updated,
+        entry.property_names,
+        (value if name == SENDER_PROPERTY_NAME else v for name, v in entry.items()),
+    )
+
+
+class _BlockerIndex:
+    """まとめるentryを上に移動した時に、追い越すと優先度が変わるentryの行番号の索引
+    送信元のアドレス・ドメインごとに行番号を昇順に登録し、区間内にあるかを二分探索で判定する。
+    """
+
+    def __init__(self):
+        # 送信元で絞り込めない(fromを持たない・解析できない)entry
+        self._wildcards = array("i")
+        # アドレス・ドメイン -> そのアドレス・ドメインを条件に持つentry
+        self._exact: dict[str, array] = {}
+        # ドメイン -> そのドメイン(下位のドメインを含む)のアドレス・ドメインを条件に持つentry
+        self._under: dict[str, array] = {}
+
+    def add(self, row: int, senders: Union[Iterable[str], None]) -> None:
+        """行番号の昇順に登録する"""
+        if senders is None:
+            self._wildcards.append(row)
+            return
+        for sender in senders:
+            self._exact.setdefault(sender, array("i")).append(row)
+            for domain in parent_domains(domain_of(sender)):
+                rows = self._under.setdefault(domain, array("i"))
+                if not rows or rows[-1] != row:
+                    rows.append(row)
+
+    @staticmethod
+    def _contains(rows: Union[array, None], start: int, stop: int) -> bool:
+        """rowsにstartより下、stopより上の行があるか"""
+        if not rows:
+            return False
+        index = bisect_right(rows, start)
+        return index < len(rows) and rows[index] < stop
+
+    def blocks(self, senders: Iterable[str], start: int, stop: int) -> bool:
+        """sendersのメールに一致するentryが、startとstopの行の間にあるか"""
+        if self._contains(self._wildcards, start, stop):
+            return True
+        for sender in senders:
+            if self._contains(self._exact.get(sender), start, stop):
+                return True
+            # 送信元を包含する上位のドメインと、送信元のドメインに含まれるアドレス・ドメイン
+            for domain in parent_domains(domain_of(sender)):
+                if self._contains(self._exact.get(domain), start, stop):
+                    return True
+            if "@" not in sender and self._contains(self._under.get(sender), start, stop):
+                return True
+        return False
+
+
+class _Chunk:
+    """1件にまとめるentry"""
+
+    __slots__ = ("rows", "senders", "length")
+
+    def __init__(self, row: int, senders: dict[str, str]):
+        self.rows = [row]
+        self.senders = dict(senders)
+        self.length = len(join_senders(senders.values()))
+
+    def add(self, row: int, senders: dict[str, str], length: int) -> None:
+        self.rows.append(row)
+        self.senders.update(senders)
+        self.length = length
+
+
+def plan_consolidation(
+    entry_list: Sequence[FilterEntry],
+    order: Union[Iterable[int], None] = None,
+    max_length: int = MAX_CRITERIA_LENGTH,
+) -> ConsolidationPlan:
+    """fromだけが異なる(条件・処理が同じ)フィルタを、fromをOR条件にした1件にまとめる
+    order(行番号 -> entry_listのインデックス)を省略した場合はentry_listの順を優先度とする。
+    まとめたフィルタはグループの一番上の位置に置くため、下のentryは上に移動する。
+    間に処理が矛盾し送信元が重なるフィルタがある場合(優先度が変わる場合)と、条件が
+    max_lengthを超える場合は、そのentryから別のフィルタにまとめる。
+    矛盾するentryの索引は矛盾する処理の組み合わせの向きごとに作る(処理の名前の組み合わせの数に
+    よらない)ため、entry数をNとしてO(N log N)で求める。
+    """
+    order = list(range(len(entry_list)) if order is None else order)
+    entries = [entry_list[entry_index] for entry_index in order]
+
+    # 行番号ごとの送信元(比較用の表記)と処理の名前
+    row_senders: list[Union[frozenset[str], None]] = []
+    row_names: list[frozenset[str]] = []
+    candidates: dict[int, dict[str, str]] = {}
+    groups: dict[Hashable, list[int]] = {}
+    for row, entry in enumerate(entries):
+        row_names.append(frozenset(name for name, _ in parse_actions(entry)))
+        senders = _split_senders(entry)
+        if senders is None:
+            row_senders.append(None)
+            continue
+        row_senders.append(frozenset(senders))
+        candidates[row] = senders
+        groups.setdefault(merge_key(entry), []).append(row)
+
+    # 処理の名前の組み合わせ -> entry
+    names_rows: dict[frozenset[str], list[int]] = {}
+    for row, names in enumerate(row_names):
+        names_rows.setdefault(names, []).append(row)
+    # 矛盾する処理の組み合わせの向き -> lowerを持ちupperを持たないentryの索引(使う向きのみ作る)
+    indexes: dict[tuple[str, str], _BlockerIndex] = {}
+
+    def blocker_index(direction: tuple[str, str]) -> _BlockerIndex:
+        index = indexes.get(direction)
+        if index is None:
+            upper, lower = direction
+            index = indexes[direction] = _BlockerIndex()
+            rows = sorted(
+                row
+                for names, other_rows in names_rows.items()
+                if lower in names and upper not in names
+                for row in other_rows
+            )
+            for row in rows:
+                index.add(row, row_senders[row])
+        return index
+
+    def blocker_indexes(names: frozenset[str]) -> list[_BlockerIndex]:
+        """namesの処理と矛盾するentryの索引"""
+        return [
+            blocker_index((upper, lower))
+            for upper, lower in CONFLICT_DIRECTIONS
+            if upper in names and lower not in names
+        ]
+
+    plan = ConsolidationPlan([], len(entries))
+    merged: dict[int, FilterEntry] = {}
+    removed: set[int] = set()
+    for rows in groups.values():
+        if len(rows) < 2:
+            continue
+        indexes_of_group = blocker_indexes(row_names[rows[0]])
+        chunks = [_Chunk(rows[0], candidates[rows[0]])]
+        for row in rows[1:]:
+            chunk = chunks[-1]
+            # NOTE: まとめるフィルタが既に持つ送信元のメールは、同じ処理が既に上で適用されている
+            senders = {
+                sender: address
+                for sender, address in candidates[row].items()
+                if sender not in chunk.senders
+            }
+            length = chunk.length + sum(len(address) + 1 for address in senders.values())
+            if length > max_length:
+                plan.n_split += 1
+            elif senders and any(
+                index.blocks(senders, chunk.rows[0], row) for index in indexes_of_group
+            ):
+                plan.n_blocked += 1
+            else:
+                chunk.add(row, senders, length)
+                continue
+            chunks.append(_Chunk(row, candidates[row]))
+
+        for chunk in chunks:
+            if len(chunk.rows) < 2:
+                continue
+            value = join_senders(chunk.senders.values())
+            top = chunk.rows[0]
+            merged[top] = _merged_entry(entries[top], value)
+            removed.update(chunk.rows[1:])
+            plan.merges.append(FilterMerge(tuple(chunk.rows), value))
+
+    plan.merges.sort(key=lambda merge: merge.rows[0])
+    plan.entry_list = [
+        merged.get(row, entry) for row, entry in enumerate(entries) if row not in removed
+    ]
+    return plan
+
+
+def consolidated_data(filter_data: FilterData, plan: ConsolidationPlan) -> FilterData:
+    """planのentryを、filter_dataのxml(entry以外の要素・読み込み元)で出力するFilterData
+    まとめていないentryは読み込んだxmlのバイト列のまま出力する。
+    """
+    consolidated = filter_data.snapshot(())
+    consolidated.extend_entry_list(plan.entry_list)
+    return consolidated
@@ -0,0 +1,386 @@
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from array import array
+from typing import Iterable, Iterator, Union
+
+from platformdirs import user_data_dir
+
+from app.data.check_point import (
+    BlockMoveOperation,
+    MoveOperation,
+    Operation,
+    PermutationOperation,
+    SwapOperation,
+)
+from app.data.filter_cache import APP_NAME
+from app.data.row_order import RowOrder
+
+JOURNAL_DIRNAME = "journal"
+JOURNAL_EXT = ".journal"
+MAGIC = b"EGFJ"
+# ジャーナルの形式を変更した場合は更新する(古い形式のジャーナルは読み込まない)
+JOURNAL_VERSION = 2
+
+# 前回のfsyncからこの秒数が経過した後の追記でfsyncする
+DEFAULT_SYNC_INTERVAL = 1.0
+# ジャーナルがこのサイズを超えたら、現在の並び順1件に置き換える(compact)
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+BUFFER_SIZE = 64 * 1024
+
+# レコードの種類
+SWAP = 1
+MOVE = 2
+PERMUTATION = 3
+BLOCK_MOVE = 4
+# 直前までの操作を反映した並び順をxmlで出力した印(データ無し)
+EXPORTED = 5
+
+# ヘッダー: マジックナンバー, 形式のバージョン, 行数, xmlのパスのバイト数(この後ろにxmlのパス)
+_HEADER = struct.Struct("<4sHIH")
+# レコード: 種類, データのバイト数, データ, (種類〜データの)CRC32
+_RECORD_HEADER = struct.Struct("<BI")
+_CRC = struct.Struct("<I")
+_PAIR = struct.Struct("<ii")
+_SORT_INDICATORS = struct.Struct("<iiii")
+_INT_SIZE = array("i").itemsize
+
+
+def default_journal_dir() -> str:
+    return os.path.join(user_data_dir(APP_NAME), JOURNAL_DIRNAME)
+
+
+def _path_hash(xml_path: str) -> str:
+    return hashlib.blake2b(os.path.abspath(xml_path).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def journal_path(content_hash: str, xml_path: str, journal_dir: Union[str, None] = None) -> str:
+    """xmlのパスと内容のハッシュ値に対応するジャーナルのパス
+    NOTE: 同じ内容の別のパスのxmlを同時に開いた場合に、同じジャーナルに追記しないようにパスも含める
+    """
+    filename = f"{content_hash}-{_path_hash(xml_path)}{JOURNAL_EXT}"
+    return os.path.join(journal_dir or default_journal_dir(), filename)
+
+
+def _read_header(journal_path: str) -> Union[tuple[int, str, int], None]:
+    """ジャーナルのヘッダーを読み込み、(行数, xmlのパス, ヘッダーのバイト数)を返す
+    別の形式・壊れている場合はNoneを返す。
+    """
+    with open(journal_path, mode="rb") as f:
+        data = f.read(_HEADER.size)
+        if len(data) < _HEADER.size:
+            return None
+        magic, version, n_rows, n_path_bytes = _HEADER.unpack(data)
+        if magic != MAGIC or version != JOURNAL_VERSION:
+            return None
+        path_bytes = f.read(n_path_bytes)
+    if len(path_bytes) < n_path_bytes:
+        return None
+    return n_rows, path_bytes.decode("utf-8", errors="surrogateescape"), _HEADER.size + n_path_bytes
+
+
+def remove_stale_journals(
+    content_hash: str, xml_path: str, journal_dir: Union[str, None] = None
+) -> int:
+    """不要になったジャーナルを削除し、削除した数を返す
+    xml_pathの変更前の内容のジャーナルと、記録したxmlが無くなった(・古い形式の)ジャーナルを削除する。
+    """
+    journal_dir = journal_dir or default_journal_dir()
+    current_path = journal_path(content_hash, xml_path, journal_dir)
+    same_xml_suffix = f"-{_path_hash(xml_path)}{JOURNAL_EXT}"
+    try:
+        filenames = os.listdir(journal_dir)
+    except FileNotFoundError:
+        return 0
+
+    n_removed = 0
+    for filename in filenames:
+        path = os.path.join(journal_dir, filename)
+        if not filename.endswith(JOURNAL_EXT) or path == current_path:
+            continue
+        try:
+            if not filename.endswith(same_xml_suffix):
+                header = _read_header(path)
+                if header is not None and os.path.exists(header[1]):
+                    continue
+            os.remove(path)
+            n_removed += 1
+        except OSError:
+            # NOTE: 別のプロセスが使用中等で削除できないジャーナルは残す
+            pass
+    return n_removed
+
+
+def _int_bytes(values: Iterable[int]) -> bytes:
+    values = array("i", values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _int_array(data: bytes) -> array:
+    values = array("i")
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _encode_record(kind: int, payload: bytes) -> bytes:
+    record = _RECORD_HEADER.pack(kind, len(payload)) + payload
+    return record + _CRC.pack(zlib.crc32(record))
+
+
+def encode_operation(operation: Operation) -> bytes:
+    """操作をジャーナルの1レコードに変換する"""
+    if isinstance(operation, SwapOperation):
+        kind, payload = SWAP, _PAIR.pack(operation.source_row, operation.target_row)
+    elif isinstance(operation, MoveOperation):
+        kind, payload = MOVE, _PAIR.pack(operation.source_row, operation.target_row)
+    elif isinstance(operation, BlockMoveOperation):
+        kind = BLOCK_MOVE
+        payload = _int_bytes(operation.source_rows) + _int_bytes(operation.destination_rows)
+    else:
+        kind = PERMUTATION
+        payload = _SORT_INDICATORS.pack(
+            *operation.sort_indicator, *operation.prev_sort_indicator
+        ) + _int_bytes(operation.order)
+    return _encode_record(kind, payload)
+
+
+def _decode_operation(kind: int, payload: bytes, n_rows: int) -> Union[Operation, None]:
+    """レコードを操作に変換する(行番号が範囲外等、壊れている場合はNone)"""
+    if kind in (SWAP, MOVE):
+        if len(payload) != _PAIR.size:
+            return None
+        source_row, target_row = _PAIR.unpack(payload)
+        if not (0 <= source_row < n_rows and 0 <= target_row < n_rows):
+            return None
+        return (SwapOperation if kind == SWAP else MoveOperation)(source_row, target_row)
+    if kind == BLOCK_MOVE:
+        if len(payload) % (2 * _INT_SIZE):
+            return None
+        rows = _int_array(payload)
+        source_rows, destination_rows = rows[: len(rows) // 2], rows[len(rows) // 2 :]
+        if any(not 0 <= row < n_rows for row in rows):
+            return None
+        return BlockMoveOperation(source_rows, destination_rows)
+    if kind == PERMUTATION:
+        if len(payload) != _SORT_INDICATORS.size + n_rows * _INT_SIZE:
+            return None
+        indicators = _SORT_INDICATORS.unpack_from(payload)
+        order = _int_array(payload[_SORT_INDICATORS.size :])
+        # NOTE: 0〜n_rows-1が1回ずつ現れる場合のみ並び替えとして正しい
+        if sorted(order) != list(range(n_rows)):
+            return None
+        return PermutationOperation(order, indicators[:2], indicators[2:])
+    return None
+
+
+def _iter_records(
+    data: bytes, n_rows: int, position: int
+) -> Iterator[tuple[Union[Operation, None], int]]:
+    """position以降のレコードを順に読み込み、(操作, レコードの終わりの位置)を返す
+    出力済みの印のレコードは、操作の代わりにNoneを返す。
+    書き込み途中で終了した等で壊れたレコードがあれば、その手前で終わる。
+    """
+    while position + _RECORD_HEADER.size <= len(data):
+        kind, n_bytes = _RECORD_HEADER.unpack_from(data, position)
+        end = position + _RECORD_HEADER.size + n_bytes
+        if end + _CRC.size > len(data):
+            return
+        (crc,) = _CRC.unpack_from(data, end)
+        if crc != zlib.crc32(data[position:end]):
+            return
+        if kind == EXPORTED and n_bytes == 0:
+            operation = None
+        else:
+            payload = data[position + _RECORD_HEADER.size : end]
+            operation = _decode_operation(kind, payload, n_rows)
+            if operation is None:
+                return
+        position = end + _CRC.size
+        yield operation, position
+
+
+class EditJournal:
+    """読み込んだxml(のパスと内容)ごとに、行の入れ替え・移動・並び替えの操作を追記するジャーナル
+    異常終了しても、次に同じパス・内容のxmlを開いた時に操作をやり直して並び順を復元できる。
+    追記はバッファに書き込み、前回からsync_interval秒以上経った時とsyncで実際に書き込む(fsync)。
+    サイズがmax_bytesを超えた場合は、compactで現在の並び順1件に置き換える。
+    xmlで出力した場合はmark_exportedで印を付け、それ以降の操作だけを出力していない編集とする。
+    復元にかかる時間はフィルタの数ではなく操作の数に比例する(並び替えの操作を除く)。
+    """
+
+    def __init__(
+        self,
+        journal_path: str,
+        n_rows: int,
+        xml_path: str,
+        sync_interval: float = DEFAULT_SYNC_INTERVAL,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self._path = journal_path
+        self._n_rows = n_rows
+        # NOTE: xmlが無くなった場合にジャーナルを削除できるよう、ヘッダーに記録する
+        self._xml_path = os.path.abspath(xml_path)
+        self._sync_interval = sync_interval
+        self._max_bytes = max_bytes
+        self._recovered: list[Operation] = []
+        # 最後の出力済みの印より前の操作の数
+        self._n_exported = 0
+        self._is_dirty = False
+        self._last_sync = time.monotonic()
+        os.makedirs(os.path.dirname(os.path.abspath(journal_path)), exist_ok=True)
+
+        n_bytes = self._read()
+        if n_bytes is None:
+            # 無い・壊れている・別の形式のジャーナルは作り直す
+            self._write_new(())
+        else:
+            self._file = open(self._path, mode="r+b", buffering=BUFFER_SIZE)
+            # 壊れたレコード以降を切り詰めて、その位置から追記する
+            self._file.truncate(n_bytes)
+            self._file.seek(n_bytes)
+            self._n_bytes = n_bytes
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def n_bytes(self) -> int:
+        return self._n_bytes
+
+    @property
+    def recovered_operations(self) -> list[Operation]:
+        """開いた時にジャーナルに残っていた操作"""
+        return self._recovered
+
+    @property
+    def n_unexported_operations(self) -> int:
+        """開いた時にジャーナルに残っていた操作のうち、最後に出力した後の操作の数"""
+        return len(self._recovered) - self._n_exported
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self._n_bytes > self._max_bytes
+
+    def _read(self) -> Union[int, None]:
+        """ジャーナルを読み込み、有効な部分のバイト数を返す(使えない場合はNone)"""
+        try:
+            header = _read_header(self._path)
+            if header is None or header[0] != self._n_rows:
+                return None
+            with open(self._path, mode="rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        n_bytes = header[2]
+        for operation, n_bytes in _iter_records(data, self._n_rows, n_bytes):
+            if operation is None:
+                self._n_exported = len(self._recovered)
+            else:
+                self._recovered.append(operation)
+        return n_bytes
+
+    def _write_new(self, records: Iterable[bytes]) -> None:
+        """ヘッダーとrecordsだけのジャーナルを一時ファイルに書き込み、置き換えて開き直す"""
+        dirpath = os.path.dirname(os.path.abspath(self._path))
+        fd, tmp_path = tempfile.mkstemp(dir=dirpath, suffix=".tmp")
+        try:
+            with os.fdopen(fd, mode="wb") as f:
+                path_bytes = self._xml_path.encode("utf-8", errors="surrogateescape")
+                f.write(_HEADER.pack(MAGIC, JOURNAL_VERSION, self._n_rows, len(path_bytes)))
+                f.write(path_bytes)
+                for record in records:
+                    f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._file = open(self._path, mode="ab", buffering=BUFFER_SIZE)
+        self._n_bytes = self._file.tell()
+        self._is_dirty = False
+        self._last_sync = time.monotonic()
+
+    def recovered_order(self) -> Union[array, None]:
+        """ジャーナルの操作をxmlの並び順に適用した並び順(操作が無い場合はNone)"""
+        if not self._recovered:
+            return None
+        order = RowOrder(range(self._n_rows))
+        for operation in self._recovered:
+            operation.apply(order)
+        return order.to_array()
+
+    def append(self, operation: Operation) -> None:
+        """操作を追記する"""
+        record = encode_operation(operation)
+        self._file.write(record)
+        self._n_bytes += len(record)
+        self._is_dirty = True
+        if time.monotonic() - self._last_sync >= self._sync_interval:
+            self.sync()
+
+    def sync(self) -> None:
+        """バッファに残っている操作をディスクに書き込む"""
+        if not self._is_dirty:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._is_dirty = False
+        self._last_sync = time.monotonic()
+
+    def _permutation_records(self, order: Iterable[int]) -> list[bytes]:
+        """xmlの並び順からorderにする操作のレコード(xmlの並び順のままの場合は無し)"""
+        order = array("i", order)
+        if order == array("i", range(self._n_rows)):
+            return []
+        return [encode_operation(PermutationOperation(order))]
+
+    def _replace(self, records: Iterable[bytes]) -> None:
+        # NOTE: Windowsでは開いたままのファイルを置き換えられないため、先に閉じる
+        self._file.close()
+        try:
+            self._write_new(records)
+        except OSError:
+            self._file = open(self._path, mode="ab", buffering=BUFFER_SIZE)
+            raise
+
+    def compact(self, order: Union[Iterable[int], None] = None) -> None:
+        """ジャーナルを現在の並び順(orderがNoneの場合はxmlの並び順)の1件に置き換える
+        出力済みの並び順は保持しない(compact後の並び順は全て出力していない編集として扱う)。
+        """
+        self._replace(self._permutation_records(range(self._n_rows) if order is None else order))
+
+    def mark_exported(
+        self, exported_order: Iterable[int], order: Union[Iterable[int], None] = None
+    ) -> None:
+        """exported_orderの並び順をxmlで出力したことを記録する
+        次に開いた時に、出力した並び順までの操作は出力していない編集として扱わない。
+        orderは出力中に編集した場合の現在の並び順(Noneの場合はexported_orderと同じ)。
+        """
+        exported_order = array("i", exported_order)
+        records = self._permutation_records(exported_order)
+        records.append(_encode_record(EXPORTED, b""))
+        if order is not None:
+            # NOTE: 並び替えの操作は適用前の並び順に対する相対的な並び順のため、
+            # 出力した並び順でのそれぞれの行の位置に変換する
+            positions = array("i", [0]) * len(exported_order)
+            for position, index in enumerate(exported_order):
+                positions[index] = position
+            records += self._permutation_records(positions[index] for index in order)
+        self._replace(records)
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self.sync()
+        self._file.close()
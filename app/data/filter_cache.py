@@ -0,0 +1,249 @@
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+from array import array
+from dataclasses import asdict, dataclass
+from typing import NamedTuple, Union
+
+from platformdirs import user_cache_dir
+
+from app.common.file_hash import file_content_hash
+from app.common.memory import paused_gc
+from app.data.filter_data import FilterData, render_entry
+from app.data.filter_entry import FilterEntry
+from app.data.filter_loader import XmlSource
+
+APP_NAME = "edit-gmail-filter-priority"
+CACHE_DIRNAME = "filter_cache"
+INDEX_FILENAME = "index.json"
+CACHE_EXT = ".cache"
+# キャッシュ形式を変更した場合は更新する(古い形式のキャッシュは読み込まない)
+CACHE_VERSION = 4
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# NOTE: 複数のタブのLoadWorkerが別スレッドで同時にindex.jsonを更新するため、
+# 読み込みから書き込みまでを排他する(更新が失われると、管理外のキャッシュが削除されずに残る)
+_index_lock = threading.Lock()
+
+
+class CacheKey(NamedTuple):
+    path: str
+    size: int
+    mtime_ns: int
+    content_hash: str
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    evictions: int = 0
+    n_files: int = 0
+    n_bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        n_lookups = self.hits + self.misses
+        return self.hits / n_lookups if n_lookups else 0.0
+
+
+@dataclass
+class CachedFilterData:
+    filter_data: FilterData
+
+
+class FilterCache:
+    """読み込んだFilterEntryとテーブル表示用の文字列をディスクにキャッシュする
+    キャッシュはxmlの内容のハッシュ値ごとに保存し、パス・サイズ・更新日時が
+    前回と同じ場合はハッシュ値の計算(ファイル全体の読み込み)も省略する。
+    合計サイズがmax_bytesを超えた場合は最後に使われた日時が古いものから削除する。
+    """
+
+    def __init__(self, cache_dir: Union[str, None] = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self._cache_dir = cache_dir or os.path.join(user_cache_dir(APP_NAME), CACHE_DIRNAME)
+        self._max_bytes = max_bytes
+        os.makedirs(self._cache_dir, exist_ok=True)
+
+    @property
+    def cache_dir(self) -> str:
+        return self._cache_dir
+
+    @property
+    def stats(self) -> CacheStats:
+        index = self._read_index()
+        stats = CacheStats(**index["stats"])
+        stats.n_files = len(index["files"])
+        stats.n_bytes = sum(file["n_bytes"] for file in index["files"].values())
+        return stats
+
+    def _index_path(self) -> str:
+        return os.path.join(self._cache_dir, INDEX_FILENAME)
+
+    def _cache_path(self, content_hash: str) -> str:
+        return os.path.join(self._cache_dir, content_hash + CACHE_EXT)
+
+    def _read_index(self) -> dict:
+        """キャッシュの管理情報を読み込む
+        files: ハッシュ値 -> キャッシュのサイズ・最終使用日時
+        paths: xmlのパス -> サイズ・更新日時・ハッシュ値
+        """
+        try:
+            with open(self._index_path(), mode="r", encoding="utf-8") as f:
+                index = json.load(f)
+            if index.get("version") == CACHE_VERSION:
+                return index
+        except (OSError, ValueError):
+            pass
+        return {"version": CACHE_VERSION, "files": {}, "paths": {}, "stats": asdict(CacheStats())}
+
+    def _write_index(self, index: dict) -> None:
+        self._atomic_write(self._index_path(), json.dumps(index).encode("utf-8"))
+
+    def _atomic_write(self, path: str, data: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, mode="wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _count(self, index: dict, name: str, n: int = 1) -> None:
+        index["stats"][name] = index["stats"].get(name, 0) + n
+
+    def make_key(self, filter_xml_path: str) -> CacheKey:
+        """xmlのキャッシュキーを作成する
+        パス・サイズ・更新日時が前回と同じ場合は、前回計算したハッシュ値を使う。
+        """
+        path = os.path.abspath(filter_xml_path)
+        stat = os.stat(path)
+        record = self._read_index()["paths"].get(path)
+        if record and record["size"] == stat.st_size and record["mtime_ns"] == stat.st_mtime_ns:
+            return CacheKey(path, stat.st_size, stat.st_mtime_ns, record["content_hash"])
+
+        return CacheKey(path, stat.st_size, stat.st_mtime_ns, file_content_hash(path))
+
+    def load(self, key: CacheKey) -> Union[CachedFilterData, None]:
+        """キャッシュを読み込む。キャッシュが無い・読み込めない場合はNoneを返す"""
+        cached = None
+        is_broken = False
+        if key.content_hash in self._read_index()["files"]:
+            try:
+                with open(self._cache_path(key.content_hash), mode="rb") as f:
+                    with paused_gc():
+                        cached = self._decode(pickle.load(f), key)
+            except Exception:
+                # NOTE: 途中までしか書き込まれていない・古い形式のpickleは、AttributeError等の
+                # 任意の例外になるため、全て読み込めないキャッシュとして削除し、xmlを読み込み直す
+                is_broken = True
+
+        # NOTE: キャッシュ本体の読み込みは排他せず、index.jsonの更新だけを排他する
+        with _index_lock:
+            index = self._read_index()
+            if is_broken:
+                index["files"].pop(key.content_hash, None)
+                self._remove(key.content_hash)
+            if cached is None or key.content_hash not in index["files"]:
+                self._count(index, "misses")
+            else:
+                self._count(index, "hits")
+                index["files"][key.content_hash]["last_access"] = time.time()
+                index["paths"][key.path] = key._asdict()
+            self._write_index(index)
+        return cached
+
+    def store(self, key: CacheKey, filter_data: FilterData) -> None:
+        """キャッシュを保存し、上限を超えた分を古いものから削除する"""
+        data = pickle.dumps(self._encode(filter_data), protocol=pickle.HIGHEST_PROTOCOL)
+        self._atomic_write(self._cache_path(key.content_hash), data)
+
+        with _index_lock:
+            index = self._read_index()
+            index["files"][key.content_hash] = {"n_bytes": len(data), "last_access": time.time()}
+            index["paths"][key.path] = key._asdict()
+            self._count(index, "stores")
+            self._evict(index)
+            self._write_index(index)
+
+    def clear(self) -> None:
+        """キャッシュを全て削除する"""
+        with _index_lock:
+            index = self._read_index()
+            for content_hash in index["files"]:
+                self._remove(content_hash)
+            self._write_index(
+                {"version": CACHE_VERSION, "files": {}, "paths": {}, "stats": asdict(CacheStats())}
+            )
+
+    def _remove(self, content_hash: str) -> None:
+        try:
+            os.remove(self._cache_path(content_hash))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, index: dict) -> None:
+        """合計サイズがmax_bytesを超えた分を最終使用日時が古いものから削除する"""
+        files = index["files"]
+        n_bytes = sum(file["n_bytes"] for file in files.values())
+        for content_hash in sorted(
+            files, key=lambda content_hash: files[content_hash]["last_access"]
+        ):
+            if n_bytes <= self._max_bytes:
+                break
+            n_bytes -= files.pop(content_hash)["n_bytes"]
+            self._remove(content_hash)
+            self._count(index, "evictions")
+
+        # 削除したキャッシュを参照しているパスの情報も削除する
+        index["paths"] = {
+            path: record
+            for path, record in index["paths"].items()
+            if record["content_hash"] in files
+        }
+
+    def _encode(self, filter_data: FilterData) -> tuple:
+        """FilterDataを組み込み型のみのタプルに変換する(pickleを小さく・速くするため)"""
+        root = None if filter_data.tree is None else filter_data.tree.getroot()
+        header = b"" if root is None else ET.tostring(root, encoding="utf-8")
+        entries = [
+            (
+                entry.category,
+                entry.title,
+                entry.id,
+                entry.updated,
+                # NOTE: 名前のタプルはentry間で共有しているため、pickleでは1回だけ保存される
+                entry.property_names,
+                entry.property_values,
+                render_entry(entry),
+                entry.source_index,
+            )
+            for entry in filter_data.entry_list
+        ]
+        # NOTE: entryのバイト範囲はxmlの内容だけで決まるため、同じ内容の別のパスでも使える
+        spans = None if filter_data.source is None else filter_data.source.spans.tobytes()
+        return (CACHE_VERSION, header, entries, spans)
+
+    def _decode(self, data: tuple, key: CacheKey) -> Union[CachedFilterData, None]:
+        version, header, entries, spans = data
+        if version != CACHE_VERSION:
+            return None
+        filter_data = FilterData()
+        if header:
+            filter_data.tree = ET.ElementTree(ET.fromstring(header))
+        if spans is not None:
+            filter_data.source = XmlSource(key.path, key.size, key.mtime_ns, array("q", spans))
+        entry_list = []
+        for category, title, id, updated, names, values, render_cache, source_index in entries:
+            entry = FilterEntry.from_items(category, title, id, updated, names, values)
+            entry.render_cache = render_cache
+            entry.source_index = source_index
+            entry_list.append(entry)
+        filter_data.extend_entry_list(entry_list)
+        return CachedFilterData(filter_data)
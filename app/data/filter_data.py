@@ -1,136 +1,156 @@
+import copy
 import xml.etree.ElementTree as ET
-from dataclasses import dataclass
-from typing import Union
+from typing import Iterable, Iterator, Union
 
+from app.common.decorator import traced
+from app.common.trace import TRACER
 from app.common.xml import XML
-
-
-@dataclass
-class FilterProperty:
-    name: str
-    value: str
-
-
-@dataclass
-class FilterEntry:
-    category: str
-    title: str
-    id: str
-    updated: str
-    property: list[FilterProperty]
+from app.data.filter_entry import FilterEntry, FilterProperty
+from app.data.filter_loader import (
+    ATOM_SYNDICATION_FORMAT_URL,
+    CHUNK_SIZE,
+    GOOGLE_SCHEMA_URL,
+    FilterEntryLoader,
+    XmlSource,
+)
+from app.data.filter_writer import FilterXmlWriter
+
+
+def _condition_string(name: str, value: str) -> str:
+    return f"{name}:({value})"
+
+
+def _others_string(name: str, value: str) -> str:
+    return f"{name}:{"{"}{value}{"}"}"
+
+
+def render_entry(entry: FilterEntry) -> tuple[str, str, str]:
+    """entryの条件・ラベル・処理をテーブル表示用の文字列に変換する(結果はentryにキャッシュする)"""
+    if entry.render_cache is not None:
+        return entry.render_cache
+    conditions = []
+    label = "-"
+    others = []
+    for name, value in entry.items():
+        if name in ["from", "subject"]:
+            conditions.append(_condition_string(name, value))
+        elif name == "label":
+            label = value
+        elif name not in ["sizeOperator", "sizeUnit"]:
+            others.append(_others_string(name, value))
+    condition = ", ".join(conditions) if conditions else "-"
+    process = ", ".join(others) if others else "-"
+    entry.render_cache = (condition, label, process)
+    return entry.render_cache
 
 
 class FilterData(XML):
 
-    ATOM_SYNDICATION_FORMAT_URL = "http://www.w3.org/2005/Atom"
-    GOOGLE_SCHEMA_URL = "http://schemas.google.com/apps/2006"
+    ATOM_SYNDICATION_FORMAT_URL = ATOM_SYNDICATION_FORMAT_URL
+    GOOGLE_SCHEMA_URL = GOOGLE_SCHEMA_URL
 
     def __init__(self, filter_xml_path: Union[str, None] = None):
-        super().__init__(filter_xml_path)
-        self._entry_list = [] if filter_xml_path is None else self._get_entry_list()
+        super().__init__()
+        self._entry_list: list[FilterEntry] = []
+        # entryの読み込み元のxml(出力時に元のバイト列をコピーする)
+        self._source: Union[XmlSource, None] = None
         ET.register_namespace("", self.ATOM_SYNDICATION_FORMAT_URL)
         ET.register_namespace("apps", self.GOOGLE_SCHEMA_URL)
+        if filter_xml_path:
+            self.import_xml(filter_xml_path)
 
     @property
     def entry_list(self) -> list[FilterEntry]:
         return self._entry_list
 
-    def _get_entry_list(self) -> list[FilterEntry]:
-        root = self._tree.getroot()
-        entry_list = []
-        for entry in root.findall(f"{"{"}{self.ATOM_SYNDICATION_FORMAT_URL}{"}"}entry"):
-            category = entry.find(f"{"{"}{self.ATOM_SYNDICATION_FORMAT_URL}{"}"}category").attrib[
-                "term"
-            ]
-            title = entry.find(f"{"{"}{self.ATOM_SYNDICATION_FORMAT_URL}{"}"}title").text
-            id = entry.find(f"{"{"}{self.ATOM_SYNDICATION_FORMAT_URL}{"}"}id").text
-            updated = entry.find(f"{"{"}{self.ATOM_SYNDICATION_FORMAT_URL}{"}"}updated").text
-
-            property_list = []
-            for prop in entry.findall(f"{"{"}{self.GOOGLE_SCHEMA_URL}{"}"}property"):
-                name = prop.get("name")
-                value = prop.get("value")
-                property_list.append(FilterProperty(name, value))
-
-            entry_list.append(FilterEntry(category, title, id, updated, property_list))
-
-        return entry_list
-
-    def _update_entry_tree(self) -> None:
-        """xml treeのentryの要素を更新する"""
-
-        def append_entry_sub_element(elem, tag, value="", namespace=None, attributes={}):
-            sub_elem = (
-                ET.SubElement(elem, tag)
-                if namespace is None
-                else ET.SubElement(elem, f"{"{"}{self.GOOGLE_SCHEMA_URL}{"}"}{tag}")
-            )
-            sub_elem.text = value
-            for key, value in attributes.items():
-                sub_elem.set(key, value)
-
-        def append_entry_element(root, entry):
-            elem = ET.SubElement(root, "entry")
-            append_entry_sub_element(elem, "category", attributes={"term": entry.category})
-            append_entry_sub_element(elem, "title", entry.title)
-            append_entry_sub_element(elem, "id", entry.id)
-            append_entry_sub_element(elem, "updated", entry.updated)
-            append_entry_sub_element(elem, "content")
-            for property in entry.property:
-                append_entry_sub_element(
-                    elem,
-                    "property",
-                    namespace=self.GOOGLE_SCHEMA_URL,
-                    attributes={"name": property.name, "value": property.value},
-                )
-
-        # entry要素を全削除する
-        root = self._tree.getroot()
-        for entry in root.findall(f"{"{"}{self.ATOM_SYNDICATION_FORMAT_URL}{"}"}entry"):
-            root.remove(entry)
-        # entry_listからentry要素を作成する
-        for entry in self._entry_list:
-            append_entry_element(root, entry)
-
-    def to_table_data(self) -> list[list[str]]:
-        def condition_string(name, value):
-            return f"{name}:({value})"
-
-        def others_string(name, value):
-            return f"{name}:{"{"}{value}{"}"}"
-
-        def get_property_data(properties):
-            conditions = []
-            label = "-"
-            others = []
-            for property in properties:
-                if property.name in ["from", "subject"]:
-                    conditions.append(condition_string(property.name, property.value))
-                elif property.name == "label":
-                    label = property.value
-                elif property.name not in ["sizeOperator", "sizeUnit"]:
-                    others.append(others_string(property.name, property.value))
-            condition = ", ".join(conditions) if conditions else "-"
-            process = ", ".join(others) if others else "-"
-            return condition, label, process
-
-        table_data = []
-        for idx, entry in enumerate(self._entry_list):
-            condition, label, process = get_property_data(entry.property)
-            table_data.append([str(idx + 1), entry.category, condition, label, process])
-
+    @property
+    def source(self) -> Union[XmlSource, None]:
+        return self._source
+
+    @source.setter
+    def source(self, source: Union[XmlSource, None]) -> None:
+        """entryのsource_indexが指す読み込み元のxmlを設定する"""
+        self._source = source
+
+    def table_row(self, index: int) -> list[str]:
+        """entry_list[index]をテーブル表示用の文字列に変換する
+        優先度(entry_listの位置)以外の文字列はentryごとにキャッシュし、並び替えでは作り直さない。
+        """
+        entry = self._entry_list[index]
+        return [str(index + 1), entry.category, *render_entry(entry)]
+
+    @traced
+    def to_table_data(self, start: int = 0, stop: Union[int, None] = None) -> list[list[str]]:
+        """entry_list[start:stop]をテーブル表示用の文字列に変換する"""
+        table_data = [self.table_row(idx) for idx in range(len(self._entry_list))[start:stop]]
+        TRACER.add_rows(len(table_data))
         return table_data
 
-    def sort_entry_list(self, index_list: list[int]) -> None:
-        entry_list = []
-        for idx in index_list:
-            entry_list.append(self._entry_list[idx])
-        self._entry_list = [entry for entry in entry_list]
+    def sort_entry_list(self, index_list: Iterable[int]) -> None:
+        """entry_listをindex_list(FilterSorter.sorted_index_list等)の順に並び替える"""
+        self._entry_list = [self._entry_list[idx] for idx in index_list]
 
+    @traced
     def import_xml(self, filter_xml_path: str) -> None:
-        self.read(filter_xml_path)
-        self._entry_list = self._get_entry_list()
-
-    def export_xml(self, filter_xml_path: str) -> None:
-        self._update_entry_tree()
-        self.write(filter_xml_path)
+        for _ in self.iter_import_xml(filter_xml_path):
+            pass
+        TRACER.add_rows(len(self._entry_list))
+
+    def iter_import_xml(
+        self, filter_xml_path: str, chunk_size: int = CHUNK_SIZE
+    ) -> Iterator[list[FilterEntry]]:
+        """xmlを逐次読み込み、entry_listに追加したentryをチャンク単位で返す
+        テーブルへのデータ投入をチャンク単位で行う場合に使用する。
+        """
+        loader = FilterEntryLoader(filter_xml_path)
+        self._entry_list = []
+        self._source = None
+        for chunk in loader.iter_chunk(chunk_size):
+            self._entry_list.extend(chunk)
+            yield chunk
+        # entry以外の要素(title, id, author等)のみ残ったtreeを保持する
+        self._tree = ET.ElementTree(loader.root)
+        self._source = loader.source
+
+    def extend_entry_list(self, entry_list: Iterable[FilterEntry]) -> None:
+        """entryを末尾に追加する(別スレッドで読み込んだentryの追加用)"""
+        self._entry_list.extend(entry_list)
+
+    def snapshot(self, index_list: Union[Iterable[int], None] = None) -> "FilterData":
+        """現在の内容(index_listを指定した場合はその並び順)の複製を作成する
+        entryは共有し、entry_listとxml treeのみ複製する。
+        """
+        filter_data = FilterData()
+        if self._tree is not None:
+            filter_data.tree = copy.deepcopy(self._tree)
+        filter_data.source = self._source
+        filter_data.extend_entry_list(
+            self._entry_list
+            if index_list is None
+            else (self._entry_list[idx] for idx in index_list)
+        )
+        return filter_data
+
+    def iter_export_xml(
+        self, filter_xml_path: str, index_list: Union[Iterable[int], None] = None
+    ) -> Iterator[int]:
+        """entry_listをxmlで出力し、出力済みのentry数を一定件数ごとに返す
+        読み込み元のxmlが変更されていなければ、変更の無いentryは元のバイト列をコピーする。
+        """
+        root = None if self._tree is None else self._tree.getroot()
+        entry_list = (
+            self._entry_list
+            if index_list is None
+            else (self._entry_list[idx] for idx in index_list)
+        )
+        return FilterXmlWriter(root, self._source).iter_write(filter_xml_path, entry_list)
+
+    @traced
+    def export_xml(
+        self, filter_xml_path: str, index_list: Union[Iterable[int], None] = None
+    ) -> None:
+        """entry_listをxmlで出力する
+        index_listを指定した場合は、entry_listを変更せずにその並び順で出力する。
+        """
+        for _ in self.iter_export_xml(filter_xml_path, index_list):
+            pass
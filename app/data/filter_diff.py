@@ -0,0 +1,219 @@
+import time
+from bisect import bisect_left
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Hashable, Sequence, Union
+
+from app.data.filter_data import FilterData
+from app.data.filter_entry import FilterEntry
+from app.data.filter_writer import export_xml_path
+
+
+@dataclass(frozen=True)
+class EntryMove:
+    """並び順を揃えるための1件の移動(targetのentry_listのインデックスで表す)"""
+
+    index: int
+    # この直後に移動する(Noneの場合は先頭に移動する)
+    after: Union[int, None]
+
+
+@dataclass
+class FilterDiff:
+    """2つのフィルタのxml(base -> target)の差分
+    インデックスはbase/targetそれぞれのentry_listのインデックス。
+    """
+
+    # targetにだけあるentry
+    added: list[int] = field(default_factory=list)
+    # baseにだけあるentry
+    removed: list[int] = field(default_factory=list)
+    # 対応するentryの組(base, target)。targetの順に並べる
+    matched: list[tuple[int, int]] = field(default_factory=list)
+    # 対応するが条件・処理が変わったentryの組(base, target)
+    changed: list[tuple[int, int]] = field(default_factory=list)
+    # 対応するentryの並び順をbaseからtargetに揃える最小の移動(targetの順に適用する)
+    moves: list[EntryMove] = field(default_factory=list)
+
+    @property
+    def is_same(self) -> bool:
+        return not (self.added or self.removed or self.changed or self.moves)
+
+
+@dataclass
+class MergeResult:
+    mine_path: str
+    fresh_path: str
+    output_path: str
+    n_entries: int
+    # freshにだけあり、前のentryの直後に並べたentryの数
+    n_added: int
+    # mineにだけあり、出力しなかったentryの数
+    n_removed: int
+    load_time: float
+    merge_time: float
+    export_time: float
+
+    @property
+    def total_time(self) -> float:
+        return self.load_time + self.merge_time + self.export_time
+
+
+def content_key(entry: FilterEntry) -> Hashable:
+    """idが変わった(作り直した)フィルタを対応付けるための、条件・処理の内容"""
+    return entry.category, entry.property_names, entry.property_values
+
+
+def match_entries(
+    base: Sequence[FilterEntry], target: Sequence[FilterEntry]
+) -> list[tuple[int, int]]:
+    """baseとtargetのentryを対応付け、(base, target)の組をtargetの順に返す
+    idが同じentryを対応付け、残りは条件・処理が同じentryを先頭から順に対応付ける。
+    """
+    base_ids: dict[str, int] = {}
+    for index, entry in enumerate(base):
+        base_ids.setdefault(entry.id, index)
+    pairs: list[Union[int, None]] = [None] * len(target)
+    used = bytearray(len(base))
+    for index, entry in enumerate(target):
+        base_index = base_ids.get(entry.id)
+        if base_index is not None and not used[base_index]:
+            used[base_index] = 1
+            pairs[index] = base_index
+
+    # idで対応付かなかったentryは内容で対応付ける
+    base_contents: dict[Hashable, deque[int]] = {}
+    for index, entry in enumerate(base):
+        if not used[index]:
+            base_contents.setdefault(content_key(entry), deque()).append(index)
+    if base_contents:
+        for index, entry in enumerate(target):
+            if pairs[index] is None:
+                candidates = base_contents.get(content_key(entry))
+                if candidates:
+                    pairs[index] = candidates.popleft()
+    return [(base_index, index) for index, base_index in enumerate(pairs) if base_index is not None]
+
+
+def longest_increasing_subsequence(values: Sequence[int]) -> list[int]:
+    """狭義単調増加な最長部分列の位置(valuesのインデックス)を返す(O(n log n))"""
+    # tails[k]: 長さk+1の増加部分列の末尾の値が最小となる位置
+    tails: list[int] = []
+    tail_values: list[int] = []
+    previous = [-1] * len(values)
+    for i, value in enumerate(values):
+        k = bisect_left(tail_values, value)
+        if k > 0:
+            previous[i] = tails[k - 1]
+        if k == len(tails):
+            tails.append(i)
+            tail_values.append(value)
+        else:
+            tails[k] = i
+            tail_values[k] = value
+
+    result = []
+    i = tails[-1] if tails else -1
+    while i >= 0:
+        result.append(i)
+        i = previous[i]
+    result.reverse()
+    return result
+
+
+def diff_entries(base: Sequence[FilterEntry], target: Sequence[FilterEntry]) -> FilterDiff:
+    """baseからtargetへの差分を求める
+    移動は、対応するentryをtargetの順に並べた時のbaseでの位置の最長増加部分列(動かさなくてよい
+    entry)以外のentryとし、最小の移動数になる。
+    """
+    matched = match_entries(base, target)
+    base_matched = bytearray(len(base))
+    target_matched = bytearray(len(target))
+    for base_index, target_index in matched:
+        base_matched[base_index] = 1
+        target_matched[target_index] = 1
+
+    diff = FilterDiff(
+        added=[index for index in range(len(target)) if not target_matched[index]],
+        removed=[index for index in range(len(base)) if not base_matched[index]],
+        matched=matched,
+        changed=[
+            (base_index, target_index)
+            for base_index, target_index in matched
+            if content_key(base[base_index]) != content_key(target[target_index])
+        ],
+    )
+
+    stays = bytearray(len(matched))
+    for i in longest_increasing_subsequence([base_index for base_index, _ in matched]):
+        stays[i] = 1
+    previous_index = None
+    for i, (_, target_index) in enumerate(matched):
+        if not stays[i]:
+            diff.moves.append(EntryMove(target_index, previous_index))
+        previous_index = target_index
+    return diff
+
+
+def merge_order(mine: Sequence[FilterEntry], fresh: Sequence[FilterEntry]) -> tuple[list[int], int]:
+    """freshのentryをmineの並び順に並べたインデックスと、対応付いたentryの数を返す
+    freshにだけあるentryは、freshでの直前のentryの直後(直前が無い場合は先頭)に並べ、
+    mineにだけあるentryは含めない。
+    """
+    matched = match_entries(fresh, mine)
+    # mineの順に並んだfreshのインデックス
+    ordered = [fresh_index for fresh_index, _ in matched]
+    is_matched = bytearray(len(fresh))
+    for fresh_index in ordered:
+        is_matched[fresh_index] = 1
+
+    # freshにだけあるentryを、直前の対応するentryごとにまとめる
+    followers: dict[Union[int, None], list[int]] = {}
+    previous_index = None
+    for fresh_index in range(len(fresh)):
+        if is_matched[fresh_index]:
+            previous_index = fresh_index
+        else:
+            followers.setdefault(previous_index, []).append(fresh_index)
+
+    index_list = list(followers.get(None, ()))
+    for fresh_index in ordered:
+        index_list.append(fresh_index)
+        index_list.extend(followers.get(fresh_index, ()))
+    return index_list, len(ordered)
+
+
+def diff_xml(base_path: str, target_path: str) -> tuple[FilterData, FilterData, FilterDiff]:
+    """2つのxmlを読み込んで差分を求める"""
+    base = FilterData(base_path)
+    target = FilterData(target_path)
+    return base, target, diff_entries(base.entry_list, target.entry_list)
+
+
+def merge_xml(mine_path: str, fresh_path: str, output_path: Union[str, None] = None) -> MergeResult:
+    """freshのxmlをmineのxmlの並び順に並べて出力する
+    output_pathを省略した場合は、Viewerと同じ名前規則でfreshと同じディレクトリに出力する。
+    """
+    if output_path is None:
+        output_path = export_xml_path(fresh_path)
+
+    start = time.perf_counter()
+    mine = FilterData(mine_path)
+    fresh = FilterData(fresh_path)
+    loaded = time.perf_counter()
+    index_list, n_matched = merge_order(mine.entry_list, fresh.entry_list)
+    merged = time.perf_counter()
+    fresh.export_xml(output_path, index_list)
+    exported = time.perf_counter()
+
+    return MergeResult(
+        mine_path,
+        fresh_path,
+        output_path,
+        len(index_list),
+        len(fresh.entry_list) - n_matched,
+        len(mine.entry_list) - n_matched,
+        loaded - start,
+        merged - loaded,
+        exported - merged,
+    )
@@ -0,0 +1,235 @@
+import sys
+import threading
+from typing import Any, Iterable, Iterator, Union
+
+# Gmailのフィルタで使われるプロパティ名(先に登録してコードを固定しておく)
+PROPERTY_NAMES = [
+    "from",
+    "to",
+    "subject",
+    "hasTheWord",
+    "doesNotHaveTheWord",
+    "hasAttachment",
+    "excludeChats",
+    "size",
+    "sizeOperator",
+    "sizeUnit",
+    "label",
+    "shouldArchive",
+    "shouldMarkAsRead",
+    "shouldStar",
+    "shouldTrash",
+    "shouldNeverSpam",
+    "shouldAlwaysMarkAsImportant",
+    "shouldNeverMarkAsImportant",
+    "smartLabelToApply",
+    "forwardTo",
+]
+
+# 値の種類が少ない(ラベル名・true等)ため、値の文字列を全entryで共有するプロパティ名
+# NOTE: sys.internした文字列はPython 3.12以降では解放されないため、from・subject等の
+# entryごとに異なる値は共有しない(共有するとxmlを閉じてもメモリが解放されない)
+SHARED_VALUE_PROPERTY_NAMES = {
+    "hasAttachment",
+    "excludeChats",
+    "sizeOperator",
+    "sizeUnit",
+    "label",
+    "shouldArchive",
+    "shouldMarkAsRead",
+    "shouldStar",
+    "shouldTrash",
+    "shouldNeverSpam",
+    "shouldAlwaysMarkAsImportant",
+    "shouldNeverMarkAsImportant",
+    "smartLabelToApply",
+}
+
+_property_codes: dict[str, int] = {}
+_property_names: list[str] = []
+# NOTE: 別スレッドでの読み込み中にも登録されるため、登録処理のみ排他する
+_register_lock = threading.Lock()
+
+
+def property_code(name: str) -> int:
+    """プロパティ名を整数コードに変換する(未登録の名前は新しく登録する)"""
+    code = _property_codes.get(name)
+    if code is None:
+        with _register_lock:
+            code = _property_codes.get(name)
+            if code is None:
+                code = len(_property_names)
+                name = sys.intern(name)
+                _property_names.append(name)
+                _property_codes[name] = code
+    return code
+
+
+def property_name(code: int) -> str:
+    return _property_names[code]
+
+
+for _name in PROPERTY_NAMES:
+    property_code(_name)
+
+
+def _intern(value: Union[str, None]) -> Union[str, None]:
+    return None if value is None else sys.intern(value)
+
+
+class PropertyLayout:
+    """entryが持つプロパティ名の並び
+    同じ並びのentryで1つのインスタンスを共有し、名前から値の位置をO(1)で引けるようにする。
+    """
+
+    __slots__ = ("codes", "names", "shared_positions", "_positions")
+
+    _layouts: dict[tuple[str, ...], "PropertyLayout"] = {}
+
+    def __init__(self, names: tuple[str, ...]):
+        self.codes = tuple(property_code(name) for name in names)
+        self.names = tuple(property_name(code) for code in self.codes)
+        # 値の文字列を共有するプロパティの位置
+        self.shared_positions = tuple(
+            position
+            for position, name in enumerate(self.names)
+            if name in SHARED_VALUE_PROPERTY_NAMES
+        )
+        self._positions: dict[str, int] = {}
+        for position, name in enumerate(self.names):
+            self._positions.setdefault(name, position)
+
+    @classmethod
+    def get(cls, names: tuple[str, ...]) -> "PropertyLayout":
+        layout = cls._layouts.get(names)
+        if layout is None:
+            with _register_lock:
+                layout = cls._layouts.get(names)
+                if layout is None:
+                    layout = cls._layouts[names] = PropertyLayout(names)
+        return layout
+
+    def position(self, name: str) -> Union[int, None]:
+        return self._positions.get(name)
+
+
+class FilterProperty:
+    __slots__ = ("name", "value")
+
+    def __init__(self, name: str, value: str):
+        self.name = name
+        self.value = value
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, FilterProperty):
+            return NotImplemented
+        return (self.name, self.value) == (other.name, other.value)
+
+    def __repr__(self) -> str:
+        return f"FilterProperty(name={self.name!r}, value={self.value!r})"
+
+
+class FilterEntry:
+    """フィルタ1件分のデータ
+    プロパティはFilterPropertyのリストではなく、共有のPropertyLayoutと値のタプルで保持する。
+    propertyはその都度作成するビューのため、変更する場合はリストごと代入する。
+    render_cacheはテーブル表示用の文字列のキャッシュで、プロパティを変更すると破棄される。
+    source_indexは読み込み元のxml(XmlSource)でのentryの位置で、プロパティを変更すると破棄される
+    (Noneのentryは元のバイト列を使わずに出力し直す)。
+    """
+
+    __slots__ = (
+        "category",
+        "title",
+        "id",
+        "updated",
+        "_layout",
+        "_values",
+        "render_cache",
+        "source_index",
+    )
+
+    def __init__(
+        self, category: str, title: str, id: str, updated: str, property: list[FilterProperty]
+    ):
+        self._set_fields(category, title, id, updated)
+        self.property = property
+
+    @classmethod
+    def from_items(
+        cls,
+        category: str,
+        title: str,
+        id: str,
+        updated: str,
+        names: Iterable[str],
+        values: Iterable[str],
+    ) -> "FilterEntry":
+        """プロパティ名と値の並びから作成する(FilterPropertyを経由しない)"""
+        entry = cls.__new__(cls)
+        entry._set_fields(category, title, id, updated)
+        entry._set_items(tuple(names), tuple(values))
+        return entry
+
+    def _set_fields(self, category: str, title: str, id: str, updated: str) -> None:
+        # NOTE: category・titleは全entryで共通のため、文字列を共有する
+        # (updatedはxmlごとに異なるため、同じxml内での共有は読み込む側で行う)
+        self.category = _intern(category)
+        self.title = _intern(title)
+        self.id = id
+        self.updated = updated
+
+    def _set_items(self, names: tuple[str, ...], values: tuple[str, ...]) -> None:
+        self._layout = PropertyLayout.get(names)
+        if self._layout.shared_positions:
+            values = list(values)
+            for position in self._layout.shared_positions:
+                values[position] = _intern(values[position])
+        self._values = tuple(values)
+        self.render_cache: Union[tuple[str, ...], None] = None
+        self.source_index: Union[int, None] = None
+
+    @property
+    def property_names(self) -> tuple[str, ...]:
+        return self._layout.names
+
+    @property
+    def property_values(self) -> tuple[str, ...]:
+        return self._values
+
+    @property
+    def property(self) -> list[FilterProperty]:
+        return [FilterProperty(name, value) for name, value in self.items()]
+
+    @property.setter
+    def property(self, property: list[FilterProperty]) -> None:
+        self._set_items(tuple(p.name for p in property), tuple(p.value for p in property))
+
+    def items(self) -> Iterator[tuple[str, str]]:
+        """(プロパティ名, 値)を順に返す"""
+        return zip(self._layout.names, self._values)
+
+    def get(self, name: str, default: Union[str, None] = None) -> Union[str, None]:
+        """指定した名前のプロパティの値を返す"""
+        position = self._layout.position(name)
+        return default if position is None else self._values[position]
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, FilterEntry):
+            return NotImplemented
+        return (
+            self.category == other.category
+            and self.title == other.title
+            and self.id == other.id
+            and self.updated == other.updated
+            and self._layout.names == other._layout.names
+            and self._values == other._values
+        )
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return (
+            f"FilterEntry(category={self.category!r}, title={self.title!r}, id={self.id!r}, "
+            f"updated={self.updated!r}, property={self.property!r})"
+        )
@@ -0,0 +1,235 @@
+import mmap
+import os
+import re
+import xml.etree.ElementTree as ET
+from array import array
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, Union
+
+from app.data.filter_entry import FilterEntry
+
+ATOM_SYNDICATION_FORMAT_URL = "http://www.w3.org/2005/Atom"
+GOOGLE_SCHEMA_URL = "http://schemas.google.com/apps/2006"
+
+# 名前空間付きのタグ名(entryごとに組み立て直さないよう事前に作成しておく)
+ENTRY_TAG = f"{{{ATOM_SYNDICATION_FORMAT_URL}}}entry"
+CATEGORY_TAG = f"{{{ATOM_SYNDICATION_FORMAT_URL}}}category"
+TITLE_TAG = f"{{{ATOM_SYNDICATION_FORMAT_URL}}}title"
+ID_TAG = f"{{{ATOM_SYNDICATION_FORMAT_URL}}}id"
+UPDATED_TAG = f"{{{ATOM_SYNDICATION_FORMAT_URL}}}updated"
+PROPERTY_TAG = f"{{{GOOGLE_SCHEMA_URL}}}property"
+
+CHUNK_SIZE = 1000
+
+# xmlの概要を取得する時の読み込み単位と、feedの情報を探す範囲
+SCAN_BLOCK_SIZE = 1 << 20
+SCAN_HEADER_SIZE = 4096
+ENTRY_START_TAGS = (b"<entry>", b"<entry ")
+FEED_UPDATED_PATTERN = re.compile(rb"<updated>([^<]*)</updated>")
+
+# entryの開始タグと終了タグ(行末の改行を含む)
+ENTRY_TAG_PATTERN = re.compile(rb"<entry[\s>]|</entry\s*>(?:[ \t]*\r?\n)?")
+INDENT_BYTES = b" \t"
+XML_ENCODING_PATTERN = re.compile(rb"^(?:\xef\xbb\xbf)?<\?xml[^>]*encoding=['\"]([^'\"]+)")
+UTF8_ENCODINGS = (b"utf-8", b"utf8")
+
+
+@dataclass
+class FilterXmlSummary:
+    """xmlを解析せずに取得したxmlの概要"""
+
+    n_entries: int
+    updated: Union[str, None]
+
+
+def scan_filter_xml(filter_xml_path: str) -> FilterXmlSummary:
+    """xmlをXMLとして解析せずに、entry数とfeedの更新日時を取得する
+    バイト列のままentry開始タグを数えるため、全体を解析するより大幅に速い。
+    """
+    n_entries = 0
+    updated = None
+    overlap = max(len(tag) for tag in ENTRY_START_TAGS) - 1
+    with open(filter_xml_path, mode="rb") as f:
+        header = f.read(SCAN_HEADER_SIZE)
+        # feed直下のupdated(最初のentryより前にあるもの)を取得する
+        match = FEED_UPDATED_PATTERN.search(header.split(b"<entry", 1)[0])
+        if match:
+            updated = match.group(1).decode("utf-8", errors="replace")
+
+        # NOTE: ブロックの境界をまたぐタグも数えられるよう、前のブロックの末尾を繋げる
+        tail = b""
+        block = header
+        while block:
+            data = tail + block
+            n_entries += sum(data.count(tag) for tag in ENTRY_START_TAGS)
+            tail = data[-overlap:]
+            block = f.read(SCAN_BLOCK_SIZE)
+    return FilterXmlSummary(n_entries, updated)
+
+
+@dataclass
+class XmlSource:
+    """読み込み元のxmlと、その中での各entryのバイト範囲
+    i番目のentryはspans[2 * i]〜spans[2 * i + 1]で、行頭の字下げと行末の改行を含む。
+    次のentryとの間の空行・コメント等は前のentryに含めるため、読み込んだ順に並べると元のxmlと一致する。
+    """
+
+    path: str
+    size: int
+    mtime_ns: int
+    spans: array
+
+    @property
+    def n_entries(self) -> int:
+        return len(self.spans) // 2
+
+    def is_unchanged(self) -> bool:
+        """読み込み後にxmlが変更・削除されていないか"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime_ns
+
+
+def scan_entry_spans(filter_xml_path: str) -> Union[array, None]:
+    """xmlをバイト列のまま走査し、各entryのバイト範囲を返す
+    開始タグと終了タグが交互に現れない(コメント内のタグ、空要素のentry等)場合や、
+    UTF-8以外の文字コードの場合は、範囲を特定できないためNoneを返す。
+    """
+    spans = array("q")
+    with open(filter_xml_path, mode="rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return spans
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            match = XML_ENCODING_PATTERN.match(data)
+            if match and match.group(1).lower() not in UTF8_ENCODINGS:
+                return None
+            for match in ENTRY_TAG_PATTERN.finditer(data):
+                is_end = data[match.start() + 1] == ord("/")
+                if is_end != (len(spans) % 2 == 1):
+                    return None
+                if is_end:
+                    spans.append(match.end())
+                    continue
+                # NOTE: 正規表現で字下げも探すと全ての位置で照合されて遅いため、タグから遡る
+                start = indent_start = match.start()
+                while indent_start > 0 and data[indent_start - 1] in INDENT_BYTES:
+                    indent_start -= 1
+                if indent_start == 0 or data[indent_start - 1] == ord("\n"):
+                    start = indent_start
+                if spans:
+                    spans[-1] = start
+                spans.append(start)
+    return None if len(spans) % 2 else spans
+
+
+class FilterEntryLoader:
+    """iterparseでxmlを逐次読み込み、FilterEntryを1件ずつ生成する
+    読み込み済みのentry要素は子要素を破棄するため、木全体をメモリに保持しない。
+    読み込み完了後のrootにはentry以外の要素(title, id, author等)だけが残る。
+    各entryにはxml内での位置(source_index)を記録し、sourceでそのバイト範囲を参照できる。
+    """
+
+    def __init__(self, filter_xml_path: str):
+        self._filter_xml_path = filter_xml_path
+        self._root: Union[ET.Element, None] = None
+        self._file: Union[BinaryIO, None] = None
+        self._n_bytes = os.path.getsize(filter_xml_path)
+        self._source: Union[XmlSource, None] = None
+        # 同じxml内で共通の文字列(updated)を共有するための辞書(読み込み中のみ保持する)
+        self._shared_texts: dict[str, str] = {}
+
+    @property
+    def root(self) -> Union[ET.Element, None]:
+        return self._root
+
+    @property
+    def source(self) -> Union[XmlSource, None]:
+        """読み込み完了後のxmlと各entryのバイト範囲(範囲を特定できない場合はNone)"""
+        return self._source
+
+    @property
+    def n_bytes(self) -> int:
+        """xmlのファイルサイズ"""
+        return self._n_bytes
+
+    @property
+    def n_read_bytes(self) -> int:
+        """読み込み済みのバイト数(進捗表示用)"""
+        if self._file is None or self._file.closed:
+            return self._n_bytes if self._root is not None else 0
+        return self._file.tell()
+
+    def _to_entry(self, elem: ET.Element) -> FilterEntry:
+        """entry要素の子要素を1回だけ走査してFilterEntryを作成する"""
+        category = title = id = updated = None
+        names = []
+        values = []
+        for child in elem:
+            tag = child.tag
+            if tag == PROPERTY_TAG:
+                names.append(child.get("name"))
+                values.append(child.get("value"))
+            elif tag == CATEGORY_TAG:
+                category = child.get("term")
+            elif tag == TITLE_TAG:
+                title = child.text
+            elif tag == ID_TAG:
+                id = child.text
+            elif tag == UPDATED_TAG:
+                updated = child.text
+                updated = self._shared_texts.setdefault(updated, updated)
+        return FilterEntry.from_items(category, title, id, updated, names, values)
+
+    def iter_entry(self) -> Iterator[FilterEntry]:
+        """xmlを先頭から読み込み、FilterEntryを1件ずつ返す"""
+        self._root = None
+        self._source = None
+        n_entries = 0
+        elem = None
+        with open(self._filter_xml_path, mode="rb") as self._file:
+            stat = os.fstat(self._file.fileno())
+            # NOTE: rootを得るためにstartイベントも受け取ると、全ての要素でイベントが倍になり遅い。
+            #       rootは最後のendイベントで得られるため、endイベントのみ受け取る
+            for _, elem in ET.iterparse(self._file):
+                if elem.tag != ENTRY_TAG:
+                    continue
+
+                entry = self._to_entry(elem)
+                entry.source_index = n_entries
+                n_entries += 1
+                yield entry
+
+                # 読み込み済みのentry要素の子要素を破棄する(空のentry要素は読み込み完了後に取り除く)
+                elem.clear()
+        self._root = elem
+        if self._root is not None:
+            self._root[:] = [child for child in self._root if child.tag != ENTRY_TAG]
+        self._shared_texts = {}
+        self._source = self._scan_source(stat, n_entries)
+
+    def _scan_source(self, stat: os.stat_result, n_entries: int) -> Union[XmlSource, None]:
+        """解析したentryと数が一致する場合のみ、各entryのバイト範囲を返す"""
+        try:
+            spans = scan_entry_spans(self._filter_xml_path)
+        except (OSError, ValueError):
+            return None
+        if spans is None or len(spans) // 2 != n_entries:
+            return None
+        source = XmlSource(
+            os.path.abspath(self._filter_xml_path), stat.st_size, stat.st_mtime_ns, spans
+        )
+        # NOTE: 解析中にxmlが変更された場合、解析結果とバイト範囲が対応しない
+        return source if source.is_unchanged() else None
+
+    def iter_chunk(self, chunk_size: int = CHUNK_SIZE) -> Iterator[list[FilterEntry]]:
+        """FilterEntryをchunk_size件ずつまとめて返す"""
+        chunk = []
+        for entry in self.iter_entry():
+            chunk.append(entry)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
@@ -0,0 +1,102 @@
+import time
+from dataclasses import dataclass, field
+from typing import Sequence, Union
+
+from app.data.filter_data import FilterData
+from app.data.filter_entry import FilterEntry
+from app.data.filter_sort import FilterSorter
+from app.data.filter_writer import export_xml_path
+
+# 並び替えに指定できるキー
+SORT_KEYS = ("category", "label", "from")
+
+
+@dataclass(frozen=True)
+class ReorderSpec:
+    """フィルタの並び替え方法
+    id_orderを指定した場合はidの並び順、それ以外はsort_keysの順にソートする。
+    """
+
+    # この順に先頭から並べるentryのid(含まれないentryは元の順で後ろに並べる)
+    id_order: Union[tuple[str, ...], None] = None
+    sort_keys: tuple[str, ...] = field(default_factory=tuple)
+    reverse: bool = False
+
+
+@dataclass
+class ReorderResult:
+    input_path: str
+    output_path: str
+    n_entries: int
+    # id_orderのidのうち、xmlに存在しなかった数
+    n_unmatched: int
+    load_time: float
+    reorder_time: float
+    export_time: float
+
+    @property
+    def total_time(self) -> float:
+        return self.load_time + self.reorder_time + self.export_time
+
+
+def reorder_index_list(
+    entry_list: Sequence[FilterEntry], spec: ReorderSpec
+) -> tuple[list[int], int]:
+    """並び替え後のentry_listのインデックスと、見つからなかったidの数を返す"""
+    if spec.id_order is not None:
+        positions: dict[str, int] = {}
+        for idx, entry in enumerate(entry_list):
+            positions.setdefault(entry.id, idx)
+        index_list = []
+        used = set()
+        n_unmatched = 0
+        for id in spec.id_order:
+            idx = positions.get(id)
+            if idx is None:
+                n_unmatched += 1
+            elif idx not in used:
+                used.add(idx)
+                index_list.append(idx)
+        index_list.extend(idx for idx in range(len(entry_list)) if idx not in used)
+        return index_list, n_unmatched
+
+    for sort_key in spec.sort_keys:
+        if sort_key not in SORT_KEYS:
+            raise ValueError(f"unknown sort key: {sort_key}")
+    sort_keys = [(sort_key, spec.reverse) for sort_key in spec.sort_keys]
+    return list(FilterSorter(entry_list).sorted_index_list(sort_keys)), 0
+
+
+def reorder_xml(
+    input_path: str, spec: ReorderSpec, output_path: Union[str, None] = None
+) -> ReorderResult:
+    """xmlを読み込んで並び替え、xmlで出力する
+    output_pathを省略した場合は、Viewerと同じ名前規則で入力と同じディレクトリに出力する。
+    """
+    if output_path is None:
+        output_path = export_xml_path(input_path)
+
+    start = time.perf_counter()
+    filter_data = FilterData(input_path)
+    loaded = time.perf_counter()
+    index_list, n_unmatched = reorder_index_list(filter_data.entry_list, spec)
+    reordered = time.perf_counter()
+    filter_data.export_xml(output_path, index_list)
+    exported = time.perf_counter()
+
+    return ReorderResult(
+        input_path,
+        output_path,
+        len(index_list),
+        n_unmatched,
+        loaded - start,
+        reordered - loaded,
+        exported - reordered,
+    )
+
+
+def read_id_order(id_order_path: str) -> tuple[str, ...]:
+    """1行に1つidを記載したファイルを読み込む(空行と#から始まる行は無視する)"""
+    with open(id_order_path, encoding="utf-8") as f:
+        lines = (line.strip() for line in f)
+        return tuple(line for line in lines if line and not line.startswith("#"))
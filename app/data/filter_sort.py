@@ -0,0 +1,140 @@
+import re
+from array import array
+from typing import Any, Callable, Iterable, Sequence, Union
+
+from app.data.filter_data import render_entry
+from app.data.filter_entry import FilterEntry
+
+# ソートに使えるキー(テーブルの列名と同じ名前にしている)
+SORT_KEY_NAMES = ("priority", "category", "from", "subject", "condition", "label", "process")
+
+# (キー名, 降順かどうか)
+SortKey = tuple[str, bool]
+
+ADDRESS_PATTERN = re.compile(r"([\w.+\-*]*)@([\w.\-*]+)")
+SUBJECT_STRIP_PATTERN = re.compile(r"[\"(){}]")
+# キーの種類が行数の1/BUCKET_SORT_RATIO以下の場合はバケットソートを使う
+BUCKET_SORT_RATIO = 4
+
+
+def _missing_last(value: Union[str, None], key: Callable[[str], Any]) -> tuple:
+    """値の無いentryを後ろに並べるためのキー"""
+    return (1,) if value is None else (0, key(value))
+
+
+def _from_key(value: str) -> tuple:
+    """fromの値をドメイン・ユーザ名の順で比較するキー(アドレスでない場合は文字列で比較する)"""
+    match = ADDRESS_PATTERN.search(value)
+    if match is None:
+        return (1, value.casefold())
+    local, domain = match.groups()
+    return (0, domain.casefold(), local.casefold())
+
+
+def _subject_key(value: str) -> str:
+    return SUBJECT_STRIP_PATTERN.sub("", value).strip().casefold()
+
+
+def entry_sort_key(name: str) -> Callable[[FilterEntry], tuple]:
+    """entryからソート用の値を取得する関数を返す(priority以外)"""
+    if name == "category":
+        return lambda entry: _missing_last(entry.category, str.casefold)
+    if name == "from":
+        return lambda entry: _missing_last(entry.get("from"), _from_key)
+    if name == "subject":
+        return lambda entry: _missing_last(entry.get("subject"), _subject_key)
+    if name == "label":
+        return lambda entry: _missing_last(entry.get("label"), str.casefold)
+    if name == "condition":
+        return lambda entry: render_entry(entry)[0].casefold()
+    if name == "process":
+        return lambda entry: render_entry(entry)[2].casefold()
+    raise ValueError(f"unknown sort key: {name}")
+
+
+def text_sort_key(text: str) -> tuple:
+    """表示文字列のソート用のキー(数値は数値として比較し、文字列より前に並べる)"""
+    try:
+        return (0, int(text), "")
+    except ValueError:
+        return (1, 0, text.casefold())
+
+
+def rank_values(values: Iterable[Any]) -> tuple[array, int]:
+    """値を順位(同じ値は同じ順位)に変換し、順位の配列と順位の数を返す"""
+    values = list(values)
+    ranks = {value: rank for rank, value in enumerate(sorted(set(values)))}
+    return array("i", (ranks[value] for value in values)), len(ranks)
+
+
+def sort_permutation(
+    rank_list: Sequence[tuple[Sequence[int], int, bool]], rows: Sequence[int]
+) -> array:
+    """rowsを順位で安定ソートした場合の並び順(新しい位置 -> rowsでの位置)を返す
+    rank_listは優先度の高い順の(順位の配列, 順位の数, 降順かどうか)で、順位の配列はrowsの値で引く。
+    複数のキーは1つの整数にまとめて比較するため、キーの数によらず1回のソートで済む。
+    """
+    keys = [0] * len(rows)
+    n_keys = 1
+    for ranks, n_ranks, descending in rank_list:
+        column = map(ranks.__getitem__, rows)
+        if descending:
+            column = (n_ranks - 1 - rank for rank in column)
+        if n_keys == 1:
+            keys = list(column)
+        else:
+            keys = [key * n_ranks + rank for key, rank in zip(keys, column)]
+        n_keys *= n_ranks
+
+    if n_keys * BUCKET_SORT_RATIO > len(keys):
+        return array("i", sorted(range(len(rows)), key=keys.__getitem__))
+    # キーの種類が少ない場合(ラベル等)は、キーごとに振り分ける方が比較ソートより速い
+    buckets: list[list[int]] = [[] for _ in range(n_keys)]
+    for position, key in enumerate(keys):
+        buckets[key].append(position)
+    order = array("i")
+    for bucket in buckets:
+        order.extend(bucket)
+    return order
+
+
+class FilterSorter:
+    """entry_listをキーの値で並び替える
+    キーごとの順位はentry_listのインデックスで保持し、キーが最初に使われた時に1回だけ計算する。
+    entryが追加された場合は計算し直す。entryの内容を変更した場合はinvalidateを呼ぶ。
+    """
+
+    def __init__(self, entry_list: Sequence[FilterEntry]):
+        self._entry_list = entry_list
+        self._ranks: dict[str, tuple[array, int]] = {}
+
+    def invalidate(self) -> None:
+        """キャッシュした順位を破棄する"""
+        self._ranks = {}
+
+    def ranks(self, name: str) -> tuple[array, int]:
+        """キーの順位の配列(entry_listのインデックス -> 順位)と順位の数を返す"""
+        n_entries = len(self._entry_list)
+        if name == "priority":
+            return range(n_entries), max(n_entries, 1)
+        cached = self._ranks.get(name)
+        if cached is None or len(cached[0]) != n_entries:
+            key = entry_sort_key(name)
+            cached = self._ranks[name] = rank_values(key(entry) for entry in self._entry_list)
+        return cached[0], max(cached[1], 1)
+
+    def sort_order(self, index_list: Sequence[int], sort_keys: Sequence[SortKey]) -> array:
+        """index_list(entry_listのインデックス)を並び替えた場合の並び順を返す
+        返り値は新しい位置 -> index_listでの位置で、キーが同じentryはindex_listの順のまま並べる。
+        """
+        rank_list = [(*self.ranks(name), descending) for name, descending in sort_keys]
+        return sort_permutation(rank_list, index_list)
+
+    def sorted_index_list(
+        self, sort_keys: Sequence[SortKey], index_list: Union[Sequence[int], None] = None
+    ) -> array:
+        """並び替えた後のentry_listのインデックスを返す(FilterData.sort_entry_listにそのまま渡せる)"""
+        if index_list is None:
+            index_list = range(len(self._entry_list))
+        order = self.sort_order(index_list, sort_keys)
+        return array("i", map(index_list.__getitem__, order))
@@ -0,0 +1,209 @@
+import mmap
+import os
+import secrets
+import xml.etree.ElementTree as ET
+from array import array
+from datetime import datetime
+from typing import BinaryIO, Generator, Iterable, Iterator, Union
+
+from app.common.trace import TRACER
+from app.common.xml import INDENT
+from app.data.filter_entry import FilterEntry
+from app.data.filter_loader import ATOM_SYNDICATION_FORMAT_URL, GOOGLE_SCHEMA_URL, XmlSource
+
+XML_DECLARATION = "<?xml version='1.0' encoding='UTF-8'?>\n"
+FEED_START_TAG = f"<feed xmlns='{ATOM_SYNDICATION_FORMAT_URL}' xmlns:apps='{GOOGLE_SCHEMA_URL}'>\n"
+FEED_END_TAG = "</feed>"
+BUFFER_SIZE = 1 << 16
+PROGRESS_STEP = 1000
+
+# 名前空間URLと出力時の接頭辞の対応
+PREFIXES = {ATOM_SYNDICATION_FORMAT_URL: "", GOOGLE_SCHEMA_URL: "apps:"}
+
+
+def export_xml_path(filter_xml_path: str) -> str:
+    """入力xmlのパスから出力先のパスを作成する(ファイル名に出力日時を付ける)"""
+    base, ext = os.path.splitext(filter_xml_path)
+    return datetime.now().strftime(f"{base}(tooledit_%Y%m%d-%H%M%S){ext}")
+
+
+def _create_temp_file(dirpath: str, filename: str) -> tuple[int, str]:
+    """出力先と同じフォルダに一時ファイルを作成し、(ファイルディスクリプタ, パス)を返す
+    作成時にumaskが適用されるため、パーミッションは通常のファイル作成と同じになる
+    (tempfile.mkstempは0o600で作成し、umaskの取得にはプロセス全体のumaskの一時的な変更が
+    必要で、別スレッドで作成中のファイルに影響するため使わない)。
+    """
+    tmp_path = os.path.join(dirpath, f".{filename}.{secrets.token_hex(8)}.tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+    return fd, tmp_path
+
+
+def _escape_text(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _escape_attribute(value: str) -> str:
+    return (
+        _escape_text(value)
+        .replace('"', "&quot;")
+        .replace("'", "&apos;")
+        .replace("\n", "&#10;")
+        .replace("\r", "&#13;")
+        .replace("\t", "&#09;")
+    )
+
+
+def _qualified_name(tag: str) -> str:
+    """{namespace}name形式のタグ名を出力用の名前(apps:property等)に変換する"""
+    if tag[:1] != "{":
+        return tag
+    namespace, name = tag[1:].split("}", 1)
+    return PREFIXES.get(namespace, "") + name
+
+
+def _attributes(attributes: Iterable[tuple[str, str]]) -> str:
+    return "".join(
+        f" {_qualified_name(key)}='{_escape_attribute(value or '')}'" for key, value in attributes
+    )
+
+
+class FilterXmlWriter:
+    """Gmailのフィルタxmlと同じ書式(シングルクォート、閉じタグ付き)でxmlを出力する
+    一時ファイルへ逐次書き込み、書き込み完了後に出力先へ置き換える。
+    sourceを指定した場合は、読み込み元のxmlをメモリマップし、source_indexを持つentryは
+    元のバイト列をそのままコピーする(読み込み元で連続していたentryはまとめてコピーする)。
+    文字列に変換し直すのはsource_indexが無いentryのみで、読み込み元のxmlが変更・削除
+    されていた場合は全てのentryを変換し直す。
+    """
+
+    def __init__(self, root: Union[ET.Element, None] = None, source: Union[XmlSource, None] = None):
+        self._root = root
+        self._source = source
+
+    def _element_string(self, elem: ET.Element, depth: int) -> str:
+        """entry以外の要素(title, author等)を文字列に変換する"""
+        indent = INDENT * depth
+        tag = _qualified_name(elem.tag)
+        attributes = _attributes(elem.items())
+        if len(elem) == 0:
+            text = _escape_text(elem.text) if elem.text else ""
+            return f"{indent}<{tag}{attributes}>{text}</{tag}>\n"
+
+        children = "".join(self._element_string(child, depth + 1) for child in elem)
+        return f"{indent}<{tag}{attributes}>\n{children}{indent}</{tag}>\n"
+
+    def _entry_string(self, entry: FilterEntry) -> str:
+        """FilterEntryをentry要素の文字列に変換する"""
+        indent = INDENT * 2
+        lines = [
+            f"{INDENT}<entry>\n",
+            f"{indent}<category term='{_escape_attribute(entry.category or '')}'></category>\n",
+            f"{indent}<title>{_escape_text(entry.title or '')}</title>\n",
+            f"{indent}<id>{_escape_text(entry.id or '')}</id>\n",
+            f"{indent}<updated>{_escape_text(entry.updated or '')}</updated>\n",
+            f"{indent}<content></content>\n",
+        ]
+        for name, value in entry.items():
+            lines.append(
+                f"{indent}<apps:property name='{_escape_attribute(name or '')}'"
+                f" value='{_escape_attribute(value or '')}'/>\n"
+            )
+        lines.append(f"{INDENT}</entry>\n")
+        return "".join(lines)
+
+    def _iter_write_entries(
+        self, f: BinaryIO, entry_list: Iterable[FilterEntry], step: int
+    ) -> Generator[int, None, int]:
+        """全ての要素を文字列に変換して書き込む"""
+        f.write(XML_DECLARATION.encode("utf-8"))
+        f.write(FEED_START_TAG.encode("utf-8"))
+        if self._root is not None:
+            for elem in self._root:
+                f.write(self._element_string(elem, 1).encode("utf-8"))
+        n_entries = 0
+        for n_entries, entry in enumerate(entry_list, 1):
+            f.write(self._entry_string(entry).encode("utf-8"))
+            if n_entries % step == 0:
+                yield n_entries
+        f.write(FEED_END_TAG.encode("utf-8"))
+        return n_entries
+
+    def _iter_splice_entries(
+        self,
+        f: BinaryIO,
+        data: memoryview,
+        spans: array,
+        entry_list: Iterable[FilterEntry],
+        step: int,
+    ) -> Generator[int, None, int]:
+        """読み込み元のバイト列(data)をentry単位でつなぎ合わせて書き込む
+        最初のentryより前(feedの開始タグ・title等)と最後のentryより後もそのままコピーする。
+        """
+        n_spans = len(spans) // 2
+        f.write(data[: spans[0]])
+        # 次に書き込む、読み込み元で連続したentryの範囲
+        run_start = run_end = 0
+        n_entries = 0
+        for n_entries, entry in enumerate(entry_list, 1):
+            index = entry.source_index
+            if index is not None and index < n_spans:
+                start, end = spans[2 * index], spans[2 * index + 1]
+                if start != run_end:
+                    f.write(data[run_start:run_end])
+                    run_start = start
+                run_end = end
+            else:
+                f.write(data[run_start:run_end])
+                run_start = run_end = 0
+                f.write(self._entry_string(entry).encode("utf-8"))
+            if n_entries % step == 0:
+                f.write(data[run_start:run_end])
+                run_start = run_end = 0
+                yield n_entries
+        f.write(data[run_start:run_end])
+        f.write(data[spans[-1] :])
+        return n_entries
+
+    def _usable_source(self) -> Union[XmlSource, None]:
+        """元のバイト列をコピーできる読み込み元のxml"""
+        source = self._source
+        if source is None or source.n_entries == 0 or not source.is_unchanged():
+            return None
+        return source
+
+    def iter_write(
+        self, filter_xml_path: str, entry_list: Iterable[FilterEntry], step: int = PROGRESS_STEP
+    ) -> Iterator[int]:
+        """xmlを一時ファイルに書き込み、完了後に出力先へ置き換える
+        書き込んだentry数をstep件ごとに返す。
+        途中で中断(ジェネレータをclose)した場合は一時ファイルを削除し、出力先は変更しない。
+        """
+        dirpath, filename = os.path.split(os.path.abspath(filter_xml_path))
+        fd, tmp_path = _create_temp_file(dirpath, filename)
+        completed = False
+        # NOTE: 記録される時間には、進捗を受け取った側の処理時間も含まれる
+        span = TRACER.span("FilterXmlWriter.iter_write")
+        try:
+            with span, os.fdopen(fd, mode="wb", buffering=BUFFER_SIZE) as f:
+                source = self._usable_source()
+                if source is None:
+                    n_entries = yield from self._iter_write_entries(f, entry_list, step)
+                else:
+                    # NOTE: 出力先が読み込み元と同じパスでも、置き換えるのはマップを閉じた後
+                    with open(source.path, mode="rb") as source_file, mmap.mmap(
+                        source_file.fileno(), 0, access=mmap.ACCESS_READ
+                    ) as mapped, memoryview(mapped) as data:
+                        n_entries = yield from self._iter_splice_entries(
+                            f, data, source.spans, entry_list, step
+                        )
+                span.add_rows(n_entries)
+            os.replace(tmp_path, filter_xml_path)
+            completed = True
+        finally:
+            if not completed:
+                os.remove(tmp_path)
+
+    def write(self, filter_xml_path: str, entry_list: Iterable[FilterEntry]) -> None:
+        """xmlを一時ファイルに書き込み、完了後に出力先へ置き換える"""
+        for _ in self.iter_write(filter_xml_path, entry_list):
+            pass
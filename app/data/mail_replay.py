@@ -0,0 +1,839 @@
+import email
+import html
+import mmap
+import os
+import re
+import time
+from array import array
+from collections import Counter
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from email.header import decode_header, make_header
+from email.message import Message
+from email.policy import compat32
+from multiprocessing import get_context
+from typing import Callable, Iterable, Iterator, NamedTuple, Sequence, Union
+
+from app.data.filter_entry import FilterEntry
+from app.data.search_index import ADDRESS_PATTERN
+
+# メールボックスを分割して各プロセスに渡す単位[byte]
+CHUNK_BYTES = 8 * 1024 * 1024
+# 1通のメールで判定に使う本文の最大文字数
+MAX_BODY_CHARS = 1 << 20
+MAILDIR_SUBDIRS = ("cur", "new")
+
+# メールの検索対象(Gmailの検索演算子と同じ名前)
+ANY = "any"
+FROM = "from"
+TO = "to"
+CC = "cc"
+BCC = "bcc"
+SUBJECT = "subject"
+LIST = "list"
+DELIVERED_TO = "deliveredto"
+FILENAME = "filename"
+BODY = "body"
+# 検索対象とメールのヘッダーの対応(to:はCc・Bccの宛先にも一致する)
+HEADER_FIELDS = {
+    FROM: ("From",),
+    TO: ("To", "Cc", "Bcc"),
+    CC: ("Cc",),
+    BCC: ("Bcc",),
+    SUBJECT: ("Subject",),
+    LIST: ("List-Id", "List-Post"),
+    DELIVERED_TO: ("Delivered-To", "X-Original-To"),
+}
+ADDRESS_FIELDS = frozenset((FROM, TO, CC, BCC, LIST, DELIVERED_TO))
+# 演算子の無い単語の検索対象
+ANY_FIELDS = (FROM, TO, SUBJECT, BODY, FILENAME)
+
+# フィルタのプロパティ名と、値を検索する時の既定の検索対象
+CRITERIA_FIELDS = {"from": FROM, "to": TO, "subject": SUBJECT, "hasTheWord": ANY}
+EXCLUDED_WORDS_NAME = "doesNotHaveTheWord"
+SIZE_UNITS = {"s_sb": 1, "s_skb": 1 << 10, "s_smb": 1 << 20}
+SIZE_SUFFIXES = {"": 1, "k": 1 << 10, "kb": 1 << 10, "m": 1 << 20, "mb": 1 << 20}
+SMALLER_OPERATOR = "s_ss"
+
+# 検索式で使える演算子(値の検索対象)と、メールの内容だけでは判定できない演算子
+QUERY_FIELDS = {
+    "from": FROM,
+    "to": TO,
+    "cc": CC,
+    "bcc": BCC,
+    "subject": SUBJECT,
+    "list": LIST,
+    "deliveredto": DELIVERED_TO,
+    "filename": FILENAME,
+}
+SIZE_OPERATORS = ("larger", "smaller", "size")
+UNSUPPORTED_OPERATORS = frozenset(
+    (
+        "in",
+        "is",
+        "label",
+        "category",
+        "after",
+        "before",
+        "older",
+        "newer",
+        "older_than",
+        "newer_than",
+        "rfc822msgid",
+        "around",
+    )
+)
+
+# 日本語・中国語・韓国語の文字(単語の区切りが無いため、2文字ずつに分割して扱う)
+CJK_CHARS = "぀-ヿ㐀-䶿一-鿿豈-﫿가-힯"
+CJK_PATTERN = re.compile(f"[{CJK_CHARS}]+")
+NON_CJK_WORD_PATTERN = re.compile(f"[^\\W{CJK_CHARS}]+")
+MAIL_WORD_PATTERN = re.compile(f"[{CJK_CHARS}]+|[^\\W{CJK_CHARS}]+")
+ADDRESS_VALUE_PATTERN = re.compile(r"(?:[\w.+\-]+@)?[\w\-]+(?:\.[\w\-]+)+")
+QUERY_TOKEN_PATTERN = re.compile(r'"[^"]*"?|[(){}]|[^\s(){}"]+')
+OPERATOR_PATTERN = re.compile(r"([A-Za-z_]+):(.*)", re.DOTALL)
+SIZE_VALUE_PATTERN = re.compile(r"(\d+)\s*([a-z]*)")
+MBOX_SEPARATOR_PATTERN = re.compile(rb"^From [^\n]*\n", re.MULTILINE)
+HTML_TAG_PATTERN = re.compile(r"<[^>]*>")
+
+
+class UnsupportedCriteria(ValueError):
+    """メールの内容だけでは判定できない条件(ラベル・日付等)"""
+
+
+def _cjk_bigrams(run: str) -> Iterator[str]:
+    if len(run) == 1:
+        yield run
+    for i in range(len(run) - 1):
+        yield run[i : i + 2]
+
+
+def split_words(text: str) -> list[str]:
+    """文字列を検索用の単語の並びに分割する(日本語等は2文字ずつの単語にする)"""
+    words = []
+    for word in MAIL_WORD_PATTERN.findall(text.casefold()):
+        if "぀" <= word[0] and CJK_PATTERN.match(word):
+            words.extend(_cjk_bigrams(word))
+        else:
+            words.append(word)
+    return words
+
+
+def _word_set(text: str) -> set[str]:
+    """文字列に含まれる単語の集合(split_wordsより速い)"""
+    words = set(NON_CJK_WORD_PATTERN.findall(text))
+    for run in CJK_PATTERN.findall(text):
+        words.update(_cjk_bigrams(run))
+    return words
+
+
+def _address_tokens(text: str) -> set[str]:
+    """アドレスの検索対象の単語・アドレス・ドメイン(上位のドメインを含む)"""
+    tokens = _word_set(text)
+    for address in ADDRESS_PATTERN.findall(text):
+        tokens.add(address)
+        parts = address.rsplit("@", 1)[-1].split(".")
+        tokens.update(".".join(parts[i:]) for i in range(len(parts) - 1))
+    return tokens
+
+
+class _Utf8HeaderPolicy(type(compat32)):
+    """エンコードせずにUTF-8で書かれたヘッダー(RFC 6532)を文字列で返すcompat32
+    compat32はバイト列から解析したヘッダーの非ASCIIの文字を置換文字(U+FFFD)にするため、
+    サロゲートになっている元のバイト列をUTF-8として変換し直す(email.policy.defaultは
+    全てのヘッダーを構造化して解析し、判定が遅くなるため使わない)。
+    """
+
+    def header_fetch_parse(self, name: str, value: str) -> str:
+        if isinstance(value, str) and not value.isascii():
+            return value.encode("utf-8", "surrogateescape").decode("utf-8", "replace")
+        return super().header_fetch_parse(name, value)
+
+
+UTF8_HEADER_POLICY = _Utf8HeaderPolicy()
+
+
+def _decode_header_value(value: str) -> str:
+    if "=?" not in value:
+        return value
+    try:
+        return str(make_header(decode_header(value)))
+    except (ValueError, LookupError, UnicodeError):
+        return value
+
+
+def _decode_payload(part: Message) -> str:
+    payload = part.get_payload(decode=True)
+    if not payload:
+        return ""
+    payload = payload[: MAX_BODY_CHARS * 4]
+    charset = part.get_content_charset() or "utf-8"
+    try:
+        text = payload.decode(charset, errors="replace")
+    except LookupError:
+        text = payload.decode("utf-8", errors="replace")
+    if part.get_content_subtype() == "html":
+        text = html.unescape(HTML_TAG_PATTERN.sub(" ", text))
+    return text
+
+
+class MailText:
+    """判定に使うメールの内容(検索対象ごとの文字列)
+    単語の集合と、フレーズの判定用に単語を空白区切りで並べた文字列は、使う時に作成する。
+    """
+
+    __slots__ = ("size", "has_attachment", "_texts", "_tokens", "_phrase_texts")
+
+    def __init__(self, size: int, has_attachment: bool, texts: dict[str, str]):
+        self.size = size
+        self.has_attachment = has_attachment
+        self._texts = {field: text.casefold() for field, text in texts.items()}
+        self._tokens: dict[str, set[str]] = {}
+        self._phrase_texts: dict[str, str] = {}
+
+    @classmethod
+    def from_bytes(cls, raw: bytes) -> "MailText":
+        """メール1通(RFC 5322形式のバイト列)を解析する"""
+        message = email.message_from_bytes(raw, policy=UTF8_HEADER_POLICY)
+        # NOTE: get_allは呼ぶたびに全てのヘッダーを走査するため、1回の走査で振り分ける
+        values: dict[str, list[str]] = {}
+        for name, value in message.items():
+            values.setdefault(name.lower(), []).append(str(value))
+        texts = {
+            field: " ".join(
+                _decode_header_value(value)
+                for name in names
+                for value in values.get(name.lower(), ())
+            )
+            for field, names in HEADER_FIELDS.items()
+        }
+        bodies = []
+        filenames = []
+        has_attachment = False
+        n_chars = 0
+        for part in message.walk():
+            if part.is_multipart():
+                continue
+            filename = part.get_filename()
+            if filename or part.get_content_disposition() == "attachment":
+                has_attachment = True
+                if filename:
+                    filenames.append(_decode_header_value(filename))
+                continue
+            if part.get_content_maintype() == "text" and n_chars < MAX_BODY_CHARS:
+                text = _decode_payload(part)[: MAX_BODY_CHARS - n_chars]
+                n_chars += len(text)
+                bodies.append(text)
+        texts[BODY] = "\n".join(bodies)
+        texts[FILENAME] = " ".join(filenames)
+        return cls(len(raw), has_attachment, texts)
+
+    def tokens(self, field: str) -> set[str]:
+        """検索対象に含まれる単語(アドレスの検索対象はアドレス・ドメインを含む)"""
+        tokens = self._tokens.get(field)
+        if tokens is None:
+            if field == ANY:
+                tokens = set().union(*(self.tokens(name) for name in ANY_FIELDS))
+            elif field in ADDRESS_FIELDS:
+                tokens = _address_tokens(self._texts[field])
+            else:
+                tokens = _word_set(self._texts[field])
+            self._tokens[field] = tokens
+        return tokens
+
+    def phrase_text(self, field: str) -> str:
+        """検索対象の単語を空白区切りで並べた文字列(前後にも空白を付ける)"""
+        text = self._phrase_texts.get(field)
+        if text is None:
+            fields = ANY_FIELDS if field == ANY else (field,)
+            # NOTE: 検索対象をまたいでフレーズが一致しないよう、改行で区切る
+            text = "\n".join(f" {' '.join(split_words(self._texts[name]))} " for name in fields)
+            self._phrase_texts[field] = text
+        return text
+
+
+# 判定条件の木
+# キーは一致するメールが必ずどれかを含む(検索対象, 単語)の組で、決められない場合はNone。
+# 重みはキーの単語を含むメールの多さの見積もりで、キーの組の選択に使う。
+Key = tuple[str, str]
+Keys = Union[frozenset[Key], None]
+Weight = Callable[[Key], int]
+
+
+@dataclass(frozen=True)
+class Term:
+    field: str
+    word: str
+
+    def matches(self, mail: MailText) -> bool:
+        return self.word in mail.tokens(self.field)
+
+    def keys(self, weight: Weight) -> Keys:
+        return frozenset(((self.field, self.word),))
+
+    def terms(self) -> Iterator[Key]:
+        yield self.field, self.word
+
+
+@dataclass(frozen=True)
+class Phrase:
+    field: str
+    words: tuple[str, ...]
+
+    def matches(self, mail: MailText) -> bool:
+        tokens = mail.tokens(self.field)
+        if not all(word in tokens for word in self.words):
+            return False
+        return f" {' '.join(self.words)} " in mail.phrase_text(self.field)
+
+    def keys(self, weight: Weight) -> Keys:
+        # NOTE: 重みが同じ場合は、長い単語ほど一致するメールが少ないとみなす
+        word = min(self.words, key=lambda word: (weight((self.field, word)), -len(word)))
+        return frozenset(((self.field, word),))
+
+    def terms(self) -> Iterator[Key]:
+        for word in self.words:
+            yield self.field, word
+
+
+@dataclass(frozen=True)
+class AllOf:
+    children: tuple["Criteria", ...]
+
+    def matches(self, mail: MailText) -> bool:
+        return all(child.matches(mail) for child in self.children)
+
+    def keys(self, weight: Weight) -> Keys:
+        # どれか1つの子の条件のキーを含めばよいため、重みの合計が最も小さいキーを使う
+        candidates = [keys for keys in (child.keys(weight) for child in self.children) if keys]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda keys: sum(map(weight, keys)))
+
+    def terms(self) -> Iterator[Key]:
+        for child in self.children:
+            yield from child.terms()
+
+
+@dataclass(frozen=True)
+class AnyOf:
+    children: tuple["Criteria", ...]
+
+    def matches(self, mail: MailText) -> bool:
+        return any(child.matches(mail) for child in self.children)
+
+    def keys(self, weight: Weight) -> Keys:
+        keys = set()
+        for child in self.children:
+            child_keys = child.keys(weight)
+            if child_keys is None:
+                return None
+            keys.update(child_keys)
+        return frozenset(keys)
+
+    def terms(self) -> Iterator[Key]:
+        for child in self.children:
+            yield from child.terms()
+
+
+@dataclass(frozen=True)
+class Not:
+    child: "Criteria"
+
+    def matches(self, mail: MailText) -> bool:
+        return not self.child.matches(mail)
+
+    def keys(self, weight: Weight) -> Keys:
+        return None
+
+    def terms(self) -> Iterator[Key]:
+        return iter(())
+
+
+@dataclass(frozen=True)
+class HasAttachment:
+    def matches(self, mail: MailText) -> bool:
+        return mail.has_attachment
+
+    def keys(self, weight: Weight) -> Keys:
+        return None
+
+    def terms(self) -> Iterator[Key]:
+        return iter(())
+
+
+@dataclass(frozen=True)
+class Size:
+    larger: bool
+    n_bytes: int
+
+    def matches(self, mail: MailText) -> bool:
+        return mail.size > self.n_bytes if self.larger else mail.size < self.n_bytes
+
+    def keys(self, weight: Weight) -> Keys:
+        return None
+
+    def terms(self) -> Iterator[Key]:
+        return iter(())
+
+
+Criteria = Union[Term, Phrase, AllOf, AnyOf, Not, HasAttachment, Size]
+
+
+def _combine(nodes: list[Criteria], is_any: bool) -> Union[Criteria, None]:
+    if not nodes:
+        return None
+    if len(nodes) == 1:
+        return nodes[0]
+    return AnyOf(tuple(nodes)) if is_any else AllOf(tuple(nodes))
+
+
+def _value_criteria(field: str, value: str) -> Union[Criteria, None]:
+    """演算子の値(単語・アドレス・ドメイン)を判定条件に変換する"""
+    if field in ADDRESS_FIELDS:
+        address = value.casefold().strip("*").lstrip("@")
+        if ADDRESS_VALUE_PATTERN.fullmatch(address):
+            return Term(field, address)
+    words = split_words(value)
+    if not words:
+        return None
+    return Term(field, words[0]) if len(words) == 1 else Phrase(field, tuple(words))
+
+
+def _size_criteria(operator: str, value: str) -> Size:
+    match = SIZE_VALUE_PATTERN.fullmatch(value.casefold())
+    if match is None or match.group(2) not in SIZE_SUFFIXES:
+        raise UnsupportedCriteria(f"invalid size: {operator}:{value}")
+    n_bytes = int(match.group(1)) * SIZE_SUFFIXES[match.group(2)]
+    return Size(operator != "smaller", n_bytes)
+
+
+class _QueryParser:
+    """Gmailの検索式(from・subject・hasTheWord等の値)を判定条件に変換する
+    単語・"フレーズ"・OR・-(否定)・( )(AND)・{ }(OR)と、from:・subject:・has:attachment・
+    larger:等の演算子に対応する。ラベル・日付等の演算子はUnsupportedCriteriaを送出する。
+    """
+
+    def __init__(self, query: str):
+        self._tokens = QUERY_TOKEN_PATTERN.findall(query)
+        self._position = 0
+
+    def parse(self, field: str, is_any: bool = False) -> Union[Criteria, None]:
+        return self._parse_sequence(field, None, is_any)
+
+    def _next(self) -> Union[str, None]:
+        if self._position >= len(self._tokens):
+            return None
+        token = self._tokens[self._position]
+        self._position += 1
+        return token
+
+    def _parse_sequence(
+        self, field: str, closing: Union[str, None], is_any: bool
+    ) -> Union[Criteria, None]:
+        nodes: list[Criteria] = []
+        is_or = False
+        while self._position < len(self._tokens):
+            token = self._tokens[self._position]
+            if token in (")", "}"):
+                self._position += 1
+                if token == closing:
+                    break
+                continue
+            if token in ("OR", "|"):
+                self._position += 1
+                is_or = True
+                continue
+            if token == "AND":
+                self._position += 1
+                continue
+            node = self._parse_item(field)
+            if node is None:
+                continue
+            if is_or and nodes:
+                previous = nodes[-1]
+                children = previous.children if isinstance(previous, AnyOf) else (previous,)
+                nodes[-1] = AnyOf(children + (node,))
+            else:
+                nodes.append(node)
+            is_or = False
+        return _combine(nodes, is_any)
+
+    def _parse_item(self, field: str) -> Union[Criteria, None]:
+        token = self._next()
+        negated = token.startswith("-") and token != "-"
+        if token == "-":
+            negated = True
+            token = self._next()
+            if token is None:
+                return None
+        elif negated:
+            token = token[1:]
+        node = self._parse_operand(token, field)
+        return Not(node) if negated and node is not None else node
+
+    def _parse_operand(self, token: str, field: str) -> Union[Criteria, None]:
+        match = OPERATOR_PATTERN.fullmatch(token) if token[:1] != '"' else None
+        if match is not None:
+            operator = match.group(1).casefold()
+            value = match.group(2)
+            if operator in UNSUPPORTED_OPERATORS or (
+                operator == "has" and value.casefold() != "attachment"
+            ):
+                raise UnsupportedCriteria(f"unsupported operator: {token}")
+            if operator == "has":
+                return HasAttachment()
+            if operator in SIZE_OPERATORS:
+                return _size_criteria(operator, value or (self._next() or ""))
+            if operator in QUERY_FIELDS:
+                field = QUERY_FIELDS[operator]
+                if not value:
+                    token = self._next()
+                    return None if token is None else self._parse_operand(token, field)
+                token = value
+        if token == "(":
+            return self._parse_sequence(field, ")", False)
+        if token == "{":
+            return self._parse_sequence(field, "}", True)
+        if token[:1] == '"':
+            words = split_words(token.strip('"'))
+            if not words:
+                return None
+            return Term(field, words[0]) if len(words) == 1 else Phrase(field, tuple(words))
+        return _value_criteria(field, token)
+
+
+def parse_query(query: str, field: str, is_any: bool = False) -> Union[Criteria, None]:
+    """検索式を判定条件に変換する(is_anyの場合は並べた単語のどれかに一致すればよい)"""
+    return _QueryParser(query).parse(field, is_any)
+
+
+def compile_criteria(entry: FilterEntry) -> Criteria:
+    """entryの条件をメールの判定条件に変換する
+    メールの内容だけでは判定できない条件を含む場合・条件が無い場合はUnsupportedCriteriaを送出する。
+    """
+    nodes = []
+    for name, field in CRITERIA_FIELDS.items():
+        value = entry.get(name)
+        if value:
+            node = parse_query(value, field)
+            if node is not None:
+                nodes.append(node)
+    excluded = entry.get(EXCLUDED_WORDS_NAME)
+    if excluded:
+        # NOTE: Gmailと同じく、並べた単語のどれか1つでも含むメールを除く
+        node = parse_query(excluded, ANY, is_any=True)
+        if node is not None:
+            nodes.append(Not(node))
+    if entry.get("hasAttachment") == "true":
+        nodes.append(HasAttachment())
+    size = entry.get("size")
+    if size:
+        if not size.isdigit():
+            raise UnsupportedCriteria(f"invalid size: {size}")
+        unit = SIZE_UNITS.get(entry.get("sizeUnit") or "s_smb", SIZE_UNITS["s_smb"])
+        nodes.append(Size(entry.get("sizeOperator") != SMALLER_OPERATOR, int(size) * unit))
+    criteria = _combine(nodes, False)
+    if criteria is None:
+        raise UnsupportedCriteria("no criteria")
+    return criteria
+
+
+class FilterMatcher:
+    """全てのフィルタの条件でメールをまとめて判定する
+    条件ごとに、一致するメールが必ず含む単語(キー)の組を選んで検索対象ごとの索引に登録しておき、
+    メールの単語との共通部分で候補の条件を絞り込んでから、候補の条件だけを判定する。
+    フィルタごとに正規表現を照合しないため、1通あたりの判定時間はフィルタ数にほぼよらない。
+    条件が同じフィルタ(処理だけが違うもの)は1回だけ判定する。
+    """
+
+    def __init__(self, entry_list: Sequence[FilterEntry]):
+        self._n_entries = len(entry_list)
+        criteria_ids: dict[Criteria, int] = {}
+        self._criteria: list[Criteria] = []
+        self._members: list[list[int]] = []
+        unsupported = []
+        for entry_index, entry in enumerate(entry_list):
+            try:
+                criteria = compile_criteria(entry)
+            except UnsupportedCriteria:
+                unsupported.append(entry_index)
+                continue
+            criteria_id = criteria_ids.get(criteria)
+            if criteria_id is None:
+                criteria_id = criteria_ids[criteria] = len(self._criteria)
+                self._criteria.append(criteria)
+                self._members.append([])
+            self._members[criteria_id].append(entry_index)
+        self._unsupported = frozenset(unsupported)
+
+        # NOTE: 多くのフィルタが使う単語はメールにも多く現れるとみなし、使うフィルタの少ない単語をキーにする
+        n_criteria = Counter(key for criteria in self._criteria for key in set(criteria.terms()))
+        # 検索対象 -> 単語 -> その単語をキーに持つ条件
+        self._index: dict[str, dict[str, list[int]]] = {}
+        # キーを決められない(全てのメールで判定する)条件
+        self._always: list[int] = []
+        for criteria_id, criteria in enumerate(self._criteria):
+            keys = criteria.keys(n_criteria.__getitem__)
+            if keys is None:
+                self._always.append(criteria_id)
+                continue
+            for field, word in keys:
+                self._index.setdefault(field, {}).setdefault(word, []).append(criteria_id)
+        # NOTE: 集合同士の共通部分は小さい方を走査するため、索引の単語も集合で持つ
+        self._index_words = {field: frozenset(words) for field, words in self._index.items()}
+
+    @property
+    def n_entries(self) -> int:
+        return self._n_entries
+
+    @property
+    def unsupported(self) -> frozenset[int]:
+        """判定できない条件を含むentry(entry_listのインデックス)"""
+        return self._unsupported
+
+    def match(self, mail: MailText) -> tuple[int, ...]:
+        """メールに一致するentry(entry_listのインデックスの昇順)"""
+        candidates = set(self._always)
+        for field, words in self._index_words.items():
+            index = self._index[field]
+            for word in mail.tokens(field) & words:
+                candidates.update(index[word])
+        matched = []
+        for criteria_id in candidates:
+            if self._criteria[criteria_id].matches(mail):
+                matched.extend(self._members[criteria_id])
+        matched.sort()
+        return tuple(matched)
+
+    def replay(self, chunk: "MailChunk") -> tuple[Counter, int]:
+        """チャンク内のメールを判定し、(一致したentryの組ごとのメール数, メール数)を返す"""
+        counts = Counter()
+        n_messages = 0
+        for raw in chunk.iter_messages():
+            counts[self.match(MailText.from_bytes(raw))] += 1
+            n_messages += 1
+        return counts, n_messages
+
+
+class MboxChunk(NamedTuple):
+    """mboxのstart〜endバイト目(メールの区切りで分割した範囲)"""
+
+    path: str
+    start: int
+    end: int
+
+    @property
+    def n_bytes(self) -> int:
+        return self.end - self.start
+
+    def iter_messages(self) -> Iterator[bytes]:
+        with open(self.path, mode="rb") as f:
+            f.seek(self.start)
+            data = f.read(self.n_bytes)
+        for raw in MBOX_SEPARATOR_PATTERN.split(data):
+            if raw.strip():
+                yield raw
+
+
+class MaildirChunk(NamedTuple):
+    """Maildirのメールのファイル"""
+
+    paths: tuple[str, ...]
+    n_bytes: int
+
+    def iter_messages(self) -> Iterator[bytes]:
+        for path in self.paths:
+            try:
+                with open(path, mode="rb") as f:
+                    yield f.read()
+            except FileNotFoundError:
+                # NOTE: 判定中に移動・削除されたメール
+                continue
+
+
+MailChunk = Union[MboxChunk, MaildirChunk]
+
+
+def _iter_mbox_chunks(mbox_path: str, chunk_bytes: int) -> Iterator[MboxChunk]:
+    """mboxをchunk_bytes程度ごとに、メールの区切り("From "で始まる行)で分割する"""
+    size = os.path.getsize(mbox_path)
+    if size == 0:
+        return
+    with open(mbox_path, mode="rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        start = 0
+        while start < size:
+            end = data.find(b"\nFrom ", min(start + chunk_bytes, size) - 1)
+            end = size if end < 0 else end + 1
+            yield MboxChunk(mbox_path, start, end)
+            start = end
+
+
+def _iter_maildir_chunks(maildir_path: str, chunk_bytes: int) -> Iterator[MaildirChunk]:
+    """Maildirのcur・newのメールをchunk_bytes程度ごとにまとめる"""
+    paths = []
+    n_bytes = 0
+    for subdir in MAILDIR_SUBDIRS:
+        dirpath = os.path.join(maildir_path, subdir)
+        if not os.path.isdir(dirpath):
+            continue
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                paths.append(entry.path)
+                n_bytes += entry.stat().st_size
+                if n_bytes >= chunk_bytes:
+                    yield MaildirChunk(tuple(paths), n_bytes)
+                    paths = []
+                    n_bytes = 0
+    if paths:
+        yield MaildirChunk(tuple(paths), n_bytes)
+
+
+def iter_mail_chunks(mailbox_path: str, chunk_bytes: int = CHUNK_BYTES) -> Iterator[MailChunk]:
+    """メールボックス(ディレクトリの場合はMaildir、ファイルの場合はmbox)を分割する"""
+    if os.path.isdir(mailbox_path):
+        if not any(os.path.isdir(os.path.join(mailbox_path, d)) for d in MAILDIR_SUBDIRS):
+            raise ValueError(f"not a Maildir (no cur/new directory): {mailbox_path}")
+        return _iter_maildir_chunks(mailbox_path, chunk_bytes)
+    return _iter_mbox_chunks(mailbox_path, chunk_bytes)
+
+
+@dataclass
+class ReplayResult:
+    """メールボックスの全てのメールをフィルタで判定した結果"""
+
+    mailbox_path: str
+    n_entries: int
+    n_messages: int
+    # 一致したentry(entry_listのインデックスの昇順のタプル) -> メール数
+    match_counts: Counter
+    # 判定できない条件(ラベル・日付等)を含むため判定しなかったentry
+    unsupported: frozenset[int]
+    elapsed: float
+
+    @property
+    def n_unmatched(self) -> int:
+        """どのフィルタにも一致しなかったメール数"""
+        return self.match_counts.get((), 0)
+
+    def hit_counts(self) -> array:
+        """entryごとの一致したメール数(並び順によらない)"""
+        counts = array("q", bytes(8 * self.n_entries))
+        for entry_indices, n_messages in self.match_counts.items():
+            for entry_index in entry_indices:
+                counts[entry_index] += n_messages
+        return counts
+
+    def first_match_counts(self, order: Iterable[int]) -> array:
+        """並び順(行番号 -> entry_listのインデックス)で、最初に一致するentryごとのメール数
+        一致したentryの組ごとに集計済みのため、メールを判定し直さずに求められる。
+        """
+        positions = array("i", bytes(4 * self.n_entries))
+        for row, entry_index in enumerate(order):
+            positions[entry_index] = row
+        counts = array("q", bytes(8 * self.n_entries))
+        for entry_indices, n_messages in self.match_counts.items():
+            if entry_indices:
+                counts[min(entry_indices, key=positions.__getitem__)] += n_messages
+        return counts
+
+
+# プロセスプールの各プロセスで使うFilterMatcher
+_process_matcher: Union[FilterMatcher, None] = None
+
+
+def _init_process(matcher: FilterMatcher) -> None:
+    global _process_matcher
+    _process_matcher = matcher
+
+
+def _replay_in_process(chunk: MailChunk) -> tuple[Counter, int]:
+    return _process_matcher.replay(chunk)
+
+
+class MailboxReplayer:
+    """mbox・Maildirの全てのメールをフィルタで判定し、フィルタごとの一致件数を集計する
+    メールボックスをchunk_bytes程度ごとに分割し、n_jobs個のプロセスで並列に判定する。
+    結果は一致したフィルタの組ごとのメール数で持つため、並び順を変えた後の
+    「最初に一致するフィルタ」もメールを判定し直さずに求められる。
+    """
+
+    def __init__(
+        self,
+        entry_list: Sequence[FilterEntry],
+        mailbox_path: str,
+        n_jobs: Union[int, None] = None,
+        chunk_bytes: int = CHUNK_BYTES,
+    ):
+        self._matcher = FilterMatcher(entry_list)
+        self._mailbox_path = mailbox_path
+        self._n_jobs = n_jobs or os.cpu_count() or 1
+        self._chunk_bytes = chunk_bytes
+        self._result: Union[ReplayResult, None] = None
+
+    @property
+    def result(self) -> Union[ReplayResult, None]:
+        """判定結果(iter_replayが最後まで終わるまではNone)"""
+        return self._result
+
+    def _iter_chunk_results(
+        self, chunks: list[MailChunk]
+    ) -> Iterator[tuple[MailChunk, tuple[Counter, int]]]:
+        if self._n_jobs <= 1 or len(chunks) <= 1:
+            # NOTE: 1チャンクだけの場合はプロセスの起動時間の方が長いため、同じプロセスで処理する
+            for chunk in chunks:
+                yield chunk, self._matcher.replay(chunk)
+            return
+
+        # NOTE: GUIのスレッドからforkするとロック等の状態が複製されるため、spawnで起動する
+        executor = ProcessPoolExecutor(
+            max_workers=min(self._n_jobs, len(chunks)),
+            mp_context=get_context("spawn"),
+            initializer=_init_process,
+            initargs=(self._matcher,),
+        )
+        try:
+            futures: dict[Future, MailChunk] = {
+                executor.submit(_replay_in_process, chunk): chunk for chunk in chunks
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            # 中断(ジェネレータをclose)した場合は、まだ始まっていないチャンクを取り消す
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def iter_replay(self) -> Iterator[tuple[int, int]]:
+        """メールを判定し、(判定済みのバイト数, 全体のバイト数)をチャンクごとに返す"""
+        start = time.perf_counter()
+        chunks = list(iter_mail_chunks(self._mailbox_path, self._chunk_bytes))
+        n_total = sum(chunk.n_bytes for chunk in chunks)
+        match_counts = Counter()
+        n_messages = 0
+        n_done = 0
+        for chunk, (chunk_counts, chunk_messages) in self._iter_chunk_results(chunks):
+            match_counts.update(chunk_counts)
+            n_messages += chunk_messages
+            n_done += chunk.n_bytes
+            yield n_done, n_total
+        self._result = ReplayResult(
+            self._mailbox_path,
+            self._matcher.n_entries,
+            n_messages,
+            match_counts,
+            self._matcher.unsupported,
+            time.perf_counter() - start,
+        )
+
+    def replay(self) -> ReplayResult:
+        for _ in self.iter_replay():
+            pass
+        return self._result
+
+
+def replay_mailbox(
+    entry_list: Sequence[FilterEntry], mailbox_path: str, n_jobs: Union[int, None] = None
+) -> ReplayResult:
+    """mbox・Maildirの全てのメールをフィルタで判定する"""
+    return MailboxReplayer(entry_list, mailbox_path, n_jobs).replay()
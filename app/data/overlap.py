@@ -0,0 +1,489 @@
+import re
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, Iterator, Sequence, Union
+
+from app.data.filter_entry import FilterEntry
+from app.data.search_index import WORD_PATTERN
+
+# 条件として扱うプロパティ名(これ以外の条件はfrom等と値が同じ場合のみ比較できる)
+SENDER_PROPERTY_NAME = "from"
+RECIPIENT_PROPERTY_NAME = "to"
+SUBJECT_PROPERTY_NAME = "subject"
+WORD_PROPERTY_NAME = "hasTheWord"
+OTHER_CONDITION_NAMES = (
+    "doesNotHaveTheWord",
+    "hasAttachment",
+    "excludeChats",
+    "size",
+    "sizeOperator",
+    "sizeUnit",
+)
+ACTION_NAMES = (
+    "label",
+    "shouldArchive",
+    "shouldMarkAsRead",
+    "shouldStar",
+    "shouldTrash",
+    "shouldNeverSpam",
+    "shouldAlwaysMarkAsImportant",
+    "shouldNeverMarkAsImportant",
+    "smartLabelToApply",
+    "forwardTo",
+)
+# 同じメールに両方が適用されると矛盾する処理の組み合わせ
+CONFLICTING_ACTIONS = (
+    ("shouldArchive", "label"),
+    ("shouldTrash", "label"),
+    ("shouldTrash", "shouldStar"),
+    ("shouldTrash", "forwardTo"),
+    ("shouldTrash", "shouldAlwaysMarkAsImportant"),
+    ("shouldTrash", "shouldNeverSpam"),
+    ("shouldAlwaysMarkAsImportant", "shouldNeverMarkAsImportant"),
+)
+
+# OR・{ }・スペース区切りで並んだアドレス・ドメインを分割する
+ADDRESS_SEPARATOR_PATTERN = re.compile(r"\s+OR\s+|[\s{}(),|]+")
+# 否定・完全一致・ワイルドカード以外の演算子を含む値は解析しない
+UNSUPPORTED_PATTERN = re.compile(r"(?:^|\s)-|\bAND\b|\"|:")
+# 件名・キーワードのOR条件(単語の集合をAND条件として比較できないため解析しない)
+WORD_ALTERNATIVE_PATTERN = re.compile(r"\bOR\b|[|{}]")
+
+SHADOWED = "shadowed"
+CONFLICT = "conflict"
+
+
+@dataclass(frozen=True)
+class FilterCondition:
+    """フィルタの条件を比較しやすい形に変換したもの
+    各値がNoneの場合はその条件を持たない(全てのメールに一致する)。
+    """
+
+    senders: Union[frozenset[str], None]
+    recipients: Union[frozenset[str], None]
+    subject_tokens: Union[frozenset[str], None]
+    word_tokens: Union[frozenset[str], None]
+    others: frozenset[tuple[str, str]]
+
+
+@dataclass(frozen=True)
+class Overlap:
+    """上にあるフィルタとの重なり(テーブルの注釈)"""
+
+    kind: str
+    # 上にあるフィルタのentry_listのインデックス
+    other: int
+    detail: str
+
+
+def iter_addresses(value: str) -> Iterator[str]:
+    """from/toの値に並んだアドレス・ドメインを元の表記のまま返す(演算子の有無は確認しない)"""
+    return (
+        address for address in ADDRESS_SEPARATOR_PATTERN.split(value) if address and address != "OR"
+    )
+
+
+def normalize_address(address: str) -> str:
+    """アドレス・ドメインを比較用の表記(小文字、先頭の*・@を除く)に変換する"""
+    return address.casefold().lstrip("*").lstrip("@")
+
+
+def split_addresses(value: str) -> Union[frozenset[str], None]:
+    """from/toの値をアドレス・ドメインの集合に変換する(解析できない場合はNone)"""
+    if UNSUPPORTED_PATTERN.search(value):
+        return None
+    addresses = frozenset(map(normalize_address, iter_addresses(value)))
+    return addresses or None
+
+
+def _split_words(value: str) -> Union[frozenset[str], None]:
+    """件名・キーワードの値を、全て含む必要がある単語の集合に変換する(解析できない場合はNone)"""
+    if UNSUPPORTED_PATTERN.search(value) or WORD_ALTERNATIVE_PATTERN.search(value):
+        return None
+    words = frozenset(WORD_PATTERN.findall(value.casefold()))
+    return words or None
+
+
+def domain_of(address: str) -> str:
+    return address.rsplit("@", 1)[-1]
+
+
+def parent_domains(domain: str) -> Iterable[str]:
+    """ドメインとその上位のドメイン(mail.example.com -> mail.example.com, example.com, com)"""
+    parts = domain.split(".")
+    return (".".join(parts[i:]) for i in range(len(parts)))
+
+
+def _address_covers(general: str, specific: str) -> bool:
+    """generalのアドレス・ドメインがspecificのアドレス・ドメインに一致するメールを全て含むか"""
+    if general == specific:
+        return True
+    if "@" in general:
+        return False
+    domain = domain_of(specific)
+    return domain == general or domain.endswith("." + general)
+
+
+def _addresses_cover(
+    general: Union[frozenset[str], None], specific: Union[frozenset[str], None]
+) -> bool:
+    if general is None:
+        return True
+    if specific is None:
+        return False
+    return all(any(_address_covers(g, s) for g in general) for s in specific)
+
+
+def _words_cover(
+    general: Union[frozenset[str], None], specific: Union[frozenset[str], None]
+) -> bool:
+    if general is None:
+        return True
+    return specific is not None and general <= specific
+
+
+def parse_condition(entry: FilterEntry) -> Union[FilterCondition, None]:
+    """entryの条件を解析する(比較できない条件を含む場合はNone)"""
+    values = {name: value for name, value in entry.items() if value is not None}
+    senders = recipients = subject_tokens = word_tokens = None
+    if SENDER_PROPERTY_NAME in values:
+        senders = split_addresses(values[SENDER_PROPERTY_NAME])
+        if senders is None:
+            return None
+    if RECIPIENT_PROPERTY_NAME in values:
+        recipients = split_addresses(values[RECIPIENT_PROPERTY_NAME])
+        if recipients is None:
+            return None
+    if SUBJECT_PROPERTY_NAME in values:
+        subject_tokens = _split_words(values[SUBJECT_PROPERTY_NAME])
+        if subject_tokens is None:
+            return None
+    if WORD_PROPERTY_NAME in values:
+        word_tokens = _split_words(values[WORD_PROPERTY_NAME])
+        if word_tokens is None:
+            return None
+    others = frozenset((name, values[name]) for name in OTHER_CONDITION_NAMES if name in values)
+    return FilterCondition(senders, recipients, subject_tokens, word_tokens, others)
+
+
+def condition_covers(general: FilterCondition, specific: FilterCondition) -> bool:
+    """specificの条件に一致するメールが全てgeneralの条件にも一致するか"""
+    # NOTE: 比較の軽いものから順に判定する
+    return (
+        general.others <= specific.others
+        and _words_cover(general.subject_tokens, specific.subject_tokens)
+        and _words_cover(general.word_tokens, specific.word_tokens)
+        and _addresses_cover(general.senders, specific.senders)
+        and _addresses_cover(general.recipients, specific.recipients)
+    )
+
+
+def parse_actions(entry: FilterEntry) -> frozenset[tuple[str, str]]:
+    return frozenset(
+        (name, value) for name, value in entry.items() if name in ACTION_NAMES and value is not None
+    )
+
+
+@lru_cache(maxsize=None)
+def conflicting_actions(names: frozenset[str], other_names: frozenset[str]) -> Union[str, None]:
+    """2つのフィルタの処理(名前の集合)が矛盾する場合はその説明を返す
+    片方だけが持つ処理同士の組み合わせのみ矛盾とする(ラベルを付けてアーカイブするフィルタ等、
+    1つのフィルタで両方行っている場合は意図した処理のため)。
+    """
+    for name, other_name in CONFLICTING_ACTIONS:
+        for upper, lower in ((name, other_name), (other_name, name)):
+            if (
+                upper in names
+                and lower in other_names
+                and upper not in other_names
+                and lower not in names
+            ):
+                return f"{name} vs {other_name}"
+    return None
+
+
+class _FilterGroup:
+    """条件・処理が同じentryのグループ"""
+
+    __slots__ = ("condition_class", "actions", "names", "members", "top")
+
+    def __init__(self, condition_class: "_ConditionClass", actions: frozenset[tuple[str, str]]):
+        self.condition_class = condition_class
+        self.actions = actions
+        self.names = frozenset(name for name, _ in actions)
+        self.members = array("i")
+        # 一番上にあるentry
+        self.top = -1
+
+
+class _ConditionClass:
+    """条件が同じグループの集まり"""
+
+    __slots__ = ("groups", "name_buckets", "bucket_tops", "item_groups", "covering", "covered")
+
+    def __init__(self):
+        self.groups: list[_FilterGroup] = []
+        # 処理の名前の集合 -> グループ(矛盾の判定は処理の名前だけで決まる)と、その一番上のentry
+        self.name_buckets: dict[frozenset[str], list[_FilterGroup]] = {}
+        self.bucket_tops: dict[frozenset[str], int] = {}
+        # 処理 -> その処理を持つグループ(処理を全て含むグループの検索用)
+        self.item_groups: dict[tuple[str, str], list[_FilterGroup]] = {}
+        # この条件を包含する条件と、この条件が包含する条件(どちらも自身を含む)
+        self.covering: list[_ConditionClass] = [self]
+        self.covered: list[_ConditionClass] = [self]
+
+    def add_group(self, group: _FilterGroup) -> None:
+        self.groups.append(group)
+        self.name_buckets.setdefault(group.names, []).append(group)
+        for item in group.actions:
+            self.item_groups.setdefault(item, []).append(group)
+
+
+class OverlapAnalyzer:
+    """優先度(並び順)を考慮して、上にあるフィルタと重なるフィルタを検出する
+    条件・処理が同じentryをグループにまとめ、条件が包含関係にある組は条件単位で最初に1回だけ求める
+    (組は並び順によらない)。組の候補は送信元のアドレス・ドメイン、件名・キーワードの単語で
+    索引を作って絞り込むため、全ての組を比較する必要はない。
+    entryの注釈は包含する条件の各グループの一番上のentryが自分より上にあるかで決まるため、
+    並び順が変わった場合は、移動したentryと、一番上のentryが変わったグループの条件に
+    包含されるentryだけを更新する。
+    """
+
+    def __init__(self, entry_list: Sequence[FilterEntry]):
+        self._n_entries = len(entry_list)
+        classes: dict[FilterCondition, _ConditionClass] = {}
+        groups: dict[tuple[FilterCondition, frozenset], _FilterGroup] = {}
+        self._entry_groups: list[Union[_FilterGroup, None]] = [None] * self._n_entries
+        for entry_index, entry in enumerate(entry_list):
+            condition = parse_condition(entry)
+            if condition is None:
+                continue
+            actions = parse_actions(entry)
+            group = groups.get((condition, actions))
+            if group is None:
+                condition_class = classes.get(condition)
+                if condition_class is None:
+                    condition_class = classes[condition] = _ConditionClass()
+                group = groups[(condition, actions)] = _FilterGroup(condition_class, actions)
+                condition_class.add_group(group)
+            group.members.append(entry_index)
+            self._entry_groups[entry_index] = group
+        self._groups = list(groups.values())
+        self._classes = list(classes.values())
+
+        conditions = list(classes)
+        for general, specific in self._find_covering_pairs(conditions):
+            classes[conditions[general]].covered.append(classes[conditions[specific]])
+            classes[conditions[specific]].covering.append(classes[conditions[general]])
+
+        self._order = array("i")
+        self._positions = array("i")
+        # 作成済みの注釈(参照されたentryのみ)
+        self._annotations: dict[int, tuple[Overlap, ...]] = {}
+
+    @property
+    def n_entries(self) -> int:
+        return self._n_entries
+
+    @property
+    def n_pairs(self) -> int:
+        """包含関係にある条件の組の数"""
+        return sum(len(condition_class.covered) - 1 for condition_class in self._classes)
+
+    @property
+    def order(self) -> array:
+        """最後にannotate・updateした時点の並び順"""
+        return self._order
+
+    @staticmethod
+    def _find_covering_pairs(conditions: Sequence[FilterCondition]) -> Iterable[tuple[int, int]]:
+        """条件が包含関係にある(general, specific)の組を返す(条件は重複しないものとする)"""
+        by_address: dict[str, list[int]] = {}
+        by_domain: dict[str, list[int]] = {}
+        by_subject: dict[str, list[int]] = {}
+        by_word: dict[str, list[int]] = {}
+        by_recipient: dict[str, list[int]] = {}
+        # 送信元・件名・キーワード・宛先のいずれも持たない(索引に登録できない)条件
+        wildcards: list[int] = []
+        # NOTE: generalの単語はspecificに全て含まれるため、generalは最も少ない単語だけに登録する
+        # ("report 14"等の共通の単語で候補が全件になるのを防ぐ)
+        subject_counts = Counter(
+            token for condition in conditions for token in condition.subject_tokens or ()
+        )
+        word_counts = Counter(
+            token for condition in conditions for token in condition.word_tokens or ()
+        )
+        for index, condition in enumerate(conditions):
+            if condition.senders is not None:
+                for sender in condition.senders:
+                    (by_address if "@" in sender else by_domain).setdefault(sender, []).append(
+                        index
+                    )
+            elif condition.subject_tokens is not None:
+                token = min(condition.subject_tokens, key=lambda t: (subject_counts[t], t))
+                by_subject.setdefault(token, []).append(index)
+            elif condition.word_tokens is not None:
+                token = min(condition.word_tokens, key=lambda t: (word_counts[t], t))
+                by_word.setdefault(token, []).append(index)
+            elif condition.recipients is not None:
+                for recipient in condition.recipients:
+                    by_recipient.setdefault(recipient, []).append(index)
+            else:
+                wildcards.append(index)
+
+        def candidates(condition: FilterCondition) -> set[int]:
+            """conditionを包含する可能性のある条件"""
+            result = set(wildcards)
+            if condition.senders is not None:
+                # generalが送信元の条件を持つ場合、specificの送信元のどれか1つを必ず含む
+                sender = next(iter(condition.senders))
+                result.update(by_address.get(sender, ()))
+                for domain in parent_domains(domain_of(sender)):
+                    result.update(by_domain.get(domain, ()))
+            for token in condition.subject_tokens or ():
+                result.update(by_subject.get(token, ()))
+            for token in condition.word_tokens or ():
+                result.update(by_word.get(token, ()))
+            for recipient in condition.recipients or ():
+                result.update(by_recipient.get(recipient, ()))
+                for domain in parent_domains(domain_of(recipient)):
+                    result.update(by_recipient.get(domain, ()))
+            return result
+
+        for specific, condition in enumerate(conditions):
+            for general in candidates(condition):
+                if general != specific and condition_covers(conditions[general], condition):
+                    yield general, specific
+
+    def _update_top(self, group: _FilterGroup) -> bool:
+        """グループの一番上のentryを求め直す。変化した場合はTrueを返す"""
+        top = min(group.members, key=self._positions.__getitem__)
+        if top == group.top:
+            return False
+        group.top = top
+        return True
+
+    def _update_bucket_top(self, condition_class: _ConditionClass, names: frozenset[str]) -> None:
+        condition_class.bucket_tops[names] = min(
+            (group.top for group in condition_class.name_buckets[names]),
+            key=self._positions.__getitem__,
+        )
+
+    def _shadowing_top(
+        self, condition_class: _ConditionClass, group: _FilterGroup, position: int
+    ) -> Union[int, None]:
+        """condition_classのグループのうち、groupの処理を全て含み、positionより上にある
+        一番上のentryを返す
+        """
+        if group.actions:
+            # NOTE: 処理を全て含むグループは、groupの処理のうち最も少ない処理を必ず持つ
+            item = min(group.actions, key=lambda i: len(condition_class.item_groups.get(i, ())))
+            candidates = condition_class.item_groups.get(item, ())
+        else:
+            candidates = condition_class.groups
+        positions = self._positions
+        result = None
+        for candidate in candidates:
+            top = candidate.top
+            if positions[top] < position and group.actions <= candidate.actions:
+                if result is None or positions[top] < positions[result]:
+                    result = top
+        return result
+
+    def _compute_annotations(self, entry_index: int) -> tuple[Overlap, ...]:
+        group = self._entry_groups[entry_index]
+        if group is None:
+            return ()
+        positions = self._positions
+        position = positions[entry_index]
+        annotations = []
+        for condition_class in group.condition_class.covering:
+            top = self._shadowing_top(condition_class, group, position)
+            if top is not None:
+                annotations.append(Overlap(SHADOWED, top, "all actions already applied above"))
+            for names, top in condition_class.bucket_tops.items():
+                if positions[top] < position:
+                    detail = conflicting_actions(names, group.names)
+                    if detail is not None:
+                        annotations.append(Overlap(CONFLICT, top, detail))
+        annotations.sort(key=lambda overlap: (positions[overlap.other], overlap.kind))
+        return tuple(annotations)
+
+    def _set_order(self, order: Iterable[int]) -> None:
+        self._order = array("i", order)
+        positions = array("i", bytes(self._n_entries * 4))
+        for row, entry_index in enumerate(self._order):
+            positions[entry_index] = row
+        self._positions = positions
+
+    def annotate(self, order: Iterable[int]) -> None:
+        """並び順(行番号 -> entry_listのインデックス)を設定し、注釈を作り直す
+        各グループの一番上のentryだけを求め、entryごとの注釈は参照された時に作成する。
+        """
+        self._set_order(order)
+        for group in self._groups:
+            self._update_top(group)
+        for condition_class in self._classes:
+            for names in condition_class.name_buckets:
+                self._update_bucket_top(condition_class, names)
+        self._annotations = {}
+
+    def update(
+        self, order: Sequence[int], moved: Iterable[int], changed_rows: Iterable[int]
+    ) -> set[int]:
+        """movedのentryを移動した後の注釈に更新し、注釈が変化したentryを返す
+        changed_rowsは移動でentryが変わった行(1行の移動では、移動元と移動先の間の行)で、
+        その行の位置だけを更新する(全体の行番号は求め直さない)。
+        移動していないentry同士の上下関係は変わらないため、移動したentryと、一番上のentryが
+        変わった(または移動した)グループの条件に包含されるentryだけを更新する。
+        まだ参照されていない(注釈を作成していない)entryは対象外。
+        """
+        for row in changed_rows:
+            entry_index = order[row]
+            self._order[row] = entry_index
+            self._positions[entry_index] = row
+        moved = set(moved)
+        affected = set(moved)
+        changed_classes = set()
+        for group in {self._entry_groups[entry_index] for entry_index in moved}:
+            if group is None:
+                continue
+            if self._update_top(group) or group.top in moved:
+                self._update_bucket_top(group.condition_class, group.names)
+                changed_classes.add(group.condition_class)
+        for condition_class in changed_classes:
+            for covered in condition_class.covered:
+                for group in covered.groups:
+                    affected.update(group.members)
+
+        changed = set()
+        for entry_index in affected:
+            previous = self._annotations.get(entry_index)
+            if previous is None:
+                continue
+            annotations = self._compute_annotations(entry_index)
+            if annotations != previous:
+                self._annotations[entry_index] = annotations
+                changed.add(entry_index)
+        return changed
+
+    def position(self, entry_index: int) -> int:
+        """entryの(最後にannotate・updateした時点の)行番号"""
+        return self._positions[entry_index]
+
+    def annotations(self, entry_index: int) -> tuple[Overlap, ...]:
+        """entryより上にあるフィルタとの重なり(上にあるものから順)"""
+        annotations = self._annotations.get(entry_index)
+        if annotations is None:
+            annotations = self._annotations[entry_index] = self._compute_annotations(entry_index)
+        return annotations
+
+    def count(self, kind: str) -> int:
+        """注釈の種類ごとのentry数(全てのentryの注釈を作成する)"""
+        return sum(
+            1
+            for entry_index in range(self._n_entries)
+            if any(overlap.kind == kind for overlap in self.annotations(entry_index))
+        )
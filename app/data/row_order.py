@@ -0,0 +1,132 @@
+from array import array
+from itertools import chain
+from typing import Iterable, Iterator, Union
+
+# 1チャンクあたりの行数の目安(この2倍を超えたチャンクは分割する)
+CHUNK_SIZE = 512
+
+
+class RowOrder:
+    """行番号 -> entry_listのインデックスの対応を保持する
+    行をCHUNK_SIZE程度のチャンク(整数配列)に分けて持ち、チャンクの行数をFenwick木で管理する。
+    行番号からチャンクの位置の検索・1行の挿入・削除がO(log n)(+チャンク内の移動)で行えるため、
+    k行の移動は全行数によらずO(k log n)で済む。
+    listと同じ操作(インデックス・insert・pop・del・スライス代入)でCheckPointの操作を適用できる。
+    """
+
+    def __init__(self, values: Iterable[int] = ()):
+        self._set_values(array("i", values))
+
+    def _set_values(self, values: array) -> None:
+        self._chunks = [values[i : i + CHUNK_SIZE] for i in range(0, len(values), CHUNK_SIZE)]
+        if not self._chunks:
+            self._chunks = [array("i")]
+        self._n_rows = len(values)
+        self._build_tree()
+
+    def _build_tree(self) -> None:
+        """チャンクの行数のFenwick木を作り直す(チャンクの分割・削除時のみ)"""
+        n_chunks = len(self._chunks)
+        tree = [0] * (n_chunks + 1)
+        for i, chunk in enumerate(self._chunks, 1):
+            tree[i] += len(chunk)
+            parent = i + (i & -i)
+            if parent <= n_chunks:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self._top_bit = 1 << (n_chunks.bit_length() - 1) if n_chunks else 0
+
+    def _add_count(self, chunk_index: int, delta: int) -> None:
+        i = chunk_index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _locate(self, row: int) -> tuple[int, int]:
+        """行番号を(チャンクの位置, チャンク内の位置)に変換する"""
+        chunk_index = 0
+        bit = self._top_bit
+        while bit:
+            next_index = chunk_index + bit
+            if next_index < len(self._tree) and self._tree[next_index] <= row:
+                chunk_index = next_index
+                row -= self._tree[next_index]
+            bit >>= 1
+        return chunk_index, row
+
+    def _normalize(self, row: int) -> int:
+        if row < 0:
+            row += self._n_rows
+        if not 0 <= row < self._n_rows:
+            raise IndexError("row index out of range")
+        return row
+
+    def __len__(self) -> int:
+        return self._n_rows
+
+    def __iter__(self) -> Iterator[int]:
+        return chain.from_iterable(self._chunks)
+
+    def __getitem__(self, row: Union[int, slice]) -> Union[int, array]:
+        if isinstance(row, slice):
+            return self.to_array()[row]
+        chunk_index, offset = self._locate(self._normalize(row))
+        return self._chunks[chunk_index][offset]
+
+    def __setitem__(self, row: Union[int, slice], value: Union[int, Iterable[int]]) -> None:
+        if isinstance(row, slice):
+            # NOTE: 並び替え等で全体を置き換える場合のみ使うため、作り直す
+            values = self.to_array()
+            values[row] = array("i", value)
+            self._set_values(values)
+            return
+        chunk_index, offset = self._locate(self._normalize(row))
+        self._chunks[chunk_index][offset] = value
+
+    def __delitem__(self, row: int) -> None:
+        chunk_index, offset = self._locate(self._normalize(row))
+        chunk = self._chunks[chunk_index]
+        del chunk[offset]
+        self._n_rows -= 1
+        if not chunk and len(self._chunks) > 1:
+            del self._chunks[chunk_index]
+            self._build_tree()
+        else:
+            self._add_count(chunk_index, -1)
+
+    def insert(self, row: int, value: int) -> None:
+        row = max(0, min(row + self._n_rows if row < 0 else row, self._n_rows))
+        if row == self._n_rows:
+            chunk_index, offset = len(self._chunks) - 1, len(self._chunks[-1])
+        else:
+            chunk_index, offset = self._locate(row)
+        chunk = self._chunks[chunk_index]
+        chunk.insert(offset, value)
+        self._n_rows += 1
+        if len(chunk) > CHUNK_SIZE * 2:
+            self._chunks[chunk_index : chunk_index + 1] = [chunk[:CHUNK_SIZE], chunk[CHUNK_SIZE:]]
+            self._build_tree()
+        else:
+            self._add_count(chunk_index, 1)
+
+    def pop(self, row: int = -1) -> int:
+        value = self[row]
+        del self[row]
+        return value
+
+    def extend(self, values: Iterable[int]) -> None:
+        values = array("i", values)
+        last = self._chunks[-1]
+        n_fill = max(CHUNK_SIZE - len(last), 0)
+        last.extend(values[:n_fill])
+        self._chunks.extend(
+            values[i : i + CHUNK_SIZE] for i in range(n_fill, len(values), CHUNK_SIZE)
+        )
+        self._n_rows += len(values)
+        self._build_tree()
+
+    def to_array(self) -> array:
+        values = array("i")
+        for chunk in self._chunks:
+            values.extend(chunk)
+        return values
@@ -0,0 +1,146 @@
+import re
+from array import array
+from bisect import bisect_left, insort
+from functools import lru_cache
+from typing import Iterable, Union
+
+from app.data.filter_entry import FilterEntry
+
+# 検索対象のプロパティ名(categoryも検索対象)
+SEARCH_PROPERTY_NAMES = ("from", "to", "subject", "hasTheWord", "label")
+# ドメインを抽出するプロパティ名
+ADDRESS_PROPERTY_NAMES = ("from", "to")
+
+WORD_PATTERN = re.compile(r"\w+")
+ADDRESS_PATTERN = re.compile(r"[\w.+\-*]+@[\w\-]+(?:\.[\w\-]+)+")
+DOMAIN_PATTERN = re.compile(r"(?:^|(?<=[@\s(,{*]))((?:[\w\-]+\.)+[\w\-]+)")
+# 値ごとのトークンをキャッシュする件数(ラベル・カテゴリ等、同じ値が多いものに効く)
+TOKEN_CACHE_SIZE = 4096
+
+
+def tokenize(text: str) -> set[str]:
+    """文字列を検索用のトークン(単語・メールアドレス)に分割する"""
+    text = text.casefold()
+    tokens = set(WORD_PATTERN.findall(text))
+    tokens.update(ADDRESS_PATTERN.findall(text))
+    return tokens
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def _tokenize_value(value: str) -> frozenset[str]:
+    """プロパティの値のトークン(ラベル等の同じ値はキャッシュを使う)"""
+    return frozenset(tokenize(value))
+
+
+def extract_domains(text: str) -> set[str]:
+    """メールアドレス・ドメインからドメインと上位のドメインを取り出す
+    mail.example.comの場合はmail.example.com, example.comを返す(トップレベルドメインは除く)。
+    """
+    domains = set()
+    for domain in DOMAIN_PATTERN.findall(text.casefold()):
+        parts = domain.strip(".").split(".")
+        for i in range(len(parts) - 1):
+            domains.add(".".join(parts[i:]))
+    return domains
+
+
+class SearchIndex:
+    """FilterEntryの転置インデックス
+    トークン・ドメインごとにentry_listのインデックスの配列を保持する。
+    前方一致の検索用にトークンをソートした一覧も保持し、entryの追加時は追加分だけ登録する。
+    NOTE: 読み込んだentryは変更されない(読み込み中の追加のみ)ため、登録の削除はできない。
+    entry_listを置き換えた場合はインデックスを作り直す。
+    """
+
+    def __init__(self):
+        self._postings: dict[str, array] = {}
+        self._domains: dict[str, array] = {}
+        self._sorted_tokens: list[str] = []
+        self._n_entries = 0
+
+    def __len__(self) -> int:
+        return self._n_entries
+
+    @staticmethod
+    def _entry_keys(entry: FilterEntry) -> tuple[set[str], set[str]]:
+        """entryの検索用のトークンとドメインを返す"""
+        tokens = set(_tokenize_value(entry.category or ""))
+        domains: set[str] = set()
+        for name, value in entry.items():
+            if value is None or name not in SEARCH_PROPERTY_NAMES:
+                continue
+            tokens.update(_tokenize_value(value))
+            if name in ADDRESS_PROPERTY_NAMES:
+                domains.update(extract_domains(value))
+        return tokens, domains
+
+    def add(self, index: int, entry: FilterEntry) -> None:
+        """entry_list[index]のentryを登録する"""
+        tokens, domains = self._entry_keys(entry)
+        for token in tokens:
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = array("i")
+                insort(self._sorted_tokens, token)
+            posting.append(index)
+        for domain in domains:
+            self._domains.setdefault(domain, array("i")).append(index)
+        self._n_entries += 1
+
+    def extend(self, entries: Iterable[tuple[int, FilterEntry]]) -> None:
+        """entryをまとめて登録する(新しいトークンの並び替えは最後に1回だけ行う)"""
+        n_tokens = len(self._postings)
+        postings = self._postings
+        for index, entry in entries:
+            tokens, domains = self._entry_keys(entry)
+            for token in tokens:
+                posting = postings.get(token)
+                if posting is None:
+                    posting = postings[token] = array("i")
+                posting.append(index)
+            for domain in domains:
+                self._domains.setdefault(domain, array("i")).append(index)
+            self._n_entries += 1
+        if len(postings) != n_tokens:
+            self._sorted_tokens = sorted(postings)
+
+    def lookup_token(self, token: str) -> set[int]:
+        return set(self._postings.get(token.casefold(), ()))
+
+    def lookup_prefix(self, prefix: str) -> set[int]:
+        prefix = prefix.casefold()
+        result: set[int] = set()
+        start = bisect_left(self._sorted_tokens, prefix)
+        for i in range(start, len(self._sorted_tokens)):
+            token = self._sorted_tokens[i]
+            if not token.startswith(prefix):
+                break
+            result.update(self._postings[token])
+        return result
+
+    def lookup_domain(self, domain: str) -> set[int]:
+        """ドメイン(サブドメインを含む)を条件に持つentryを返す"""
+        return set(self._domains.get(domain.casefold().strip("@."), ()))
+
+    def search(self, query: str) -> Union[set[int], None]:
+        """検索文字列に一致するentry_listのインデックスを返す(検索条件が無い場合はNone)
+        空白区切りの各条件を全て満たすentryを返す。条件の書式は下記の通り。
+            word   : トークンが一致する
+            word*  : トークンが前方一致する
+            @domain: from/toのドメイン(サブドメインを含む)が一致する
+        """
+        result: Union[set[int], None] = None
+        for term in query.split():
+            if term.startswith("@") and len(term) > 1:
+                matched = self.lookup_domain(term[1:])
+            elif term.endswith("*") and len(term) > 1:
+                matched = self.lookup_prefix(term[:-1])
+            else:
+                # NOTE: メールアドレス等は単語にも分割されるため、全ての単語を含むentryを返す
+                tokens = tokenize(term) or {term.casefold()}
+                postings = sorted((self._postings.get(token, ()) for token in tokens), key=len)
+                matched = set(postings[0]).intersection(*postings[1:])
+            result = matched if result is None else result & matched
+            if not result:
+                return result
+        return result
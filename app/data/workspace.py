@@ -0,0 +1,97 @@
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Collection, Hashable, Union
+
+# NOTE: Viewerが起動時にimportするため、テーブル・メールの処理のモジュールはimportしない
+if TYPE_CHECKING:
+    from app.data.check_point import CheckPoint, SortIndicator
+    from app.data.mail_replay import ReplayResult
+
+# 開いている全てのxml(ドキュメント)のメモリ使用量の見積もりの上限の既定値[byte]
+DEFAULT_MEMORY_BUDGET = 512 * 1024 * 1024
+# 1entryあたりのメモリ使用量の見積もり[byte](100000件のxmlをtracemallocで計測した値)
+# 圧縮: entry(共有する文字列を除く)・並び順・xmlのバイト範囲
+COMPACT_ENTRY_BYTES = 450
+# 展開: 圧縮に加えて表示用の文字列・検索のインデックス・ソートのキー・重なりの解析結果
+EXPANDED_ENTRY_BYTES = 2600
+# テーブル(ウィジェット)1つあたりのメモリ使用量の見積もり[byte]
+TABLE_BYTES = 1024 * 1024
+
+
+def estimate_bytes(n_entries: int, is_expanded: bool) -> int:
+    """ドキュメントのメモリ使用量の見積もり"""
+    if is_expanded:
+        return n_entries * EXPANDED_ENTRY_BYTES + TABLE_BYTES
+    return n_entries * COMPACT_ENTRY_BYTES
+
+
+@dataclass
+class CompactDocument:
+    """非アクティブなドキュメントの、テーブルを作り直すために必要な状態
+    entryはFilterDataに残し、テーブル・表示用の文字列・検索のインデックス・重なりの解析結果は破棄する。
+    """
+
+    # 並び順(行番号 -> entry_listのインデックス)
+    order: array
+    # Undo/Redo用の操作履歴と、ヘッダーに表示していたソート情報
+    check_point: "CheckPoint"
+    sort_indicator: "SortIndicator"
+    # メールボックスの判定結果(entryごとの件数のみのため残す)
+    replay_result: Union["ReplayResult", None]
+
+
+class DocumentLru:
+    """開いているドキュメントを最後に使った順に管理する
+    メモリ使用量の見積もりの合計がmemory_budgetを超えた場合は、最も長く使っていない
+    展開済みのドキュメントから順に、圧縮するドキュメントとして返す。
+    """
+
+    def __init__(self, memory_budget: int = DEFAULT_MEMORY_BUDGET):
+        self._memory_budget = memory_budget
+        # ドキュメント -> (entry数, 展開済みか)(最後に使ったものが末尾)
+        self._documents: OrderedDict[Hashable, tuple[int, bool]] = OrderedDict()
+
+    @property
+    def memory_budget(self) -> int:
+        return self._memory_budget
+
+    @memory_budget.setter
+    def memory_budget(self, memory_budget: int) -> None:
+        self._memory_budget = memory_budget
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(estimate_bytes(*state) for state in self._documents.values())
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._documents
+
+    def update(self, key: Hashable, n_entries: int, is_expanded: bool) -> None:
+        """ドキュメントのentry数・状態を更新する(使った順は変えない)"""
+        self._documents[key] = (n_entries, is_expanded)
+
+    def touch(self, key: Hashable) -> None:
+        """ドキュメントを最後に使ったものにする"""
+        self._documents.move_to_end(key)
+
+    def remove(self, key: Hashable) -> None:
+        self._documents.pop(key, None)
+
+    def evictions(self, keep: Collection[Hashable] = ()) -> list[Hashable]:
+        """予算に収めるために圧縮するドキュメント(keepは圧縮しない)を、使った順が古いものから返す
+        全て圧縮しても予算を超える場合は、圧縮できるドキュメントを全て返す。
+        """
+        excess = self.total_bytes - self._memory_budget
+        evictions = []
+        for key, (n_entries, is_expanded) in self._documents.items():
+            if excess <= 0:
+                break
+            if not is_expanded or key in keep:
+                continue
+            evictions.append(key)
+            excess -= estimate_bytes(n_entries, True) - estimate_bytes(n_entries, False)
+        return evictions
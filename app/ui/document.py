@@ -0,0 +1,111 @@
+import os
+from array import array
+from typing import TYPE_CHECKING, Iterator, Union
+
+from PyQt5.QtWidgets import QVBoxLayout, QWidget
+
+from app.data.filter_data import FilterData
+from app.data.workspace import CompactDocument
+from app.ui.table_view import DraggableTableView
+
+if TYPE_CHECKING:
+    from app.data.edit_journal import EditJournal
+    from app.ui.worker import LoadWorker, OverlapWorker, ReplayWorker, Worker
+
+
+class Document:
+    """タブ1つ分のxml(FilterDataとテーブル)と、そのバックグラウンド処理
+    compactでテーブル(表示用の文字列・検索のインデックス等を含む)を削除し、
+    entryと並び順・操作履歴だけを残す。再度表示する時はset_tableで新しいテーブルに引き継ぐ。
+    """
+
+    def __init__(self, xml_path: str):
+        self.xml_path = xml_path
+        self.filter_data = FilterData()
+        self.table: Union[DraggableTableView, None] = None
+        # compactした場合の、テーブルを作り直すために必要な状態
+        self.compact_state: Union[CompactDocument, None] = None
+        self.journal: Union["EditJournal", None] = None
+        self.load_worker: Union["LoadWorker", None] = None
+        self.overlap_worker: Union["OverlapWorker", None] = None
+        self.replay_worker: Union["ReplayWorker", None] = None
+
+        # タブのページ(テーブルはこの中に配置し、compact後もページは残す)
+        self.page = QWidget()
+        self._layout = QVBoxLayout(self.page)
+        self._layout.setContentsMargins(0, 0, 0, 0)
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.xml_path)
+
+    @property
+    def n_entries(self) -> int:
+        return len(self.filter_data.entry_list)
+
+    @property
+    def is_expanded(self) -> bool:
+        return self.table is not None
+
+    @property
+    def order(self) -> array:
+        """現在の並び順(compact済みの場合はcompactした時の並び順)"""
+        if self.table is None:
+            return self.compact_state.order
+        return self.table.model().order
+
+    @property
+    def is_loading(self) -> bool:
+        return self.load_worker is not None
+
+    def workers(self) -> Iterator["Worker"]:
+        """実行中のバックグラウンド処理"""
+        for worker in (self.load_worker, self.overlap_worker, self.replay_worker):
+            if worker is not None:
+                yield worker
+
+    def set_table(self, table: DraggableTableView) -> None:
+        """テーブルをページに配置する(compact済みの場合は並び順・操作履歴等を引き継ぐ)"""
+        state = self.compact_state
+        if state is not None:
+            model = table.model()
+            model.reset(state.order)
+            model.set_replay_result(state.replay_result)
+            table.restore_history(state.check_point, state.sort_indicator)
+            self.compact_state = None
+        self.table = table
+        self._layout.addWidget(table)
+
+    def compact(self) -> None:
+        """テーブルを削除し、並び順・操作履歴・メールボックスの判定結果だけを残す
+        重なりの解析結果はテーブルと一緒に破棄する(解析中の場合は中断する)。
+        """
+        if self.table is None:
+            return
+        model = self.table.model()
+        self.compact_state = CompactDocument(
+            model.order, self.table.check_point, self.table.sort_indicator, model.replay_result
+        )
+        if self.overlap_worker is not None:
+            self.overlap_worker.cancel()
+            self.overlap_worker = None
+        self._delete_table()
+        # 表示用の文字列はテーブルを作り直した後に表示した行だけ作成する
+        for entry in self.filter_data.entry_list:
+            entry.render_cache = None
+
+    def _delete_table(self) -> None:
+        self._layout.removeWidget(self.table)
+        # NOTE: レイアウトから外すだけではウィジェットが残るため、削除する
+        self.table.deleteLater()
+        self.table = None
+
+    def close(self) -> None:
+        """バックグラウンド処理を中断し、テーブルとページを削除する(ジャーナルは閉じない)"""
+        for worker in self.workers():
+            worker.cancel()
+        self.load_worker = self.overlap_worker = self.replay_worker = None
+        if self.table is not None:
+            self._delete_table()
+        self.compact_state = None
+        self.page.deleteLater()
@@ -0,0 +1,426 @@
+from array import array
+from bisect import bisect_left
+from typing import Any, Iterable, Sequence, Union
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+from PyQt5.QtGui import QColor
+
+from app.common.decorator import traced
+from app.common.trace import TRACER
+from app.data.check_point import (
+    BlockMoveOperation,
+    MoveOperation,
+    Operation,
+    PermutationOperation,
+    SwapOperation,
+)
+from app.data.filter_data import FilterData, render_entry
+from app.data.filter_entry import FilterEntry
+from app.data.filter_sort import (
+    SORT_KEY_NAMES,
+    FilterSorter,
+    rank_values,
+    sort_permutation,
+    text_sort_key,
+)
+from app.data.mail_replay import ReplayResult
+from app.data.overlap import CONFLICT, SHADOWED, OverlapAnalyzer
+from app.data.row_order import RowOrder
+from app.data.search_index import SearchIndex
+
+# 上にあるフィルタと重なる行の背景色(種類が複数ある場合はconflictを優先する)
+OVERLAP_COLORS = {SHADOWED: QColor(235, 235, 235), CONFLICT: QColor(255, 220, 220)}
+OVERLAP_LABELS = {SHADOWED: "Shadowed", CONFLICT: "Conflict"}
+# ツールチップに表示する重なりの最大件数
+MAX_OVERLAP_TOOLTIPS = 5
+# メールボックスの判定結果をセットした場合に末尾に追加する列(一致件数, 現在の並び順で最初に一致した件数)
+REPLAY_HEADER = ["hits", "first match"]
+# 判定できない条件(ラベル・日付等)を含むフィルタの件数の表示
+UNSUPPORTED_TEXT = "?"
+
+
+class FilterTableModel(QAbstractTableModel):
+    """FilterDataを直接参照するテーブルモデル
+    行番号とentry_listのインデックスの対応(order)だけを保持し、
+    表示文字列はビューから要求された行だけを作成する(作成した文字列はentryにキャッシュされる)。
+
+    検索で絞り込んでいる場合は、一致した行だけを表示する。
+    その場合、表示上の行番号(row)と全体での行番号(source_row)は異なり、
+    並び順・操作履歴は常に全体での行番号で扱う。
+
+    フィルタの重なりの解析結果(OverlapAnalyzer)をセットした場合は、上にあるフィルタと
+    重なる行を背景色とツールチップで示し、行の移動に合わせて差分だけ更新する。
+
+    メールボックスの判定結果(ReplayResult)をセットした場合は、フィルタごとの一致件数と
+    現在の並び順で最初に一致した件数の列を末尾に追加する(後者は並び順が変わるたびに求め直す)。
+    """
+
+    def __init__(self, filter_data: FilterData, header: list[str], parent=None):
+        super().__init__(parent)
+        self._filter_data = filter_data
+        self._header = header
+        self._order = RowOrder(range(len(filter_data.entry_list)))
+        self._sorter = FilterSorter(filter_data.entry_list)
+        # 検索用のインデックス(最初に検索した時に作成する)
+        self._search_index: Union[SearchIndex, None] = None
+        self._search_query = ""
+        # 検索に一致したentry_listのインデックスと、その全体での行番号(昇順)
+        self._matched: Union[set[int], None] = None
+        self._visible_rows = array("i")
+        # フィルタの重なりの解析結果(解析が終わるまではNone)
+        self._overlaps: Union[OverlapAnalyzer, None] = None
+        # メールボックスの判定結果と、entryごとの一致件数・最初に一致した件数の表示文字列
+        self._replay: Union[ReplayResult, None] = None
+        self._hit_texts: list[str] = []
+        self._first_match_texts: Union[list[str], None] = None
+
+    @property
+    def filter_data(self) -> FilterData:
+        return self._filter_data
+
+    @property
+    def header(self) -> list[str]:
+        return self._header
+
+    @property
+    def order(self) -> array:
+        """現在の並び順(行番号 -> entry_listのインデックス)"""
+        return self._order.to_array()
+
+    @property
+    def is_filtered(self) -> bool:
+        return self._matched is not None
+
+    @property
+    def search_query(self) -> str:
+        return self._search_query
+
+    @property
+    def overlaps(self) -> Union[OverlapAnalyzer, None]:
+        return self._overlaps
+
+    @property
+    def replay_result(self) -> Union[ReplayResult, None]:
+        return self._replay
+
+    @property
+    def n_source_rows(self) -> int:
+        """絞り込み前の行数"""
+        return len(self._order)
+
+    def source_row(self, row: int) -> int:
+        """表示上の行番号を全体での行番号に変換する"""
+        return row if self._matched is None else self._visible_rows[row]
+
+    def proxy_row(self, source_row: int) -> Union[int, None]:
+        """全体での行番号を表示上の行番号に変換する(表示されていない場合はNone)"""
+        if self._matched is None:
+            return source_row
+        row = bisect_left(self._visible_rows, source_row)
+        if row < len(self._visible_rows) and self._visible_rows[row] == source_row:
+            return row
+        return None
+
+    def entry_index(self, row: int) -> int:
+        return self._order[self.source_row(row)]
+
+    def row_texts(self, row: int) -> list[str]:
+        """指定した行の表示文字列を返す"""
+        entry_index = self.entry_index(row)
+        texts = self._filter_data.table_row(entry_index)
+        if self._replay is None:
+            return texts
+        return texts + self._replay_texts(entry_index)
+
+    def _cell_text(self, entry_index: int, column: int) -> str:
+        if column < len(self._header):
+            return self._filter_data.table_row(entry_index)[column]
+        return self._replay_texts(entry_index)[column - len(self._header)]
+
+    def _replay_texts(self, entry_index: int) -> list[str]:
+        if self._first_match_texts is None:
+            self._first_match_texts = self._count_texts(
+                self._replay.first_match_counts(self._order)
+            )
+        return [self._hit_texts[entry_index], self._first_match_texts[entry_index]]
+
+    def _count_texts(self, counts: Sequence[int]) -> list[str]:
+        unsupported = self._replay.unsupported
+        return [
+            UNSUPPORTED_TEXT if entry_index in unsupported else str(count)
+            for entry_index, count in enumerate(counts)
+        ]
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self._order) if self._matched is None else len(self._visible_rows)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self._header) + (0 if self._replay is None else len(REPLAY_HEADER))
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return self._cell_text(self.entry_index(index.row()), index.column())
+        if role == Qt.ToolTipRole:
+            return self._tooltip(index)
+        if role == Qt.BackgroundRole:
+            return self._overlap_color(index.row())
+        if role == Qt.TextAlignmentRole:
+            if index.column() >= len(self._header):
+                return int(Qt.AlignRight | Qt.AlignVCenter)
+            return int(Qt.AlignLeft | Qt.AlignVCenter)
+        return None
+
+    def _overlap_color(self, row: int) -> Union[QColor, None]:
+        if self._overlaps is None:
+            return None
+        kinds = {overlap.kind for overlap in self._overlaps.annotations(self.entry_index(row))}
+        if not kinds:
+            return None
+        return OVERLAP_COLORS[CONFLICT if CONFLICT in kinds else SHADOWED]
+
+    def _tooltip(self, index: QModelIndex) -> str:
+        """セルの文字列に、上にあるフィルタとの重なりの説明を追加する"""
+        text = self._cell_text(self.entry_index(index.row()), index.column())
+        if self._overlaps is None:
+            return text
+        annotations = self._overlaps.annotations(self.entry_index(index.row()))
+        if not annotations:
+            return text
+        lines = [
+            f"{OVERLAP_LABELS[overlap.kind]}: priority {overlap.other + 1}"
+            f" [{render_entry(self._filter_data.entry_list[overlap.other])[0]}] {overlap.detail}"
+            for overlap in annotations[:MAX_OVERLAP_TOOLTIPS]
+        ]
+        if len(annotations) > MAX_OVERLAP_TOOLTIPS:
+            lines.append(f"... and {len(annotations) - MAX_OVERLAP_TOOLTIPS} more")
+        return "\n".join([text, ""] + lines)
+
+    def headerData(self, section: int, orientation: int, role: int = Qt.DisplayRole) -> Any:
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            if section >= len(self._header):
+                return REPLAY_HEADER[section - len(self._header)]
+            return self._header[section]
+        return super().headerData(section, orientation, role)
+
+    def flags(self, index: QModelIndex) -> Qt.ItemFlags:
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsDragEnabled
+        return flags if index.isValid() else flags | Qt.ItemIsDropEnabled
+
+    def supportedDropActions(self) -> Qt.DropActions:
+        return Qt.MoveAction
+
+    def sort_order(self, column: int, order: int = Qt.AscendingOrder) -> array:
+        """指定した列で並び替えた場合の並び順(新しい行番号 -> 元の行番号)を返す
+        列名がソートのキー名の場合は型に合わせたキー(priorityは数値等)で比較する。
+        """
+        descending = order == Qt.DescendingOrder
+        name = self._header[column] if column < len(self._header) else None
+        if name in SORT_KEY_NAMES:
+            return self._sorter.sort_order(self._order, [(name, descending)])
+        ranks, n_ranks = rank_values(
+            text_sort_key(self._cell_text(entry_index, column)) for entry_index in self._order
+        )
+        return sort_permutation([(ranks, n_ranks, descending)], range(len(self._order)))
+
+    @traced
+    def apply_operation(self, operation: Operation) -> None:
+        """行の入れ替え・移動・並び替えの操作を並び順に適用する"""
+        if self._matched is not None:
+            # NOTE: 絞り込み中は表示上の行番号が操作と対応しないため、まとめて更新する
+            self.layoutAboutToBeChanged.emit()
+            if isinstance(operation, PermutationOperation):
+                self._permute(operation)
+            else:
+                operation.apply(self._order)
+            self._update_visible_rows()
+            self.layoutChanged.emit()
+        elif isinstance(operation, SwapOperation):
+            operation.apply(self._order)
+            for row in (operation.source_row, operation.target_row):
+                self.dataChanged.emit(self.index(row, 0), self.index(row, self.columnCount() - 1))
+        elif isinstance(operation, MoveOperation):
+            source_row, target_row = operation.source_row, operation.target_row
+            destination = target_row + 1 if source_row < target_row else target_row
+            self.beginMoveRows(QModelIndex(), source_row, source_row, QModelIndex(), destination)
+            operation.apply(self._order)
+            self.endMoveRows()
+        elif isinstance(operation, BlockMoveOperation):
+            self.layoutAboutToBeChanged.emit()
+            operation.apply(self._order)
+            self.layoutChanged.emit()
+        else:
+            self.layoutAboutToBeChanged.emit()
+            self._permute(operation)
+            self.layoutChanged.emit()
+        self._update_overlaps(operation)
+        self._update_first_matches()
+
+    def _moved_rows(self, operation: Operation) -> Union[tuple[Sequence[int], Iterable[int]], None]:
+        """操作で移動した行と、entryが変わった行(並び替えの場合は全体のためNone)
+        1行・複数行の移動では、移動元と移動先の間の行も詰めてずれる。
+        """
+        if isinstance(operation, SwapOperation):
+            rows = (operation.source_row, operation.target_row)
+            return rows, rows
+        if isinstance(operation, MoveOperation):
+            first, last = sorted((operation.source_row, operation.target_row))
+            return (operation.target_row,), range(first, last + 1)
+        if isinstance(operation, BlockMoveOperation):
+            rows = (*operation.source_rows, *operation.destination_rows)
+            return operation.destination_rows, range(min(rows), max(rows) + 1)
+        return None
+
+    def _update_overlaps(self, operation: Operation) -> None:
+        """操作で上下関係が変わったフィルタの重なりの注釈を更新する"""
+        if self._overlaps is None:
+            return
+        moved_rows = self._moved_rows(operation)
+        if moved_rows is None:
+            # NOTE: 並び替え後はほぼ全行の表示が変わるため、layoutChangedの再描画に任せる
+            self._overlaps.annotate(self._order)
+            return
+        rows, changed_rows = moved_rows
+        moved = [self._order[row] for row in rows]
+        for entry_index in self._overlaps.update(self._order, moved, changed_rows):
+            row = self.proxy_row(self._overlaps.position(entry_index))
+            if row is not None:
+                self.dataChanged.emit(self.index(row, 0), self.index(row, self.columnCount() - 1))
+
+    def _update_first_matches(self) -> None:
+        """並び順が変わったため、最初に一致した件数の列を求め直す(次に表示する時に作成する)"""
+        if self._replay is None:
+            return
+        self._first_match_texts = None
+        column = self.columnCount() - 1
+        if self.rowCount() > 0:
+            self.dataChanged.emit(self.index(0, column), self.index(self.rowCount() - 1, column))
+
+    def set_replay_result(self, result: Union[ReplayResult, None]) -> None:
+        """メールボックスの判定結果をセットし、一致件数の列を追加する(Noneの場合は列を削除する)"""
+        if result is not None and result.n_entries != len(self._filter_data.entry_list):
+            # NOTE: 判定後にentryが追加された場合は結果が古いため使わない
+            return
+        first_column = len(self._header)
+        last_column = first_column + len(REPLAY_HEADER) - 1
+        if result is None:
+            if self._replay is not None:
+                self.beginRemoveColumns(QModelIndex(), first_column, last_column)
+                self._set_replay(None)
+                self.endRemoveColumns()
+            return
+        if self._replay is None:
+            self.beginInsertColumns(QModelIndex(), first_column, last_column)
+            self._set_replay(result)
+            self.endInsertColumns()
+            return
+        self._set_replay(result)
+        if self.rowCount() > 0:
+            self.dataChanged.emit(
+                self.index(0, first_column), self.index(self.rowCount() - 1, last_column)
+            )
+
+    def _set_replay(self, result: Union[ReplayResult, None]) -> None:
+        self._replay = result
+        self._first_match_texts = None
+        self._hit_texts = [] if result is None else self._count_texts(result.hit_counts())
+
+    def set_overlap_analyzer(self, analyzer: Union[OverlapAnalyzer, None]) -> None:
+        """フィルタの重なりの解析結果をセットする(解析後に並び順が変わった場合は注釈を作り直す)"""
+        if analyzer is not None:
+            if analyzer.n_entries != len(self._filter_data.entry_list):
+                # NOTE: 解析後にentryが追加された場合は結果が古いため使わない
+                return
+            order = self._order.to_array()
+            if analyzer.order != order:
+                analyzer.annotate(order)
+        self._overlaps = analyzer
+        if self.rowCount() > 0:
+            self.dataChanged.emit(
+                self.index(0, 0), self.index(self.rowCount() - 1, self.columnCount() - 1)
+            )
+
+    def _permute(self, operation: PermutationOperation) -> None:
+        # NOTE: 並び替え後に追加読み込みされた行は末尾のまま残す
+        n_rows = len(operation.order)
+        order = self._order.to_array()
+        self._order[:n_rows] = array("i", map(order.__getitem__, operation.order))
+
+    def _update_visible_rows(self) -> None:
+        """検索に一致したentryの全体での行番号を求め直す"""
+        matched = self._matched
+        self._visible_rows = array(
+            "i", (row for row, entry_index in enumerate(self._order) if entry_index in matched)
+        )
+
+    def set_search_query(self, query: str) -> None:
+        """検索文字列に一致する行だけを表示する(空の場合は全行を表示する)
+        インデックスは最初の検索時に作成し、表示の更新は1回のリセットで行う。
+        """
+        self._search_query = query
+        matched = None
+        if query.strip():
+            if self._search_index is None:
+                self._search_index = SearchIndex()
+                self._search_index.extend(enumerate(self._filter_data.entry_list))
+            matched = self._search_index.search(query)
+        self.beginResetModel()
+        self._matched = matched
+        if matched is not None:
+            self._update_visible_rows()
+        self.endResetModel()
+
+    @traced
+    def append_entries(self, entry_list: Sequence[FilterEntry]) -> None:
+        """FilterDataにentryを追加し、テーブルの末尾に行を追加する"""
+        if not entry_list:
+            return
+        TRACER.add_rows(len(entry_list))
+        first_row = len(self._order)
+        first_index = len(self._filter_data.entry_list)
+        if self._search_index is not None:
+            self._search_index.extend(enumerate(entry_list, first_index))
+        # NOTE: 重なりの解析結果・メールボックスの判定結果は追加前のentryのみが対象のため破棄する
+        self._overlaps = None
+        self.set_replay_result(None)
+        if self._matched is None:
+            self.beginInsertRows(QModelIndex(), first_row, first_row + len(entry_list) - 1)
+            self._filter_data.extend_entry_list(entry_list)
+            self._order.extend(range(first_index, first_index + len(entry_list)))
+            self.endInsertRows()
+            return
+
+        # 絞り込み中は、追加したentryのうち検索に一致したものだけを表示する
+        self._filter_data.extend_entry_list(entry_list)
+        self._order.extend(range(first_index, first_index + len(entry_list)))
+        matched = self._search_index.search(self._search_query) or set()
+        new_matched = sorted(idx for idx in matched if idx >= first_index)
+        if not new_matched:
+            self._matched = matched
+            return
+        first_visible_row = len(self._visible_rows)
+        self.beginInsertRows(
+            QModelIndex(), first_visible_row, first_visible_row + len(new_matched) - 1
+        )
+        self._matched = matched
+        self._visible_rows.extend(first_row + idx - first_index for idx in new_matched)
+        self.endInsertRows()
+
+    def reset(self, order: Union[array, None] = None) -> None:
+        """FilterDataの内容が変わった時に並び順を作り直す"""
+        self.beginResetModel()
+        n_entries = len(self._filter_data.entry_list)
+        self._order = RowOrder(range(n_entries) if order is None else order)
+        self._sorter = FilterSorter(self._filter_data.entry_list)
+        self._search_index = None
+        self._search_query = ""
+        self._matched = None
+        self._visible_rows = array("i")
+        self._overlaps = None
+        self._set_replay(None)
+        self.endResetModel()
@@ -0,0 +1,14 @@
+from enum import Enum
+
+
+class SizingPolicy(Enum):
+    """行の入れ替え後などに列幅をどう調整するか
+    DraggableTableViewは行の高さが固定で、列幅は読み込み時・列の追加時に表示付近の行だけを計測する
+    (RESIZE_CONTENTS_PRECISION)。並び替えでは各列のセルの集合は変わらないため、INCREMENTALでは
+    何も計測し直さず、FULLでは操作のたびに列幅を計測し直す。
+    """
+
+    # 毎回列幅を計測し直して調整する
+    FULL = "full"
+    # 内容が変わった場合だけ計測し直す(並び替えでは計測しない)
+    INCREMENTAL = "incremental"
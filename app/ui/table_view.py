@@ -0,0 +1,262 @@
+from array import array
+from typing import Iterable, Union
+
+from PyQt5.QtCore import QItemSelection, QItemSelectionModel, Qt, pyqtSignal
+from PyQt5.QtGui import QDropEvent
+from PyQt5.QtWidgets import QAbstractItemView, QHeaderView, QTableView
+
+from app.common.decorator import override, traced
+from app.data.check_point import (
+    DEFAULT_MAX_BYTES,
+    DEFAULT_MAX_DEPTH,
+    NO_SORT_INDICATOR,
+    BlockMoveOperation,
+    CheckPoint,
+    Operation,
+    PermutationOperation,
+    SortIndicator,
+    SwapOperation,
+)
+from app.ui.table_model import FilterTableModel
+from app.ui.table_sizing import SizingPolicy
+
+# 列幅の自動調整時に文字幅を計測する行数
+RESIZE_CONTENTS_PRECISION = 200
+
+
+class DraggableTableView(QTableView):
+    """ドラッグアンドドロップで行を入れ替え可能なTableView
+    FilterTableModelと組み合わせて使う。表示中の行だけが描画されるため、
+    大量のフィルタでもDraggableTableWidgetより高速に表示できる。
+    """
+
+    # 行の入れ替え・ソート・Undo/Redoで操作履歴が変化した時に通知する
+    history_changed = pyqtSignal()
+    # 並び順に操作(Undo/Redoで適用した操作を含む)を適用した時に通知する
+    operation_applied = pyqtSignal(object)
+
+    def __init__(
+        self,
+        model: FilterTableModel,
+        row_widths: list[Union[int, None]],
+        history_depth: Union[int, None] = DEFAULT_MAX_DEPTH,
+        history_bytes: Union[int, None] = DEFAULT_MAX_BYTES,
+        sizing_policy: SizingPolicy = SizingPolicy.INCREMENTAL,
+    ):
+        super().__init__()
+        model.setParent(self)
+        self.setModel(model)
+        self.setDragEnabled(True)
+        self.setAcceptDrops(True)
+        self.setDragDropMode(QAbstractItemView.InternalMove)
+        self.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.setDropIndicatorShown(True)
+        self.setDefaultDropAction(Qt.MoveAction)
+        self._row_widths = row_widths
+        self._sizing_policy = sizing_policy
+
+        # 行の高さは固定にして、全行の文字サイズ計測を行わない
+        self.setWordWrap(False)
+        self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.horizontalHeader().setResizeContentsPrecision(RESIZE_CONTENTS_PRECISION)
+
+        # Undo/Redo用の操作履歴
+        self._check_point = CheckPoint(history_depth, history_bytes)
+
+        # セルソート時のアクション追加
+        self._sort_indicator = NO_SORT_INDICATOR
+        self.horizontalHeader().setSortIndicatorShown(True)
+        self.horizontalHeader().setSortIndicator(*NO_SORT_INDICATOR)
+        self.horizontalHeader().sectionClicked.connect(self._sort_action)
+
+        # テーブルの設定(サイズとか)
+        self.adjust_columns()
+        self.adjust_setting()
+
+    @property
+    def header(self):
+        return self.model().header
+
+    @property
+    def n_rows(self):
+        return self.model().rowCount()
+
+    @property
+    def n_source_rows(self):
+        """検索で絞り込む前の行数"""
+        return self.model().n_source_rows
+
+    @property
+    def n_columns(self):
+        return self.model().columnCount()
+
+    @property
+    def row_widths(self):
+        return self._row_widths
+
+    @property
+    def sizing_policy(self):
+        return self._sizing_policy
+
+    @property
+    def check_point(self) -> CheckPoint:
+        return self._check_point
+
+    @property
+    def sort_indicator(self) -> SortIndicator:
+        return self._sort_indicator
+
+    @property
+    def n_undo(self):
+        return self._check_point.n_undo
+
+    @property
+    def n_redo(self):
+        return self._check_point.n_redo
+
+    @override
+    def dropEvent(self, event: QDropEvent) -> None:
+        """ドラッグアンドドロップで行を入れ替えるイベント関数
+        1行の場合はドロップ先の行と入れ替え、複数行の場合はドロップ先の位置にまとめて移動する。
+        """
+        if event.source() == self:
+            target_row = self.indexAt(event.pos()).row()
+            selected_rows = self.selected_rows()
+            if not selected_rows or target_row < 0:
+                return
+            target_row = self.model().source_row(target_row)
+            if len(selected_rows) == 1:
+                self.swap(selected_rows[0], target_row)
+                return
+            if self.dropIndicatorPosition() == QAbstractItemView.BelowItem:
+                target_row += 1
+            # 移動する行を除いた後の位置に変換する
+            position = target_row - sum(1 for row in selected_rows if row < target_row)
+            self.move_rows(selected_rows, position)
+
+    def _set_sort_indicator(self, sort_indicator: SortIndicator) -> None:
+        """ソート情報をヘッダーに表示する"""
+        self._sort_indicator = sort_indicator
+        self.horizontalHeader().blockSignals(True)
+        self.horizontalHeader().setSortIndicator(*sort_indicator)
+        self.horizontalHeader().blockSignals(False)
+
+    @traced
+    def _apply_operation(self, operation: Operation) -> None:
+        """操作をモデルに適用する"""
+        self.model().apply_operation(operation)
+        if isinstance(operation, PermutationOperation):
+            self._set_sort_indicator(operation.sort_indicator)
+        else:
+            self._set_sort_indicator(NO_SORT_INDICATOR)
+        if isinstance(operation, BlockMoveOperation):
+            # 移動した行を選択したままにする
+            self._select_rows(operation.destination_rows)
+
+        # NOTE: 行の高さは固定のため、INCREMENTALでは調整不要
+        # (並び替えでは各列のセルの集合は変わらないため、列幅も変わらない)
+        if self._sizing_policy == SizingPolicy.FULL:
+            self.adjust_columns()
+        self.operation_applied.emit(operation)
+
+    def _sort_action(self, section: int) -> None:
+        """列名クリック時のソートアクション関数"""
+        sort_indicator = (section, int(self.horizontalHeader().sortIndicatorOrder()))
+        order = self.model().sort_order(*sort_indicator)
+        self.execute(PermutationOperation(order, sort_indicator, self._sort_indicator))
+
+    def execute(self, operation: Operation) -> None:
+        """操作をテーブルに適用し、操作履歴に保存する"""
+        self._apply_operation(operation)
+        self._check_point.resist_operation(operation)
+        self.history_changed.emit()
+
+    def undo(self) -> None:
+        """直前の操作をUndoする"""
+        operation = self._check_point.undo_operation()
+        if operation is not None:
+            self._apply_operation(operation)
+        self.history_changed.emit()
+
+    def redo(self) -> None:
+        """Undoした操作をRedoする"""
+        operation = self._check_point.redo_operation()
+        if operation is not None:
+            self._apply_operation(operation)
+        self.history_changed.emit()
+
+    @traced
+    def swap(self, source_row: int, target_row: int) -> None:
+        """指定した行のデータを入れ替える"""
+        if source_row == target_row:
+            return
+        self.execute(SwapOperation(source_row, target_row))
+
+    def selected_rows(self) -> list[int]:
+        """選択中の行の全体での行番号(検索で絞り込む前の行番号)を昇順で返す"""
+        model = self.model()
+        return sorted(
+            model.source_row(index.row()) for index in self.selectionModel().selectedRows()
+        )
+
+    def _select_rows(self, source_rows: Iterable[int]) -> None:
+        """指定した行を選択する(連続した行はまとめて選択する)"""
+        selection = QItemSelection()
+        last_column = self.model().columnCount() - 1
+        start = end = None
+        rows = (self.model().proxy_row(source_row) for source_row in source_rows)
+        for row in (row for row in rows if row is not None):
+            if start is not None and row == end + 1:
+                end = row
+                continue
+            if start is not None:
+                selection.select(self.model().index(start, 0), self.model().index(end, last_column))
+            start = end = row
+        if start is not None:
+            selection.select(self.model().index(start, 0), self.model().index(end, last_column))
+            self.scrollTo(self.model().index(start, 0))
+        self.selectionModel().select(selection, QItemSelectionModel.ClearAndSelect)
+
+    @traced
+    def move_rows(self, rows: Iterable[int], position: int) -> None:
+        """指定した行(連続していなくてもよい)をposition行目から順にまとめて移動する
+        行番号は検索で絞り込む前の行番号で指定する。
+        """
+        rows = sorted(set(rows))
+        if not rows:
+            return
+        position = max(0, min(position, self.n_source_rows - len(rows)))
+        operation = BlockMoveOperation.to_position(rows, position)
+        if operation.is_identity:
+            return
+        self.execute(operation)
+
+    def move_selected_rows(self, position: int) -> None:
+        """選択中の行をposition行目から順にまとめて移動する"""
+        self.move_rows(self.selected_rows(), position)
+
+    def reset_order(self, order: array) -> None:
+        """並び順を置き換え、操作履歴を破棄する(操作として通知しない)"""
+        self.model().reset(order)
+        self._check_point.clear()
+        self._set_sort_indicator(NO_SORT_INDICATOR)
+        self.history_changed.emit()
+
+    def restore_history(self, check_point: CheckPoint, sort_indicator: SortIndicator) -> None:
+        """別のテーブルから引き継いだ操作履歴・ソート情報に置き換える(並び順は変更しない)"""
+        self._check_point = check_point
+        self._set_sort_indicator(sort_indicator)
+        self.history_changed.emit()
+
+    def adjust_columns(self) -> None:
+        """テーブルの列幅を調整する(表示付近の行のみ計測する)"""
+        self.resizeColumnsToContents()
+        # 特定のカラム幅を固定
+        for idx, row_width in enumerate(self._row_widths):
+            if row_width is not None:
+                self.setColumnWidth(idx, row_width)
+
+    def adjust_setting(self) -> None:
+        """テーブル情報を調整する"""
+        # サイズのポリシー設定
+        self.setSizeAdjustPolicy(QAbstractItemView.AdjustToContents)
@@ -1,26 +1,43 @@
-from dataclasses import dataclass
-from typing import Union
+from array import array
+from typing import Iterable, Union
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtGui import QDropEvent
 from PyQt5.QtWidgets import QAbstractItemView, QTableWidget, QTableWidgetItem
 
-from app.common.decorator import override
-from app.data.check_point import CheckPoint
-
-
-@dataclass
-class State:
-    texts: list[list[str]]
-    #set_sorting_enabled: bool
-    sort_indicator_section: int
-    sort_indicator_order: int
+from app.common.decorator import override, traced
+from app.common.trace import TRACER
+from app.data.check_point import (
+    DEFAULT_MAX_BYTES,
+    DEFAULT_MAX_DEPTH,
+    NO_SORT_INDICATOR,
+    BlockMoveOperation,
+    CheckPoint,
+    MoveOperation,
+    Operation,
+    PermutationOperation,
+    SortIndicator,
+    SwapOperation,
+)
+from app.data.filter_sort import rank_values, sort_permutation, text_sort_key
 
 
 class DraggableTableWidget(QTableWidget):
     """ドラッグアンドドロップで行を入れ替え可能なTableWidget"""
+
+    # 行の入れ替え・ソート・Undo/Redoで操作履歴が変化した時に通知する
+    history_changed = pyqtSignal()
+
     def __init__(
-        self, header: list[str], n_rows: int, n_columns: int, row_widths: list[Union[int, None]], edit_enable: bool = True, init_texts: list[list[str]] = []
+        self,
+        header: list[str],
+        n_rows: int,
+        n_columns: int,
+        row_widths: list[Union[int, None]],
+        edit_enable: bool = True,
+        init_texts: list[list[str]] = [],
+        history_depth: Union[int, None] = DEFAULT_MAX_DEPTH,
+        history_bytes: Union[int, None] = DEFAULT_MAX_BYTES,
     ):
         super().__init__(n_rows, n_columns)
         self.setHorizontalHeaderLabels(header)
@@ -36,11 +53,15 @@ class DraggableTableWidget(QTableWidget):
         self._row_widths = row_widths
         self._edit_enable = edit_enable
 
-        # Undo/Redo用のデータ保存処理
-        self._check_point = CheckPoint()
+        # Undo/Redo用の操作履歴
+        self._check_point = CheckPoint(history_depth, history_bytes)
 
         # セルソート時のアクション追加
-        self.horizontalHeader().sectionPressed.connect(self._sort_action)
+        # NOTE: ソートはQtに任せず、並び替え結果を操作履歴に残すため自前で行う
+        self._sort_indicator = NO_SORT_INDICATOR
+        self.horizontalHeader().setSortIndicatorShown(True)
+        self.horizontalHeader().setSortIndicator(*NO_SORT_INDICATOR)
+        self.horizontalHeader().sectionClicked.connect(self._sort_action)
 
         # データの挿入
         self._set_table_texts(init_texts)
@@ -71,98 +92,170 @@ class DraggableTableWidget(QTableWidget):
 
     @override
     def dropEvent(self, event: QDropEvent) -> None:
-        """ドラッグアンドドロップで行を入れ替えるイベント関数"""
+        """ドラッグアンドドロップで行を入れ替えるイベント関数
+        1行の場合はドロップ先の行と入れ替え、複数行の場合はドロップ先の位置にまとめて移動する。
+        """
         if event.source() == self:
             target_row = self.indexAt(event.pos()).row()
-            selected_rows = self.selectionModel().selectedRows()
+            selected_rows = sorted(index.row() for index in self.selectionModel().selectedRows())
             if not selected_rows:
                 return
-            source_row = selected_rows[0].row()
-            self.swap(source_row, target_row)
-
-    def _set_table_texts(self, table_texts: list[list[str]], is_sorting: bool = False):
+            # NOTE: 行の無い位置にドロップした場合は何もしない
+            if target_row < 0:
+                return
+            if len(selected_rows) == 1:
+                self.swap(selected_rows[0], target_row)
+                return
+            if self.dropIndicatorPosition() == QAbstractItemView.BelowItem:
+                target_row += 1
+            # 移動する行を除いた後の位置に変換する
+            position = target_row - sum(1 for row in selected_rows if row < target_row)
+            self.move_rows(selected_rows, position)
+
+    @traced
+    def _set_table_texts(self, table_texts: list[list[str]]):
         """テーブルデータをセットする"""
+        self.blockSignals(True)
         for row_idx, row_data in enumerate(table_texts):
             for col_idx, item in enumerate(row_data):
                 table_item = QTableWidgetItem(item)
                 table_item.setTextAlignment(Qt.AlignLeft | Qt.AlignVCenter)
                 if not self._edit_enable:
-                    table_item.setFlags(table_item.flags() & ~Qt.ItemIsEditable)  # セルを編集不可に設定
+                    # セルを編集不可に設定
+                    table_item.setFlags(table_item.flags() & ~Qt.ItemIsEditable)
                 self.setItem(row_idx, col_idx, table_item)
+        self.blockSignals(False)
+
+        TRACER.add_rows(len(table_texts))
 
         # テーブルの設定(サイズとか)
         self.adjust_columns()
         self.adjust_rows()
-        self.adjust_setting(is_sorting)
-
-    def _get_state(self) -> State:
-        """現在のテーブル情報(データ、ソート情報)を取得"""
-        texts = []
-        for row in range(self.rowCount()):
-            row_data = []
-            for col in range(self.columnCount()):
-                item = self.item(row, col)
-                row_data.append(item.text() if item else "")
-            texts.append(row_data)
-        return State(texts, self.horizontalHeader().sortIndicatorSection(), self.horizontalHeader().sortIndicatorOrder())
-
-    def _set_state(self, state: State) -> None:
-        """テーブル情報(データ、ソート情報)をセットする"""
-        self.setRowCount(0)
-        self.setRowCount(len(state.texts))
-        self.setSortingEnabled(False)
-
-        # テーブル値をセット
-        is_sorting = True if state.sort_indicator_section > 0 else False
-        self._set_table_texts(state.texts, is_sorting)
-
-        # ソート情報をセット
-        self.horizontalHeader().setSortIndicator(state.sort_indicator_section, state.sort_indicator_order)
-
-    def _sort_action(self) -> None:
-        """列名クリック時のソートアクション関数"""
-        self.save()
-        self.setSortingEnabled(True)
-
-    def save(self) -> None:
-        """現在のテーブル情報(データ、ソート情報)を保存する"""
-        curr_state = self._get_state()
-        self._check_point.resist_state(curr_state)
-
-    def undo(self) -> None:
-        """テーブル情報(データ、ソート情報)をUndoする"""
-        curr_state = self._get_state()
-        next_state = self._check_point.undo_state(curr_state)
-        self._set_state(next_state)
-
-    def redo(self) -> None:
-        """テーブル情報(データ、ソート情報)をRedoする"""
-        curr_state = self._get_state()
-        next_state = self._check_point.redo_state(curr_state)
-        self._set_state(next_state)
-
-    def swap(self, source_row: int, target_row: int) -> None:
-        """指定した行のデータを入れ替える"""
-        if source_row == target_row:
-            return
+        self.adjust_setting()
 
-        # バックアップ
-        self.save()
+    def _set_sort_indicator(self, sort_indicator: SortIndicator) -> None:
+        """ソート情報をヘッダーに表示する"""
+        self._sort_indicator = sort_indicator
+        self.horizontalHeader().blockSignals(True)
+        self.horizontalHeader().setSortIndicator(*sort_indicator)
+        self.horizontalHeader().blockSignals(False)
 
-        # 保存元の行のデータ
+    def _swap_rows(self, source_row: int, target_row: int) -> None:
+        """指定した2行のアイテムを入れ替える"""
         source_data = [self.takeItem(source_row, col) for col in range(self.columnCount())]
         target_data = [self.takeItem(target_row, col) for col in range(self.columnCount())]
-
-        # 行のデータを入れ替える
         for col in range(self.columnCount()):
             self.setItem(target_row, col, source_data[col])
             self.setItem(source_row, col, target_data[col])
 
+    def _move_row(self, source_row: int, target_row: int) -> None:
+        """指定した行のアイテムをtarget_rowへ移動する"""
+        items = [self.takeItem(source_row, col) for col in range(self.columnCount())]
+        self.removeRow(source_row)
+        self.insertRow(target_row)
+        for col, item in enumerate(items):
+            self.setItem(target_row, col, item)
+
+    def _permute_rows(self, order: array) -> None:
+        """order[新しい行番号] = 元の行番号 となるようにアイテムを並び替える"""
+        items = [
+            [self.takeItem(row, col) for col in range(self.columnCount())]
+            for row in range(self.rowCount())
+        ]
+        for new_row, old_row in enumerate(order):
+            for col, item in enumerate(items[old_row]):
+                self.setItem(new_row, col, item)
+
+    def _block_move_rows(self, operation: BlockMoveOperation) -> None:
+        """複数行をまとめて移動する(位置が変わる行のアイテムのみ付け替える)"""
+        order = operation.permutation(self.rowCount())
+        moved_rows = [
+            (new_row, old_row) for new_row, old_row in enumerate(order) if new_row != old_row
+        ]
+        items = {
+            old_row: [self.takeItem(old_row, col) for col in range(self.columnCount())]
+            for _, old_row in moved_rows
+        }
+        for new_row, old_row in moved_rows:
+            for col, item in enumerate(items[old_row]):
+                self.setItem(new_row, col, item)
+
+    @traced
+    def _apply_operation(self, operation: Operation) -> None:
+        """操作をテーブルに適用する"""
+        # NOTE: アイテムの付け替えごとにcellChangedが発火しないようにする
+        self.blockSignals(True)
+        if isinstance(operation, SwapOperation):
+            self._swap_rows(operation.source_row, operation.target_row)
+            self._set_sort_indicator(NO_SORT_INDICATOR)
+        elif isinstance(operation, MoveOperation):
+            self._move_row(operation.source_row, operation.target_row)
+            self._set_sort_indicator(NO_SORT_INDICATOR)
+        elif isinstance(operation, BlockMoveOperation):
+            self._block_move_rows(operation)
+            self._set_sort_indicator(NO_SORT_INDICATOR)
+        else:
+            self._permute_rows(operation.order)
+            self._set_sort_indicator(operation.sort_indicator)
+        self.blockSignals(False)
+
         # テーブル関連の更新
         self.adjust_columns()
         self.adjust_rows()
         self.adjust_setting()
 
+    def _sort_action(self, section: int) -> None:
+        """列名クリック時のソートアクション関数
+        クリック時にヘッダーが切り替えたソート情報で並び替え、並び替え結果を履歴に残す。
+        """
+        header = self.horizontalHeader()
+        sort_indicator = (section, int(header.sortIndicatorOrder()))
+        # NOTE: 数値の列は数値として比較する(文字列での比較では"10"が"2"より前になるため)
+        ranks, n_ranks = rank_values(
+            text_sort_key(self.item(row, section).text()) for row in range(self.rowCount())
+        )
+        descending = sort_indicator[1] == Qt.DescendingOrder
+        order = sort_permutation([(ranks, n_ranks, descending)], range(self.rowCount()))
+        self.execute(PermutationOperation(order, sort_indicator, self._sort_indicator))
+
+    def execute(self, operation: Operation) -> None:
+        """操作をテーブルに適用し、操作履歴に保存する"""
+        self._apply_operation(operation)
+        self._check_point.resist_operation(operation)
+        self.history_changed.emit()
+
+    def undo(self) -> None:
+        """直前の操作をUndoする"""
+        operation = self._check_point.undo_operation()
+        if operation is not None:
+            self._apply_operation(operation)
+        self.history_changed.emit()
+
+    def redo(self) -> None:
+        """Undoした操作をRedoする"""
+        operation = self._check_point.redo_operation()
+        if operation is not None:
+            self._apply_operation(operation)
+        self.history_changed.emit()
+
+    @traced
+    def swap(self, source_row: int, target_row: int) -> None:
+        """指定した行のデータを入れ替える"""
+        if source_row == target_row:
+            return
+        self.execute(SwapOperation(source_row, target_row))
+
+    def move_rows(self, rows: Iterable[int], position: int) -> None:
+        """指定した行(連続していなくてもよい)をposition行目から順にまとめて移動する"""
+        rows = sorted(set(rows))
+        if not rows:
+            return
+        position = max(0, min(position, self.rowCount() - len(rows)))
+        operation = BlockMoveOperation.to_position(rows, position)
+        if operation.is_identity:
+            return
+        self.execute(operation)
+
     def adjust_columns(self) -> None:
         """テーブルの列幅を調整する"""
         # カラムの幅を自動調整
@@ -177,9 +270,7 @@ class DraggableTableWidget(QTableWidget):
         # 行の高さを自動調整
         self.resizeRowsToContents()
 
-    def adjust_setting(self, is_sorting: bool = False) -> None:
+    def adjust_setting(self) -> None:
         """テーブル情報を調整する"""
         # サイズのポリシー設定
         self.setSizeAdjustPolicy(QAbstractItemView.AdjustToContents)
-        # ソート設定
-        self.setSortingEnabled(is_sorting)
@@ -1,93 +1,616 @@
 import os
+from array import array
 from datetime import datetime
 from functools import partial
-from tkinter import messagebox
-
-from PyQt5.QtCore import Qt
-from PyQt5.QtWidgets import QAction, QMainWindow, QTableWidgetItem, QVBoxLayout, QWidget
-
-from app.common.adjuster import FilterXmlAdjuster
-from app.data.filter_data import FilterData
-from app.ui.table_widget import DraggableTableWidget
+from typing import TYPE_CHECKING, Union
+
+from PyQt5.QtCore import QThreadPool, QTimer
+from PyQt5.QtGui import QCloseEvent, QPaintEvent
+from PyQt5.QtWidgets import (
+    QAction,
+    QFileDialog,
+    QInputDialog,
+    QLineEdit,
+    QMainWindow,
+    QMessageBox,
+    QProgressBar,
+    QPushButton,
+    QTabWidget,
+    QVBoxLayout,
+    QWidget,
+)
+
+from app.common.decorator import override
+from app.common.trace import TRACER
+from app.data.workspace import DEFAULT_MEMORY_BUDGET, DocumentLru
+from app.ui.table_sizing import SizingPolicy
+
+# NOTE: 最初のウィンドウを早く表示するため、xmlの読み込み・テーブル表示に使うモジュールは
+# 初めて使う時にimportする
+if TYPE_CHECKING:
+    from app.data.check_point import Operation
+    from app.data.consolidate import ConsolidationPlan
+    from app.data.filter_cache import FilterCache
+    from app.data.filter_data import FilterData
+    from app.data.mail_replay import ReplayResult
+    from app.ui.document import Document
+    from app.ui.table_view import DraggableTableView
+    from app.ui.worker import (
+        LoadResult,
+        LoadWorker,
+        OverlapResult,
+        OverlapWorker,
+        ReplayWorker,
+        Worker,
+    )
+    from app.ui.xml_directory import XmlDirectoryIndex, XmlFileInfo
 
 XML_DIRPATH = "./xml_file"
+TRACE_DIRPATH = "./trace"
 TITLE = "Gmail filter table view"
 
 HEADER = ["priority", "category", "condition", "label", "process"]
 WIDTHS = [None, None, 500, None, None]
+# INCREMENTALでは、並び替えの後に列幅を計測し直さない
+SIZING_POLICY = SizingPolicy.INCREMENTAL
+# 検索バーの入力が止まってから検索するまでの時間
+SEARCH_DELAY_MSEC = 200
+# 編集のジャーナルをディスクに書き込む間隔
+JOURNAL_SYNC_MSEC = 1000
+# 開いている全てのxmlのメモリ使用量の見積もりの上限[byte]
+# 超えた場合は最も長く表示していないタブからテーブルを削除し、並び順・操作履歴だけを残す
+MEMORY_BUDGET = DEFAULT_MEMORY_BUDGET
+# フィルタをまとめる前の確認で、詳細に表示するまとめたフィルタの数の上限
+CONSOLIDATION_PREVIEW_LIMIT = 1000
 
 
 class Viewer(QMainWindow):
-    def __init__(self):
+    def __init__(self, memory_budget: int = MEMORY_BUDGET):
         super().__init__()
-        self._filter_data = FilterData()
-        self._table = None
-        self._curr_xml_path = None
+        # タブのページ -> 開いているxml
+        self._documents: dict[QWidget, "Document"] = {}
+        self._document_lru = DocumentLru(memory_budget)
+        self._progress_worker: Union["Worker", None] = None
+        self._workers: set["Worker"] = set()
+        # 初回の描画後に作成する
+        self._filter_cache: Union["FilterCache", None] = None
+        self._xml_directory: Union["XmlDirectoryIndex", None] = None
+        self._is_painted = False
         self._init_ui()
 
+    def _create_filter_cache(self) -> Union["FilterCache", None]:
+        """読み込んだxmlのキャッシュを作成(キャッシュフォルダを作成できない場合は使わない)"""
+        from app.data.filter_cache import FilterCache
+
+        try:
+            return FilterCache()
+        except OSError:
+            return None
+
     def _init_ui(self):
         """UI作成"""
         self._create_layout()
         self._create_menubar()
         self.resize(self.width(), self.height())
 
+    @override
+    def paintEvent(self, event: QPaintEvent) -> None:
+        """初回の描画後に、起動時の表示に不要な処理(xmlフォルダの確認等)を開始する"""
+        super().paintEvent(event)
+        if not self._is_painted:
+            self._is_painted = True
+            QTimer.singleShot(0, self._init_after_first_paint)
+
+    def _init_after_first_paint(self) -> None:
+        self._filter_cache = self._create_filter_cache()
+        self._start_xml_directory()
+
+    @property
+    def _document(self) -> Union["Document", None]:
+        """表示中のタブのxml"""
+        return self._documents.get(self._tabs.currentWidget())
+
+    @property
+    def _table(self) -> Union["DraggableTableView", None]:
+        """表示中のタブのテーブル"""
+        document = self._document
+        return None if document is None else document.table
+
+    @override
+    def closeEvent(self, event: QCloseEvent) -> None:
+        """ウィンドウを閉じる時に実行中の処理を中断する"""
+        for worker in self._workers:
+            worker.cancel()
+        for document in self._documents.values():
+            self._close_journal(document)
+        if self._xml_directory is not None:
+            self._xml_directory.cancel()
+        event.accept()
+
+    def _start_worker(self, worker: "Worker", message: str) -> None:
+        """バックグラウンド処理を開始し、進捗を表示する"""
+        self._workers.add(worker)
+        worker.signals.progress.connect(partial(self._show_progress, worker))
+        for signal in (worker.signals.finished, worker.signals.failed, worker.signals.canceled):
+            signal.connect(partial(self._finish_worker, worker))
+
+        self._progress_worker = worker
+        self._progress_bar.setRange(0, 0)
+        self._progress_bar.setVisible(True)
+        self._cancel_button.setVisible(True)
+        self.statusBar().showMessage(message)
+        QThreadPool.globalInstance().start(worker)
+
+    def _show_progress(self, worker: "Worker", n_done: int, n_total: int) -> None:
+        """バックグラウンド処理の進捗を表示する"""
+        if worker is not self._progress_worker:
+            return
+        self._progress_bar.setRange(0, n_total)
+        self._progress_bar.setValue(n_done)
+
+    def _finish_worker(self, worker: "Worker", *args) -> None:
+        """バックグラウンド処理の終了時に進捗表示を消す"""
+        self._workers.discard(worker)
+        if worker is not self._progress_worker:
+            return
+        self._progress_worker = None
+        self._progress_bar.setVisible(False)
+        self._cancel_button.setVisible(False)
+
+    def _cancel_worker(self) -> None:
+        """進捗表示中のバックグラウンド処理を中断する"""
+        if self._progress_worker is not None:
+            self._progress_worker.cancel()
+
     def _export_filter_xml(self) -> None:
         """並び替えたテーブルデータをxmlで出力"""
-        if self._table is None:
+        document = self._document
+        if document is None or document.table is None or document.is_loading:
+            return
+        from app.data.filter_writer import export_xml_path
+
+        # NOTE: テーブルの並び順で出力される(各entryは読み込んだxmlのバイト列のまま。
+        # xmlが変更されていた場合はGmailと同じ書式(シングルクォート、閉じタグ付き)で出力し直す)
+        # 出力中もテーブルを編集できるよう、現在の並び順のスナップショットを別スレッドで出力する
+        order = document.table.model().order
+        self._start_export(
+            document.filter_data.snapshot(order),
+            export_xml_path(document.xml_path),
+            document,
+            order,
+        )
+
+    def _start_export(
+        self,
+        filter_data: "FilterData",
+        xml_path: str,
+        document: Union["Document", None] = None,
+        order: Union[array, None] = None,
+    ) -> None:
+        """filter_dataをxmlで出力する
+        documentを指定した場合は、出力完了時にorderの並び順を出力済みとしてジャーナルに記録する。
+        """
+        from app.ui.worker import ExportWorker
+
+        worker = ExportWorker(filter_data, xml_path)
+        if document is not None:
+            worker.signals.finished.connect(partial(self._mark_exported, document, order))
+        worker.signals.finished.connect(self._finish_export)
+        worker.signals.failed.connect(self._fail_export)
+        worker.signals.canceled.connect(self.statusBar().clearMessage)
+        self._start_worker(worker, f"Exporting: {xml_path}")
+
+    def _finish_export(self, xml_path: str) -> None:
+        self.statusBar().showMessage(f"Exported: {xml_path}")
+        QMessageBox.information(
+            self, "Export xml successfully!", f"下記パスにxmlを保存しました。\n{xml_path}"
+        )
+
+    def _mark_exported(self, document: "Document", order: array, xml_path: str) -> None:
+        """出力した並び順までの編集を、次に開いた時に復元の対象にしない"""
+        if document.journal is None:
+            return
+        try:
+            # NOTE: 出力中に編集した場合は、出力後の編集として現在の並び順も記録する
+            document.journal.mark_exported(order, document.order)
+        except OSError as e:
+            self._close_journal(document)
+            self.statusBar().showMessage(f"Edit journal is disabled: {e}")
+
+    def _fail_export(self, message: str) -> None:
+        self.statusBar().clearMessage()
+        QMessageBox.critical(self, "Export xml failure...", f"xmlの出力に失敗しました。\n{message}")
+
+    def _consolidate_filter_xml(self) -> None:
+        """fromだけが異なるフィルタをまとめた結果を求め、確認後にxmlで出力する"""
+        document = self._document
+        if document is None or document.table is None or document.is_loading:
+            return
+        from app.ui.worker import ConsolidateWorker
+
+        worker = ConsolidateWorker(document.filter_data.entry_list, document.table.model().order)
+        worker.signals.finished.connect(partial(self._confirm_consolidation, document))
+        worker.signals.failed.connect(self._fail_export)
+        worker.signals.canceled.connect(self.statusBar().clearMessage)
+        self._start_worker(worker, f"Consolidating: {document.xml_path}")
+
+    def _confirm_consolidation(self, document: "Document", plan: "ConsolidationPlan") -> None:
+        """まとめる前後のフィルタ数とまとめるフィルタを表示し、確認後にまとめたxmlを出力する
+        テーブルは変更しない(出力したxmlを読み込むと、まとめた後のフィルタを表示できる)。
+        """
+        self.statusBar().clearMessage()
+        if self._documents.get(document.page) is not document:
+            return
+        if not plan.merges:
+            QMessageBox.information(
+                self, "Consolidate filters", f"{document.name}にまとめられるフィルタはありません。"
+            )
             return
 
-        def export_xml_path(xml_path):
-            base, ext = os.path.splitext(xml_path)
-            return datetime.now().strftime(f"{base}(tooledit_%Y%m%d-%H%M%S){ext}")
+        from app.data.consolidate import consolidated_data
+        from app.data.filter_writer import export_xml_path
 
-        xml_path = export_xml_path(self._curr_xml_path)
-        priority_list = [
-            int(self._table.item(row, 0).text()) - 1 for row in range(self._table.rowCount())
+        skipped = []
+        if plan.n_blocked:
+            skipped.append(
+                f"間にあるフィルタの優先度が変わるため分けたフィルタ: {plan.n_blocked}件"
+            )
+        if plan.n_split:
+            skipped.append(f"条件が長くなりすぎるため分けたフィルタ: {plan.n_split}件")
+        message_box = QMessageBox(
+            QMessageBox.Question,
+            "Consolidate filters",
+            f"{document.name}のフィルタを{plan.n_entries}件から{len(plan.entry_list)}件に"
+            f"まとめます({plan.n_removed + len(plan.merges)}件を{len(plan.merges)}件に統合)。\n"
+            + "".join(f"{line}\n" for line in skipped)
+            + "まとめたxmlを出力しますか?",
+            QMessageBox.Yes | QMessageBox.No,
+            self,
+        )
+        message_box.setDetailedText(self._consolidation_preview(plan))
+        if message_box.exec() != QMessageBox.Yes:
+            return
+        # NOTE: まとめた後のentryは求めた時点のものを出力する(確認中の編集は反映しない)
+        self._start_export(
+            consolidated_data(document.filter_data, plan), export_xml_path(document.xml_path)
+        )
+
+    @staticmethod
+    def _consolidation_preview(plan: "ConsolidationPlan") -> str:
+        """まとめるフィルタの優先度(まとめた後の位置 <- 移動するフィルタ)とまとめた後の条件"""
+        lines = [
+            f"#{merge.rows[0] + 1} <- {', '.join(f'#{row + 1}' for row in merge.rows[1:])}: "
+            f"from:({merge.value})"
+            for merge in plan.merges[:CONSOLIDATION_PREVIEW_LIMIT]
         ]
-        self._filter_data.sort_entry_list(priority_list)
-        self._filter_data.export_xml(xml_path)
+        if len(plan.merges) > CONSOLIDATION_PREVIEW_LIMIT:
+            lines.append(f"... ({len(plan.merges) - CONSOLIDATION_PREVIEW_LIMIT} more)")
+        return "\n".join(lines)
+
+    def _replay_mbox(self) -> None:
+        """mboxのファイルを選択してメールを判定する"""
+        mailbox_path, _ = QFileDialog.getOpenFileName(self, "Replay mbox")
+        if mailbox_path:
+            self._start_replay(mailbox_path)
+
+    def _replay_maildir(self) -> None:
+        """Maildirのフォルダを選択してメールを判定する"""
+        mailbox_path = QFileDialog.getExistingDirectory(self, "Replay Maildir")
+        if mailbox_path:
+            self._start_replay(mailbox_path)
+
+    def _start_replay(self, mailbox_path: str) -> None:
+        """メールボックスの全てのメールを表示中のタブのフィルタで判定し、一致件数をテーブルに表示する"""
+        document = self._document
+        if document is None or document.table is None or document.is_loading:
+            return
+        from app.ui.worker import ReplayWorker
+
+        if document.replay_worker is not None:
+            document.replay_worker.cancel()
+        worker = ReplayWorker(document.filter_data.entry_list, mailbox_path)
+        document.replay_worker = worker
+        worker.signals.finished.connect(partial(self._finish_replay, document, worker))
+        worker.signals.failed.connect(partial(self._fail_replay, document, worker))
+        worker.signals.canceled.connect(self.statusBar().clearMessage)
+        self._start_worker(worker, f"Replaying: {mailbox_path}")
+
+    def _finish_replay(
+        self, document: "Document", worker: "ReplayWorker", result: "ReplayResult"
+    ) -> None:
+        """フィルタごとの一致件数・最初に一致した件数の列を表示する"""
+        if worker is not document.replay_worker:
+            return
+        document.replay_worker = None
+        if document.table is None:
+            # 判定中にテーブルを削除した場合は、次にテーブルを作り直す時に表示する
+            document.compact_state.replay_result = result
+        else:
+            model = document.table.model()
+            model.set_replay_result(result)
+            for column in range(len(model.header), model.columnCount()):
+                document.table.resizeColumnToContents(column)
+        unsupported = f", {len(result.unsupported)} filters skipped" if result.unsupported else ""
+        rate = result.n_messages / result.elapsed if result.elapsed > 0 else 0
+        self.statusBar().showMessage(
+            f"Replayed {result.n_messages} messages ({result.n_unmatched} unmatched{unsupported})"
+            f" in {result.elapsed:.1f}s ({rate:,.0f} messages/s): {result.mailbox_path}"
+        )
+
+    def _fail_replay(self, document: "Document", worker: "ReplayWorker", message: str) -> None:
+        if worker is not document.replay_worker:
+            return
+        document.replay_worker = None
+        self.statusBar().clearMessage()
+        QMessageBox.critical(
+            self, "Replay failure...", f"メールボックスの読み込みに失敗しました。\n{message}"
+        )
 
-        # NOTE: ["]を[']に変換したり、閉じタグを追加したりする
-        FilterXmlAdjuster().minor_adjustment(xml_path)
+    def _close_document(self, document: "Document") -> None:
+        """xmlのタブを閉じる(実行中の処理は中断し、テーブルは削除する)"""
+        self._close_journal(document)
+        document.close()
+        self._document_lru.remove(document)
+        page = document.page
+        del self._documents[page]
+        self._tabs.removeTab(self._tabs.indexOf(page))
+        self._set_undo_redo_action_enable()
 
-        messagebox.showinfo(
-            "Export xml successfully!", f"下記パスにxmlを保存しました。\n{xml_path}"
+    def _close_tab(self, index: int) -> None:
+        document = self._documents.get(self._tabs.widget(index))
+        if document is not None:
+            self._close_document(document)
+
+    def _find_document(self, xml_path: str) -> Union["Document", None]:
+        return next(
+            (document for document in self._documents.values() if document.xml_path == xml_path),
+            None,
         )
 
-    def _create_table(self, xml_path: str) -> None:
-        """テーブルのUIを作成"""
-        # 今あるテーブルを削除
-        if self._table:
-            self._layout.removeWidget(self._table)
+    def _create_table(self, document: "Document") -> "DraggableTableView":
+        """xmlのテーブルを作成してタブのページに配置する(表示中の行だけが描画される)"""
+        from app.ui.table_model import FilterTableModel
+        from app.ui.table_view import DraggableTableView
 
+        table = DraggableTableView(
+            FilterTableModel(document.filter_data, HEADER), WIDTHS, sizing_policy=SIZING_POLICY
+        )
+        # テーブル更新時のアクションをセット
+        table.history_changed.connect(self._set_undo_redo_action_enable)
+        table.operation_applied.connect(partial(self._write_journal, document))
+        document.set_table(table)
+        self._document_lru.update(document, document.n_entries, True)
+        return table
+
+    def _open_document(self, xml_path: str) -> None:
+        """xmlを新しいタブで開く(既に開いている場合は、そのタブで読み込み直す)"""
         if not os.path.exists(xml_path):
-            messagebox.showerror(
+            QMessageBox.critical(
+                self,
                 "Import xml failure...",
                 f"下記パスにxmlがありません。\n一度[Refresh]をクリックしてメニューバーを更新してください。\n{xml_path}",
             )
             return
 
-        # データ読み込み
-        self._curr_xml_path = xml_path
-        self._filter_data.import_xml(xml_path)
-        table_data = self._filter_data.to_table_data()
+        from app.ui.document import Document
+        from app.ui.worker import LoadWorker
+
+        index = self._tabs.count()
+        opened = self._find_document(xml_path)
+        if opened is not None:
+            index = self._tabs.indexOf(opened.page)
+            self._close_document(opened)
+
+        document = Document(xml_path)
+        self._documents[document.page] = document
+        self._create_table(document)
+        # データ読み込み(読み込んだ分から順にテーブルに追加する)
+        worker = LoadWorker(xml_path, cache=self._filter_cache)
+        document.load_worker = worker
+        worker.signals.chunk.connect(partial(self._append_chunk, document, worker))
+        worker.signals.finished.connect(partial(self._finish_load, document, worker))
+        worker.signals.failed.connect(partial(self._fail_load, document, worker))
+        worker.signals.canceled.connect(partial(self._cancel_load, document, worker))
+
+        # タブを追加して表示する(検索中の場合は、読み込んだ行のうち一致する行だけを表示する)
+        self._tabs.insertTab(index, document.page, document.name)
+        self._tabs.setTabToolTip(index, xml_path)
+        self._tabs.setCurrentIndex(index)
+        self._start_worker(worker, f"Loading: {xml_path}")
+
+    def _activate_document(self, index: int) -> None:
+        """表示するタブを切り替えた時に、テーブルが削除済みであれば作り直す
+        作り直したテーブルでメモリの予算を超える場合は、最も長く表示していないタブのテーブルを削除する。
+        """
+        document = self._document
+        if document is not None:
+            if document.table is None:
+                self._create_table(document)
+                self._start_overlap_analysis(document)
+            self._document_lru.touch(document)
+            self._compact_documents()
+            self._search()
+        is_exportable = document is not None and not document.is_loading
+        self._export_action.setEnabled(is_exportable)
+        self._consolidate_action.setEnabled(is_exportable)
+        self._set_undo_redo_action_enable()
 
-        # テーブル作成
-        self._table = DraggableTableWidget(HEADER, len(table_data), len(HEADER), WIDTHS, False, table_data)
+    def _compact_documents(self) -> None:
+        """メモリの予算を超えている間、最も長く表示していないタブのテーブルを削除する
+        表示中・読み込み中のタブは対象外にする。
+        """
+        keep = [document for document in self._documents.values() if document.is_loading]
+        keep.append(self._document)
+        for document in self._document_lru.evictions(keep):
+            self._sync_journal(document)
+            document.compact()
+            self._document_lru.update(document, document.n_entries, False)
+
+    def _append_chunk(self, document: "Document", worker: "LoadWorker", entry_list: list) -> None:
+        """読み込んだentryをテーブルに追加する"""
+        if worker is not document.load_worker:
+            return
+        table = document.table
+        is_first_chunk = table.model().rowCount() == 0
+        table.model().append_entries(entry_list)
+        if is_first_chunk:
+            table.adjust_columns()
+            if document is self._document:
+                self.resize(table.sizeHint().width(), self.height())
+
+    def _finish_load(
+        self, document: "Document", worker: "LoadWorker", result: "LoadResult"
+    ) -> None:
+        """読み込み完了時の処理"""
+        if worker is not document.load_worker:
+            return
+        document.load_worker = None
+        document.filter_data.tree = result.tree
+        document.filter_data.source = result.source
+        self._document_lru.update(document, document.n_entries, True)
+        if document is self._document:
+            self._export_action.setEnabled(True)
+            self._consolidate_action.setEnabled(True)
+        self._show_load_message(document, result)
+        self._open_journal(document, result.content_hash)
 
-        # テーブル更新時のアクションをセット
-        self._table.cellChanged.connect(self._set_undo_redo_action_enable)
-        self._table.horizontalHeader().sectionClicked.connect(self._set_undo_redo_action_enable)
+        # ウィンドウサイズの調整
+        document.table.adjust_columns()
+        if document is self._document:
+            self.resize(document.table.sizeHint().width(), self.height())
+
+        # フィルタの重なりの解析(解析中もテーブルは操作できる)
+        self._start_overlap_analysis(document)
+        # 読み込み中は対象外にしていたため、メモリの予算を確認し直す
+        self._compact_documents()
+
+    def _open_journal(self, document: "Document", content_hash: str) -> None:
+        """読み込んだxmlの編集のジャーナルを開き、前回の編集が残っていれば復元する"""
+        from app.data.edit_journal import EditJournal, journal_path, remove_stale_journals
+
+        model = document.table.model()
+        try:
+            remove_stale_journals(content_hash, document.xml_path)
+            journal = EditJournal(
+                journal_path(content_hash, document.xml_path),
+                model.n_source_rows,
+                document.xml_path,
+            )
+            n_operations = journal.n_unexported_operations
+            if n_operations and self._ask_restore_edits(document, n_operations):
+                document.table.reset_order(journal.recovered_order())
+                self._search()
+                self.statusBar().showMessage(f"Restored {n_operations} edits from the journal")
+            else:
+                # NOTE: 読み込み中に編集した場合は、その並び順から記録する
+                journal.compact(model.order)
+        except OSError as e:
+            self.statusBar().showMessage(f"Edit journal is disabled: {e}")
+            return
+        document.journal = journal
+        self._journal_timer.start()
+
+    def _ask_restore_edits(self, document: "Document", n_operations: int) -> bool:
+        answer = QMessageBox.question(
+            self,
+            "Restore edits",
+            f"{document.name}に前回出力せずに終了した{n_operations}件の編集が残っています。\n"
+            "復元しますか?",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.Yes,
+        )
+        return answer == QMessageBox.Yes
 
-        # テーブルをレイアウトに追加
-        self._layout.addWidget(self._table)
+    def _write_journal(self, document: "Document", operation: "Operation") -> None:
+        """テーブルに適用した操作をジャーナルに追記する"""
+        if document.journal is None:
+            return
+        try:
+            document.journal.append(operation)
+            if document.journal.needs_compaction:
+                document.journal.compact(document.table.model().order)
+        except OSError as e:
+            self._close_journal(document)
+            self.statusBar().showMessage(f"Edit journal is disabled: {e}")
+
+    def _sync_journals(self) -> None:
+        for document in list(self._documents.values()):
+            self._sync_journal(document)
+
+    def _sync_journal(self, document: "Document") -> None:
+        if document.journal is None:
+            return
+        try:
+            document.journal.sync()
+        except OSError as e:
+            self._close_journal(document)
+            self.statusBar().showMessage(f"Edit journal is disabled: {e}")
+
+    def _close_journal(self, document: "Document") -> None:
+        if document.journal is not None:
+            try:
+                document.journal.close()
+            except OSError:
+                pass
+            document.journal = None
+        if not any(document.journal for document in self._documents.values()):
+            self._journal_timer.stop()
+
+    def _start_overlap_analysis(self, document: "Document") -> None:
+        """上にあるフィルタと重なるフィルタをバックグラウンドで解析する"""
+        if document.is_loading:
+            # NOTE: 読み込みが終わった時に解析する
+            return
+        from app.ui.worker import OverlapWorker
+
+        worker = OverlapWorker(document.filter_data.entry_list, document.table.model().order)
+        document.overlap_worker = worker
+        self._workers.add(worker)
+        worker.signals.finished.connect(partial(self._finish_overlap_analysis, document, worker))
+        for signal in (worker.signals.finished, worker.signals.failed, worker.signals.canceled):
+            signal.connect(partial(self._finish_worker, worker))
+        QThreadPool.globalInstance().start(worker)
+
+    def _finish_overlap_analysis(
+        self, document: "Document", worker: "OverlapWorker", result: "OverlapResult"
+    ) -> None:
+        """解析結果をテーブルの注釈として表示する"""
+        if worker is not document.overlap_worker:
+            return
+        document.overlap_worker = None
+        document.table.model().set_overlap_analyzer(result.analyzer)
+        if (result.n_shadowed or result.n_conflicts) and document is self._document:
+            self.statusBar().showMessage(
+                f"{result.n_shadowed} shadowed / {result.n_conflicts} conflicting filters"
+                " (hover a highlighted row for details)"
+            )
 
-        # ウィンドウサイズの調整
-        self.resize(self._table.sizeHint().width(), self.height())
+    def _show_load_message(self, document: "Document", result: "LoadResult") -> None:
+        """読み込み結果(キャッシュの使用状況)をステータスバーに表示する"""
+        message = f"Loaded {document.n_entries} filters from {document.name}"
+        if self._filter_cache is not None:
+            stats = self._filter_cache.stats
+            message += (
+                f" ({'cache' if result.from_cache else 'xml'}"
+                f", cache hit rate: {stats.hit_rate:.0%} [{stats.hits}/{stats.hits + stats.misses}])"
+            )
+        self.statusBar().showMessage(message)
 
-        # Undo/Redoボタンの設定
-        self._connect_undo_redo_action()
-        self._set_undo_redo_action_enable()
+    def _fail_load(self, document: "Document", worker: "LoadWorker", message: str) -> None:
+        """読み込み失敗時の処理"""
+        if worker is not document.load_worker:
+            return
+        self._close_document(document)
+        self.statusBar().clearMessage()
+        QMessageBox.critical(
+            self, "Import xml failure...", f"xmlの読み込みに失敗しました。\n{message}"
+        )
+
+    def _cancel_load(self, document: "Document", worker: "LoadWorker") -> None:
+        """読み込み中断時の処理(途中まで読み込んだテーブルは出力できないため削除する)"""
+        if worker is document.load_worker:
+            self._close_document(document)
+            self.statusBar().clearMessage()
 
     def _create_layout(self) -> None:
         """レイアウト作成"""
@@ -95,53 +618,194 @@ class Viewer(QMainWindow):
         self._widget = QWidget()
         self._layout = QVBoxLayout(self._widget)
 
+        # 検索バー(入力が止まってから検索する)
+        self._search_edit = QLineEdit()
+        self._search_edit.setPlaceholderText("Search: word  prefix*  @domain")
+        self._search_edit.setClearButtonEnabled(True)
+        self._search_timer = QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(SEARCH_DELAY_MSEC)
+        self._search_timer.timeout.connect(self._search)
+        self._search_edit.textChanged.connect(self._search_timer.start)
+        self._layout.addWidget(self._search_edit)
+
+        # xmlごとのタブ(表示中のタブのテーブルを検索・編集・出力する)
+        self._tabs = QTabWidget()
+        self._tabs.setTabsClosable(True)
+        self._tabs.setMovable(True)
+        self._tabs.currentChanged.connect(self._activate_document)
+        self._tabs.tabCloseRequested.connect(self._close_tab)
+        self._layout.addWidget(self._tabs)
+
+        # 編集のジャーナルの定期的な書き込み
+        self._journal_timer = QTimer(self)
+        self._journal_timer.setInterval(JOURNAL_SYNC_MSEC)
+        self._journal_timer.timeout.connect(self._sync_journals)
+
+        # 読み込み・出力の進捗表示
+        self._progress_bar = QProgressBar()
+        self._progress_bar.setVisible(False)
+        self._cancel_button = QPushButton("Cancel")
+        self._cancel_button.setVisible(False)
+        self._cancel_button.clicked.connect(self._cancel_worker)
+        self.statusBar().addPermanentWidget(self._progress_bar)
+        self.statusBar().addPermanentWidget(self._cancel_button)
+
         # メインウィンドウの設定
         self.setCentralWidget(self._widget)
         self.setWindowTitle(TITLE)
 
+    def _search(self) -> None:
+        """検索バーの文字列に一致するフィルタだけをテーブルに表示する"""
+        if self._table is None:
+            return
+        model = self._table.model()
+        model.set_search_query(self._search_edit.text())
+        if model.is_filtered:
+            self.statusBar().showMessage(
+                f"{model.rowCount()} / {model.n_source_rows} filters match: {model.search_query}"
+            )
+        else:
+            self.statusBar().clearMessage()
+
     def _create_load_action(self) -> None:
         """ファイル読み込みのアクション作成
-        xml_fileフォルダ内にあるファイルを読み込むアクションボタンを作成する。
+        xml_fileフォルダ内にあるファイルを読み込むアクションボタンは、初回の描画後に作成する。
         """
-        # 今あるアクションメニューをクリア
-        self._load_menu.clear()
-        self._load_actions = []
-
-        # xml_fileフォルダ内にあるファイルを読み込むアクションボタンを作成
-        for xml_name in os.listdir(XML_DIRPATH):
-            if os.path.splitext(xml_name)[-1] != ".xml":
-                continue
-
-            xml_path = os.path.join(XML_DIRPATH, xml_name)
-            self._load_actions.append(QAction(f"Load XML: {xml_name}"))
-            self._load_actions[-1].triggered.connect(partial(self._create_table, xml_path))
-            self._load_menu.addAction(self._load_actions[-1])
+        self._load_actions: dict[str, QAction] = {}
 
         # フォルダ内を再度確認する[Refresh]アクションを作成
         self._refresh_action = QAction("Refresh")
-        self._refresh_action.triggered.connect(self._create_load_action)
         self._load_menu.addAction(self._refresh_action)
 
+    def _start_xml_directory(self) -> None:
+        """xml_fileフォルダ内のxmlを読み込むアクションボタンを作成する
+        フォルダを監視し、xmlの追加・削除・変更があったアクションボタンだけを更新する。
+        """
+        from app.ui.xml_directory import XmlDirectoryIndex
+
+        self._xml_directory = XmlDirectoryIndex(XML_DIRPATH, self)
+        self._xml_directory.file_added.connect(self._add_load_action)
+        self._xml_directory.file_changed.connect(self._update_load_action)
+        self._xml_directory.file_removed.connect(self._remove_load_action)
+        self._refresh_action.triggered.connect(self._xml_directory.refresh)
+        self._xml_directory.refresh()
+
+    def _load_action_text(self, info: "XmlFileInfo") -> str:
+        """xmlを読み込むアクションボタンの表示名(entry数・サイズ・更新日時付き)"""
+        if info.summary is not None:
+            n_entries = f"{info.summary.n_entries} filters"
+        else:
+            n_entries = "scanning..." if info.is_scanning else "unavailable"
+        size = f"{info.size / 1024:,.0f} KB"
+        mtime = datetime.fromtimestamp(info.mtime).strftime("%Y/%m/%d %H:%M")
+        return f"Load XML: {info.name}  ({n_entries}, {size}, {mtime})"
+
+    def _add_load_action(self, info: "XmlFileInfo") -> None:
+        """xmlを読み込むアクションボタンをファイル名順の位置に追加する"""
+        action = QAction(self._load_action_text(info))
+        action.triggered.connect(partial(self._open_document, info.path))
+        before_action = next(
+            (
+                self._load_actions[path]
+                for path in sorted(self._load_actions)
+                if os.path.basename(path) > info.name
+            ),
+            self._refresh_action,
+        )
+        self._load_menu.insertAction(before_action, action)
+        self._load_actions[info.path] = action
+
+    def _update_load_action(self, info: "XmlFileInfo") -> None:
+        action = self._load_actions.get(info.path)
+        if action is not None:
+            action.setText(self._load_action_text(info))
+
+    def _remove_load_action(self, xml_path: str) -> None:
+        action = self._load_actions.pop(xml_path, None)
+        if action is not None:
+            self._load_menu.removeAction(action)
+
     def _create_export_action(self) -> None:
         """ファイル読み込みのアクション作成"""
         self._export_action = QAction("Export XML")
         self._export_action.triggered.connect(self._export_filter_xml)
         self._export_menu.addAction(self._export_action)
+        self._consolidate_action = QAction("Export consolidated XML...")
+        self._consolidate_action.triggered.connect(self._consolidate_filter_xml)
+        self._export_menu.addAction(self._consolidate_action)
+
+    def _create_replay_action(self) -> None:
+        """メールボックスの判定(一致件数の集計)のアクション作成"""
+        self._replay_mbox_action = QAction("Replay mbox...")
+        self._replay_mbox_action.triggered.connect(self._replay_mbox)
+        self._replay_menu.addAction(self._replay_mbox_action)
+        self._replay_maildir_action = QAction("Replay Maildir...")
+        self._replay_maildir_action.triggered.connect(self._replay_maildir)
+        self._replay_menu.addAction(self._replay_maildir_action)
 
     def _create_edit_action(self) -> None:
         """ファイルエディットのアクション作成"""
         self._undo_action = QAction("Undo")
+        self._undo_action.setShortcut("Ctrl+Z")
+        self._undo_action.triggered.connect(self._undo)
         self._edit_menu.addAction(self._undo_action)
         self._redo_action = QAction("Redo")
+        self._redo_action.setShortcut("Ctrl+R")
+        self._redo_action.triggered.connect(self._redo)
         self._edit_menu.addAction(self._redo_action)
         self._set_undo_redo_action_enable()
 
-    def _connect_undo_redo_action(self) -> None:
-        """Undo/Redoの処理をアクションボタンに接続"""
-        self._undo_action.triggered.connect(self._table.undo)
-        self._undo_action.setShortcut("Ctrl+Z")
-        self._redo_action.triggered.connect(self._table.redo)
-        self._redo_action.setShortcut("Ctrl+R")
+        # 選択中の行をまとめて移動するアクション
+        self._edit_menu.addSeparator()
+        self._move_top_action = QAction("Move to Top")
+        self._move_top_action.setShortcut("Ctrl+Shift+Up")
+        self._move_top_action.triggered.connect(partial(self._move_selected_rows, 0))
+        self._edit_menu.addAction(self._move_top_action)
+        self._move_bottom_action = QAction("Move to Bottom")
+        self._move_bottom_action.setShortcut("Ctrl+Shift+Down")
+        self._move_bottom_action.triggered.connect(partial(self._move_selected_rows, None))
+        self._edit_menu.addAction(self._move_bottom_action)
+        self._move_position_action = QAction("Move to Position...")
+        self._move_position_action.setShortcut("Ctrl+M")
+        self._move_position_action.triggered.connect(self._move_selected_rows_to_position)
+        self._edit_menu.addAction(self._move_position_action)
+
+    def _move_selected_rows(self, position: Union[int, None]) -> None:
+        """選択中の行をposition行目(Noneの場合は末尾)にまとめて移動する"""
+        if self._table is None:
+            return
+        if position is None:
+            position = self._table.n_source_rows
+        self._table.move_selected_rows(position)
+
+    def _move_selected_rows_to_position(self) -> None:
+        """選択中の行を入力した優先度の位置にまとめて移動する"""
+        if self._table is None:
+            return
+        rows = self._table.selected_rows()
+        if not rows:
+            return
+        priority, ok = QInputDialog.getInt(
+            self,
+            "Move to Position",
+            f"移動先の優先度(1-{self._table.n_source_rows - len(rows) + 1})",
+            rows[0] + 1,
+            1,
+            self._table.n_source_rows - len(rows) + 1,
+        )
+        if ok:
+            self._table.move_selected_rows(priority - 1)
+
+    def _undo(self) -> None:
+        """表示中のタブのテーブルの直前の操作をUndoする"""
+        if self._table is not None:
+            self._table.undo()
+
+    def _redo(self) -> None:
+        """表示中のタブのテーブルのUndoした操作をRedoする"""
+        if self._table is not None:
+            self._table.redo()
 
     def _set_undo_redo_action_enable(self) -> None:
         """Undo/Redoのアクションボタンの活性/非活性切り替え
@@ -162,12 +826,54 @@ class Viewer(QMainWindow):
         else:
             self._redo_action.setEnabled(False)
 
+    def _create_trace_action(self) -> None:
+        """処理時間の記録(トレース)のアクション作成"""
+        self._trace_action = QAction("Record Trace")
+        self._trace_action.setCheckable(True)
+        self._trace_action.setChecked(TRACER.enabled)
+        self._trace_action.toggled.connect(self._toggle_trace)
+        self._trace_menu.addAction(self._trace_action)
+        self._save_trace_action = QAction("Save Trace")
+        self._save_trace_action.triggered.connect(self._save_trace)
+        self._trace_menu.addAction(self._save_trace_action)
+
+    def _toggle_trace(self, checked: bool) -> None:
+        """トレースの記録を開始(それまでの記録は破棄する)・停止する"""
+        if checked:
+            TRACER.clear()
+            TRACER.enable()
+            self.statusBar().showMessage("Recording trace")
+        else:
+            TRACER.disable()
+            self.statusBar().showMessage(f"Stopped recording trace ({len(TRACER.spans)} spans)")
+
+    def _save_trace(self) -> None:
+        """記録したトレースをChrome trace形式のjsonと集計表(txt)で保存する"""
+        trace_path = os.path.join(
+            TRACE_DIRPATH, datetime.now().strftime("trace_%Y%m%d_%H%M%S.json")
+        )
+        try:
+            os.makedirs(TRACE_DIRPATH, exist_ok=True)
+            TRACER.write_chrome_trace(trace_path)
+            with open(os.path.splitext(trace_path)[0] + ".txt", mode="w", encoding="utf-8") as f:
+                f.write(TRACER.format_summary())
+        except OSError as e:
+            QMessageBox.critical(
+                self, "Save trace failure...", f"トレースの保存に失敗しました。\n{e}"
+            )
+            return
+        self.statusBar().showMessage(f"Saved trace ({len(TRACER.spans)} spans): {trace_path}")
+
     def _create_menubar(self) -> None:
         """メニューバー作成"""
         self._menubar = self.menuBar()
         self._edit_menu = self._menubar.addMenu("Edit")
         self._load_menu = self._menubar.addMenu("Load")
         self._export_menu = self._menubar.addMenu("Export")
+        self._replay_menu = self._menubar.addMenu("Replay")
+        self._trace_menu = self._menubar.addMenu("Trace")
         self._create_edit_action()
         self._create_load_action()
         self._create_export_action()
+        self._create_replay_action()
+        self._create_trace_action()
@@ -0,0 +1,275 @@
+import threading
+import xml.etree.ElementTree as ET
+from array import array
+from dataclasses import dataclass
+from typing import Any, Sequence, Union
+
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+
+from app.common.decorator import traced
+from app.common.file_hash import file_content_hash
+from app.common.trace import TRACER
+from app.data.consolidate import ConsolidationPlan, plan_consolidation
+from app.data.filter_cache import FilterCache
+from app.data.filter_data import FilterData
+from app.data.filter_entry import FilterEntry
+from app.data.filter_loader import (
+    CHUNK_SIZE,
+    FilterEntryLoader,
+    FilterXmlSummary,
+    XmlSource,
+    scan_filter_xml,
+)
+from app.data.mail_replay import MailboxReplayer, ReplayResult
+from app.data.overlap import CONFLICT, SHADOWED, OverlapAnalyzer
+
+
+class WorkerSignals(QObject):
+    """Workerの処理状況をUIスレッドに通知するシグナル"""
+
+    # 処理済みの量, 全体の量
+    progress = pyqtSignal(int, int)
+    # 読み込み途中のデータ(FilterEntryのリスト)
+    chunk = pyqtSignal(object)
+    # 処理結果
+    finished = pyqtSignal(object)
+    # エラーメッセージ
+    failed = pyqtSignal(str)
+    canceled = pyqtSignal()
+
+
+class Worker(QRunnable):
+    """QThreadPoolでUIスレッドとは別に処理を実行する
+    サブクラスでworkを実装し、途中でis_canceledを確認して処理を中断する。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.signals = WorkerSignals()
+        self._cancel_event = threading.Event()
+
+    @property
+    def is_canceled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self) -> None:
+        """処理の中断を要求する"""
+        self._cancel_event.set()
+
+    def work(self) -> Any:
+        raise NotImplementedError
+
+    def run(self) -> None:
+        try:
+            result = self.work()
+        except Exception as e:
+            self.signals.failed.emit(f"{type(e).__name__}: {e}")
+            return
+        if self.is_canceled:
+            self.signals.canceled.emit()
+        else:
+            self.signals.finished.emit(result)
+
+
+@dataclass
+class LoadResult:
+    # entry以外の要素のみ残したxml tree
+    tree: ET.ElementTree
+    from_cache: bool
+    # xmlの内容のハッシュ値(編集のジャーナルの対応付けに使う)
+    content_hash: str
+    # 各entryのバイト範囲(出力時に元のバイト列をコピーする)
+    source: Union[XmlSource, None]
+
+
+class LoadWorker(Worker):
+    """xmlを読み込み、FilterEntryをチャンク単位で通知する
+    cacheを指定した場合は、キャッシュがあればxmlを解析せずにキャッシュから読み込み、
+    無ければ解析結果をキャッシュに保存する。
+    """
+
+    def __init__(
+        self,
+        filter_xml_path: str,
+        chunk_size: int = CHUNK_SIZE,
+        cache: Union[FilterCache, None] = None,
+    ):
+        super().__init__()
+        self._filter_xml_path = filter_xml_path
+        self._chunk_size = chunk_size
+        self._cache = cache
+
+    @property
+    def filter_xml_path(self) -> str:
+        return self._filter_xml_path
+
+    @traced
+    def _load_cache(self) -> Union[LoadResult, None]:
+        """キャッシュから読み込む(読み込み済みのため、チャンクに分けずに通知する)"""
+        cached = self._cache.load(self._cache_key)
+        if cached is None or self.is_canceled:
+            return None
+        TRACER.add_rows(len(cached.filter_data.entry_list))
+        self.signals.chunk.emit(cached.filter_data.entry_list)
+        return LoadResult(
+            cached.filter_data.tree,
+            True,
+            self._cache_key.content_hash,
+            cached.filter_data.source,
+        )
+
+    @traced
+    def _load_xml(self) -> Union[LoadResult, None]:
+        """xmlを解析して読み込む"""
+        filter_data = FilterData()
+        loader = FilterEntryLoader(self._filter_xml_path)
+        for chunk in loader.iter_chunk(self._chunk_size):
+            if self.is_canceled:
+                return None
+            filter_data.extend_entry_list(chunk)
+            TRACER.add_rows(len(chunk))
+            self.signals.chunk.emit(chunk)
+            self.signals.progress.emit(loader.n_read_bytes, loader.n_bytes)
+        filter_data.tree = ET.ElementTree(loader.root)
+        filter_data.source = loader.source
+
+        if self._cache is None:
+            content_hash = file_content_hash(self._filter_xml_path)
+        else:
+            content_hash = self._cache_key.content_hash
+            try:
+                self._cache.store(self._cache_key, filter_data)
+            except OSError:
+                pass
+        return LoadResult(filter_data.tree, False, content_hash, filter_data.source)
+
+    def work(self) -> Union[LoadResult, None]:
+        if self._cache is not None:
+            try:
+                self._cache_key = self._cache.make_key(self._filter_xml_path)
+                result = self._load_cache()
+                if result is not None or self.is_canceled:
+                    return result
+            except OSError:
+                self._cache = None
+        return self._load_xml()
+
+
+class ExportWorker(Worker):
+    """FilterDataのスナップショットをxmlで出力する
+    処理結果は出力したxmlのパス。中断した場合は出力先を変更しない。
+    """
+
+    def __init__(self, filter_data: FilterData, filter_xml_path: str):
+        super().__init__()
+        self._filter_data = filter_data
+        self._filter_xml_path = filter_xml_path
+
+    @traced
+    def work(self) -> str:
+        n_entries = len(self._filter_data.entry_list)
+        exporter = self._filter_data.iter_export_xml(self._filter_xml_path)
+        for n_written in exporter:
+            if self.is_canceled:
+                exporter.close()
+                return None
+            self.signals.progress.emit(n_written, n_entries)
+        self.signals.progress.emit(n_entries, n_entries)
+        return self._filter_xml_path
+
+
+class ScanWorker(Worker):
+    """xmlを解析せずに概要(entry数等)を取得する
+    処理結果はFilterXmlSummary。
+    """
+
+    def __init__(self, filter_xml_path: str):
+        super().__init__()
+        self._filter_xml_path = filter_xml_path
+
+    @property
+    def filter_xml_path(self) -> str:
+        return self._filter_xml_path
+
+    def work(self) -> FilterXmlSummary:
+        return scan_filter_xml(self._filter_xml_path)
+
+
+@dataclass
+class OverlapResult:
+    analyzer: OverlapAnalyzer
+    # 上のフィルタに全て含まれる・上のフィルタと処理が矛盾するentryの数
+    n_shadowed: int
+    n_conflicts: int
+
+
+class OverlapWorker(Worker):
+    """フィルタの重なりを解析し、解析開始時の並び順で注釈を作成する
+    処理結果はOverlapResult。解析中に並び順が変わった場合はUIスレッドで注釈を作り直す。
+    """
+
+    def __init__(self, entry_list: Sequence[FilterEntry], order: array):
+        super().__init__()
+        # NOTE: 解析中に読み込み・追加されたentryは対象外にする
+        self._entry_list = list(entry_list)
+        self._order = array("i", order)
+
+    @traced
+    def work(self) -> OverlapResult:
+        TRACER.add_rows(len(self._entry_list))
+        analyzer = OverlapAnalyzer(self._entry_list)
+        analyzer.annotate(self._order)
+        # NOTE: 件数の集計で全entryの注釈が作成されるため、UIスレッドでは作成済みの注釈を使う
+        return OverlapResult(analyzer, analyzer.count(SHADOWED), analyzer.count(CONFLICT))
+
+
+class ConsolidateWorker(Worker):
+    """fromだけが異なるフィルタを1件にまとめた結果を求める(出力はしない)
+    処理結果はConsolidationPlan。
+    """
+
+    def __init__(self, entry_list: Sequence[FilterEntry], order: array):
+        super().__init__()
+        # NOTE: 処理中に読み込み・追加されたentryは対象外にする
+        self._entry_list = list(entry_list)
+        self._order = array("i", order)
+
+    @traced
+    def work(self) -> ConsolidationPlan:
+        TRACER.add_rows(len(self._entry_list))
+        return plan_consolidation(self._entry_list, self._order)
+
+
+class ReplayWorker(Worker):
+    """mbox・Maildirのメールをフィルタで判定し、フィルタごとの一致件数を集計する
+    処理結果はReplayResult(中断した場合はNone)。判定は別プロセスで並列に行う。
+    """
+
+    def __init__(
+        self,
+        entry_list: Sequence[FilterEntry],
+        mailbox_path: str,
+        n_jobs: Union[int, None] = None,
+    ):
+        super().__init__()
+        # NOTE: 判定中に読み込み・追加されたentryは対象外にする
+        self._entry_list = list(entry_list)
+        self._mailbox_path = mailbox_path
+        self._n_jobs = n_jobs
+
+    @property
+    def mailbox_path(self) -> str:
+        return self._mailbox_path
+
+    @traced
+    def work(self) -> Union[ReplayResult, None]:
+        TRACER.add_rows(len(self._entry_list))
+        replayer = MailboxReplayer(self._entry_list, self._mailbox_path, self._n_jobs)
+        replaying = replayer.iter_replay()
+        for n_done, n_total in replaying:
+            if self.is_canceled:
+                replaying.close()
+                return None
+            # NOTE: progressはintのシグナルのため、2GiBを超えるメールボックスでも溢れないようKiBで通知する
+            self.signals.progress.emit(n_done >> 10, n_total >> 10)
+        return replayer.result
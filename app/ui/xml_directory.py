@@ -0,0 +1,145 @@
+import os
+from dataclasses import dataclass
+from functools import partial
+from typing import Union
+
+from PyQt5.QtCore import QFileSystemWatcher, QObject, QThreadPool, pyqtSignal
+
+from app.data.filter_loader import FilterXmlSummary
+from app.ui.worker import ScanWorker
+
+XML_EXT = ".xml"
+# xmlの概要取得に使うスレッド数(読み込み・出力の処理を妨げないよう少なめにする)
+SCAN_THREAD_COUNT = 2
+
+
+@dataclass
+class XmlFileInfo:
+    path: str
+    name: str
+    size: int
+    mtime: float
+    # 概要の取得が終わるまではNone
+    summary: Union[FilterXmlSummary, None] = None
+    # 概要を取得できなかった場合のエラーメッセージ
+    scan_error: Union[str, None] = None
+
+    @property
+    def is_scanning(self) -> bool:
+        return self.summary is None and self.scan_error is None
+
+
+class XmlDirectoryIndex(QObject):
+    """フォルダ内のxmlの一覧を管理する
+    QFileSystemWatcherでフォルダとxmlを監視し、追加・削除・変更されたxmlだけを通知する。
+    xmlの概要(entry数等)は別スレッドで取得し、取得でき次第変更として通知する。
+    """
+
+    file_added = pyqtSignal(object)
+    file_changed = pyqtSignal(object)
+    file_removed = pyqtSignal(str)
+
+    def __init__(self, dirpath: str, parent: Union[QObject, None] = None):
+        super().__init__(parent)
+        self._dirpath = dirpath
+        self._files: dict[str, XmlFileInfo] = {}
+        self._scan_workers: dict[str, ScanWorker] = {}
+        self._thread_pool = QThreadPool(self)
+        self._thread_pool.setMaxThreadCount(SCAN_THREAD_COUNT)
+
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(self.refresh)
+        self._watcher.fileChanged.connect(self._update_file)
+
+    @property
+    def dirpath(self) -> str:
+        return self._dirpath
+
+    @property
+    def files(self) -> list[XmlFileInfo]:
+        return sorted(self._files.values(), key=lambda info: info.name)
+
+    def refresh(self) -> None:
+        """フォルダ内のxmlを確認し、前回からの差分を通知する"""
+        if os.path.isdir(self._dirpath) and self._dirpath not in self._watcher.directories():
+            self._watcher.addPath(self._dirpath)
+
+        paths = set()
+        if os.path.isdir(self._dirpath):
+            with os.scandir(self._dirpath) as it:
+                for dir_entry in it:
+                    if dir_entry.is_file() and os.path.splitext(dir_entry.name)[-1] == XML_EXT:
+                        paths.add(os.path.join(self._dirpath, dir_entry.name))
+
+        for path in set(self._files) - paths:
+            self._remove_file(path)
+        for path in paths:
+            self._update_file(path)
+
+    def _remove_file(self, path: str) -> None:
+        del self._files[path]
+        worker = self._scan_workers.pop(path, None)
+        if worker is not None:
+            worker.cancel()
+        if path in self._watcher.files():
+            self._watcher.removePath(path)
+        self.file_removed.emit(path)
+
+    def _update_file(self, path: str) -> None:
+        """xmlの情報を更新する(サイズ・更新日時が変わっていなければ何もしない)"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            if path in self._files:
+                self._remove_file(path)
+            return
+
+        info = self._files.get(path)
+        if info is not None and (info.size, info.mtime) == (stat.st_size, stat.st_mtime):
+            return
+
+        new_info = XmlFileInfo(path, os.path.basename(path), stat.st_size, stat.st_mtime)
+        self._files[path] = new_info
+        if path not in self._watcher.files():
+            self._watcher.addPath(path)
+        if info is None:
+            self.file_added.emit(new_info)
+        else:
+            self.file_changed.emit(new_info)
+        self._scan(path)
+
+    def _scan(self, path: str) -> None:
+        """xmlの概要を別スレッドで取得する"""
+        prev_worker = self._scan_workers.get(path)
+        if prev_worker is not None:
+            prev_worker.cancel()
+        worker = ScanWorker(path)
+        worker.signals.finished.connect(partial(self._finish_scan, worker))
+        worker.signals.failed.connect(partial(self._fail_scan, worker))
+        self._scan_workers[path] = worker
+        self._thread_pool.start(worker)
+
+    def _finish_scan(self, worker: ScanWorker, summary: FilterXmlSummary) -> None:
+        path = worker.filter_xml_path
+        if self._scan_workers.get(path) is not worker:
+            return
+        del self._scan_workers[path]
+        self._files[path].summary = summary
+        self.file_changed.emit(self._files[path])
+
+    def _fail_scan(self, worker: ScanWorker, message: str) -> None:
+        """概要を取得できなかったxml(読み込み権限が無い・取得中に削除された等)を通知する
+        削除された場合はQFileSystemWatcherの通知で一覧から削除する。
+        """
+        path = worker.filter_xml_path
+        if self._scan_workers.get(path) is not worker:
+            return
+        del self._scan_workers[path]
+        self._files[path].scan_error = message
+        self.file_changed.emit(self._files[path])
+
+    def cancel(self) -> None:
+        """実行中の概要取得を中断する"""
+        for worker in self._scan_workers.values():
+            worker.cancel()
+        self._scan_workers = {}
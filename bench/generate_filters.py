@@ -0,0 +1,279 @@
+"""ベンチマーク用に、Gmailから出力したものと同じ形式のフィルタのxml(mailFilters.xml)を生成する
+
+使い方:
+    python -m bench.generate_filters 100000 xml_file/bench_100k.xml
+    python -m bench.generate_filters 1000 out.xml --mix from_domain=0.5 --mix shouldTrash=0.1 --seed 3
+    python -m bench.generate_filters 10000 out.xml --mbox mail.mbox --n-messages 100000
+"""
+
+import argparse
+import random
+import sys
+from dataclasses import dataclass, field, fields, replace
+from typing import Iterator, TextIO, Union
+from xml.sax.saxutils import escape
+
+MIN_ENTRIES = 1
+MAX_ENTRIES = 500_000
+DEFAULT_N_MESSAGES = 10000
+
+FEED_HEADER = (
+    "<?xml version='1.0' encoding='UTF-8'?>"
+    "<feed xmlns='http://www.w3.org/2005/Atom' xmlns:apps='http://schemas.google.com/apps/2006'>\n"
+    "\t<title>Mail Filters</title>\n"
+    "\t<id>tag:mail.google.com,2008:filters:{ids}</id>\n"
+    "\t<updated>{updated}</updated>\n"
+    "\t<author>\n"
+    "\t\t<name>{name}</name>\n"
+    "\t\t<email>{email}</email>\n"
+    "\t</author>\n"
+)
+ENTRY_HEADER = (
+    "\t<entry>\n"
+    "\t\t<category term='filter'></category>\n"
+    "\t\t<title>Mail Filter</title>\n"
+    "\t\t<id>tag:mail.google.com,2008:filter:{id}</id>\n"
+    "\t\t<updated>{updated}</updated>\n"
+    "\t\t<content></content>\n"
+)
+ENTRY_FOOTER = "\t</entry>\n"
+FEED_FOOTER = "</feed>"
+UPDATED = "2024-05-01T00:00:00Z"
+
+SUBJECT_WORDS = (
+    "report", "invoice", "weekly", "newsletter", "order", "receipt", "alert", "meeting",
+    "shipping", "update", "security", "reminder", "sale", "digest", "build", "review",
+)  # fmt: skip
+
+
+@dataclass(frozen=True)
+class PropertyMix:
+    """フィルタ1件あたりの各プロパティの出現率(0〜1)
+    条件はfrom(アドレス・ドメイン・複数アドレス)・subjectのいずれか1つを必ず持つ。
+    """
+
+    # 条件(from_address + from_domain + from_list + subjectの残りはsubjectのみのフィルタ)
+    from_address: float = 0.45
+    from_domain: float = 0.2
+    from_list: float = 0.1
+    to: float = 0.05
+    hasTheWord: float = 0.2
+    doesNotHaveTheWord: float = 0.05
+    hasAttachment: float = 0.05
+    size: float = 0.02
+    # 処理
+    label: float = 0.85
+    shouldArchive: float = 0.4
+    shouldMarkAsRead: float = 0.25
+    shouldStar: float = 0.05
+    shouldTrash: float = 0.03
+    shouldNeverSpam: float = 0.05
+    shouldAlwaysMarkAsImportant: float = 0.03
+    forwardTo: float = 0.01
+    # 送信者・ラベル等の種類の数(少ないほど同じ値が多くなる)
+    n_domains: int = 500
+    n_users: int = 20
+    n_labels: int = 60
+    n_words: int = 2000
+
+    def with_ratios(self, ratios: dict[str, float]) -> "PropertyMix":
+        names = {f.name for f in fields(self)}
+        for name in ratios:
+            if name not in names:
+                raise ValueError(f"unknown property: {name}")
+        return replace(self, **ratios)
+
+
+@dataclass
+class _Names:
+    """生成に使う値の一覧"""
+
+    domains: list[str] = field(default_factory=list)
+    labels: list[str] = field(default_factory=list)
+    words: list[str] = field(default_factory=list)
+
+
+def _create_names(mix: PropertyMix, rng: random.Random) -> _Names:
+    tlds = ("com", "co.jp", "net", "org", "io", "jp")
+    domains = []
+    for i in range(mix.n_domains):
+        domain = f"{rng.choice(SUBJECT_WORDS)}{i}.{rng.choice(tlds)}"
+        # 一部はサブドメイン(mail.example.com等)にする
+        domains.append(f"mail.{domain}" if rng.random() < 0.2 else domain)
+    labels = [
+        f"{rng.choice(SUBJECT_WORDS).title()}/{i}" if rng.random() < 0.3 else f"Label{i}"
+        for i in range(mix.n_labels)
+    ]
+    words = [f"{rng.choice(SUBJECT_WORDS)}{i}" for i in range(mix.n_words)]
+    return _Names(domains, labels, words)
+
+
+def _address(names: _Names, mix: PropertyMix, rng: random.Random) -> str:
+    return f"user{rng.randrange(mix.n_users)}@{rng.choice(names.domains)}"
+
+
+def iter_entry_properties(
+    n_entries: int, mix: PropertyMix = PropertyMix(), seed: int = 0
+) -> Iterator[list[tuple[str, str]]]:
+    """各entryのプロパティ(名前, 値)のリストを生成する(seedが同じなら同じ結果になる)"""
+    rng = random.Random(seed)
+    names = _create_names(mix, rng)
+    for _ in range(n_entries):
+        properties = []
+        r = rng.random()
+        if r < mix.from_address:
+            properties.append(("from", _address(names, mix, rng)))
+        elif r < mix.from_address + mix.from_domain:
+            properties.append(("from", rng.choice(names.domains)))
+        elif r < mix.from_address + mix.from_domain + mix.from_list:
+            addresses = [_address(names, mix, rng) for _ in range(rng.randint(2, 6))]
+            properties.append(("from", "{" + " ".join(addresses) + "}"))
+        else:
+            subject = " ".join(rng.sample(SUBJECT_WORDS, rng.randint(1, 3)))
+            properties.append(("subject", f"{subject} {rng.randrange(1000)}"))
+        if rng.random() < mix.to:
+            properties.append(("to", _address(names, mix, rng)))
+        if rng.random() < mix.hasTheWord:
+            properties.append(("hasTheWord", " ".join(rng.sample(names.words, rng.randint(1, 2)))))
+        if rng.random() < mix.doesNotHaveTheWord:
+            properties.append(("doesNotHaveTheWord", rng.choice(names.words)))
+        if rng.random() < mix.hasAttachment:
+            properties.append(("hasAttachment", "true"))
+        if rng.random() < mix.label:
+            properties.append(("label", rng.choice(names.labels)))
+        for name in (
+            "shouldArchive",
+            "shouldMarkAsRead",
+            "shouldStar",
+            "shouldTrash",
+            "shouldNeverSpam",
+            "shouldAlwaysMarkAsImportant",
+        ):
+            if rng.random() < getattr(mix, name):
+                properties.append((name, "true"))
+        if rng.random() < mix.forwardTo:
+            properties.append(("forwardTo", f"forward@{rng.choice(names.domains)}"))
+        if rng.random() < mix.size:
+            properties.append(("size", str(rng.randint(1, 20))))
+            properties.append(("sizeOperator", rng.choice(("s_sl", "s_ss"))))
+            properties.append(("sizeUnit", "s_smb"))
+        else:
+            # NOTE: Gmailは条件にサイズを指定していなくても既定値を出力する
+            properties.append(("sizeOperator", "s_sl"))
+            properties.append(("sizeUnit", "s_smb"))
+        yield properties
+
+
+def write_filter_xml(
+    f: TextIO, n_entries: int, mix: PropertyMix = PropertyMix(), seed: int = 0
+) -> None:
+    """n_entries件のフィルタをGmailの出力形式で書き込む"""
+    rng = random.Random(seed + 1)
+    ids = [f"z{1700000000000 + i:019d}*{rng.randrange(10**15, 10**16)}" for i in range(n_entries)]
+    f.write(
+        FEED_HEADER.format(
+            ids=",".join(ids[:3]), updated=UPDATED, name="Bench User", email="bench@example.com"
+        )
+    )
+    for id, properties in zip(ids, iter_entry_properties(n_entries, mix, seed)):
+        f.write(ENTRY_HEADER.format(id=escape(id), updated=UPDATED))
+        for name, value in properties:
+            # NOTE: Gmailと同じく属性は'で囲む
+            value = escape(value, {"'": "&apos;", '"': "&quot;"})
+            f.write(f"\t\t<apps:property name='{name}' value='{value}'/>\n")
+        f.write(ENTRY_FOOTER)
+    f.write(FEED_FOOTER)
+
+
+def generate_filter_xml(
+    output_path: str, n_entries: int, mix: PropertyMix = PropertyMix(), seed: int = 0
+) -> None:
+    if not MIN_ENTRIES <= n_entries <= MAX_ENTRIES:
+        raise ValueError(f"n_entries must be {MIN_ENTRIES}-{MAX_ENTRIES}: {n_entries}")
+    with open(output_path, mode="w", encoding="utf-8") as f:
+        write_filter_xml(f, n_entries, mix, seed)
+
+
+def iter_messages(
+    n_messages: int, mix: PropertyMix = PropertyMix(), seed: int = 0
+) -> Iterator[str]:
+    """mboxの各メール(区切りの"From "の行を含む)を生成する
+    送信者・単語はフィルタと同じseedの値から選ぶため、一部のメールがフィルタに一致する。
+    """
+    # NOTE: iter_entry_propertiesと同じ乱数の使い方で、同じ値の一覧を作る
+    names = _create_names(mix, random.Random(seed))
+    rng = random.Random(seed + 2)
+    for i in range(n_messages):
+        sender = _address(names, mix, rng)
+        subject = " ".join(rng.sample(SUBJECT_WORDS, rng.randint(1, 4)))
+        words = rng.sample(names.words, rng.randint(0, 3)) + rng.choices(SUBJECT_WORDS, k=40)
+        rng.shuffle(words)
+        body = "\n".join(" ".join(words[j : j + 10]) for j in range(0, len(words), 10))
+        headers = (
+            f"From {sender} Wed May  1 00:00:00 2024\n"
+            f"From: {sender}\n"
+            f"To: bench@example.com\n"
+            f"Subject: {subject} {rng.randrange(1000)}\n"
+            f"Date: Wed, 1 May 2024 00:00:00 +0000\n"
+            f"Message-ID: <{i}@bench.example.com>\n"
+            f"MIME-Version: 1.0\n"
+        )
+        if rng.random() < mix.hasAttachment:
+            yield (
+                f'{headers}Content-Type: multipart/mixed; boundary="b{i}"\n\n'
+                f"--b{i}\nContent-Type: text/plain; charset=utf-8\n\n{body}\n"
+                f"--b{i}\nContent-Type: application/pdf\n"
+                f'Content-Disposition: attachment; filename="{rng.choice(names.words)}.pdf"\n'
+                f"Content-Transfer-Encoding: base64\n\nJVBERi0xLjQK\n--b{i}--\n\n"
+            )
+        else:
+            yield f"{headers}Content-Type: text/plain; charset=utf-8\n\n{body}\n\n"
+
+
+def generate_mbox(
+    output_path: str, n_messages: int, mix: PropertyMix = PropertyMix(), seed: int = 0
+) -> None:
+    """generate_filter_xmlと同じseedで、フィルタに一部が一致するメールのmboxを生成する"""
+    with open(output_path, mode="w", encoding="utf-8", newline="\n") as f:
+        f.writelines(iter_messages(n_messages, mix, seed))
+
+
+def _parse_ratio(text: str) -> tuple[str, float]:
+    name, _, value = text.partition("=")
+    if not value:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE: {text}")
+    return name, float(value) if "." in value else int(value)
+
+
+def main(argv: Union[list[str], None] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.generate_filters", description=__doc__.split("\n")[0]
+    )
+    parser.add_argument("n_entries", type=int, help=f"entry数({MIN_ENTRIES}〜{MAX_ENTRIES})")
+    parser.add_argument("output", help="出力先のxmlのパス")
+    parser.add_argument(
+        "--mix",
+        action="append",
+        type=_parse_ratio,
+        default=[],
+        metavar="NAME=VALUE",
+        help="プロパティの出現率・値の種類の数を変更する(例: shouldTrash=0.1, n_labels=10)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--mbox", help="フィルタに一部が一致するメールのmboxも生成する場合の出力先")
+    parser.add_argument("--n-messages", type=int, default=DEFAULT_N_MESSAGES, help="mboxのメール数")
+    args = parser.parse_args(argv)
+
+    try:
+        mix = PropertyMix().with_ratios(dict(args.mix))
+        generate_filter_xml(args.output, args.n_entries, mix, args.seed)
+        if args.mbox is not None:
+            generate_mbox(args.mbox, args.n_messages, mix, args.seed)
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,393 @@
+"""主要な処理(読み込み・表示用の変換・並び替え・出力・Undo/Redo・テーブル操作)の
+処理時間とメモリ使用量を計測し、JSONで保存する
+
+Qtの計測はoffscreenプラットフォームで行うため、ディスプレイの無い環境でも実行できる。
+
+使い方:
+    python -m bench.run_bench --sizes 100 10000 100000 --output bench_results.json
+    python -m bench.run_bench --compare old.json new.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from random import Random
+from typing import Any, Callable, Union
+
+from bench.generate_filters import MAX_ENTRIES, PropertyMix, generate_filter_xml, generate_mbox
+
+DEFAULT_SIZES = (100, 1000, 10000)
+DEFAULT_REPEAT = 3
+# QTableWidgetは全セルのアイテムを作成するため、Qtの計測はこの件数までに制限する
+DEFAULT_QT_MAX_ENTRIES = 20000
+# CheckPoint・テーブル操作で実行する操作の数
+N_OPERATIONS = 1000
+# メールボックスの判定で使うメール数(フィルタの件数によらず同じにする)
+N_MESSAGES = 2000
+# 比較時に処理時間がこの倍率を超えて遅くなった場合に劣化とみなす
+DEFAULT_THRESHOLD = 1.2
+HEADER = ["priority", "category", "condition", "label", "process"]
+WIDTHS = [None, None, 500, None, None]
+
+
+@dataclass
+class BenchResult:
+    name: str
+    n_entries: int
+    # 各回の処理時間[s]
+    times: list[float] = field(default_factory=list)
+    # 処理中に確保したメモリのピーク[byte](tracemallocで別に1回計測する)
+    peak_bytes: Union[int, None] = None
+
+    @property
+    def min(self) -> Union[float, None]:
+        return min(self.times) if self.times else None
+
+    @property
+    def median(self) -> Union[float, None]:
+        return statistics.median(self.times) if self.times else None
+
+    def to_dict(self) -> dict[str, Any]:
+        return {**asdict(self), "min": self.min, "median": self.median}
+
+
+@dataclass
+class Bench:
+    """計測する処理
+    setupで準備した状態をrunに渡し、runの処理時間だけを計測する。
+    """
+
+    name: str
+    run: Callable[[Any], Any]
+    setup: Callable[[], Any] = lambda: None
+
+
+def measure(bench: Bench, n_entries: int, repeat: int) -> BenchResult:
+    result = BenchResult(bench.name, n_entries)
+    for _ in range(repeat):
+        state = bench.setup()
+        start = time.perf_counter()
+        bench.run(state)
+        result.times.append(time.perf_counter() - start)
+
+    # NOTE: tracemallocは処理が数倍遅くなるため、処理時間とは別に計測する
+    state = bench.setup()
+    tracemalloc.start()
+    try:
+        bench.run(state)
+        result.peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result
+
+
+def _data_benches(xml_path: str, mbox_path: str, work_dir: str) -> list[Bench]:
+    """app.data・app.commonの処理"""
+    from app.common.adjuster import FilterXmlAdjuster
+    from app.data.check_point import (
+        BlockMoveOperation,
+        CheckPoint,
+        MoveOperation,
+        PermutationOperation,
+        SwapOperation,
+    )
+    from app.data.consolidate import plan_consolidation
+    from app.data.filter_data import FilterData
+    from app.data.filter_sort import FilterSorter
+    from app.data.mail_replay import MailboxReplayer
+    from app.data.row_order import RowOrder
+
+    loaded = FilterData(xml_path)
+    export_path = os.path.join(work_dir, "export.xml")
+    loaded.export_xml(export_path)
+
+    def fresh_filter_data() -> FilterData:
+        """表示文字列のキャッシュが無い状態のFilterData"""
+        for entry in loaded.entry_list:
+            entry.render_cache = None
+        return loaded.snapshot()
+
+    def sort_entry_list(filter_data: FilterData) -> None:
+        sorter = FilterSorter(filter_data.entry_list)
+        filter_data.sort_entry_list(sorter.sorted_index_list([("label", False), ("from", False)]))
+
+    def shuffled() -> list[int]:
+        order = list(range(len(loaded.entry_list)))
+        Random(0).shuffle(order)
+        return order
+
+    def without_source() -> FilterData:
+        """元のバイト列を使わず、全てのentryを文字列に変換して出力するFilterData"""
+        filter_data = loaded.snapshot()
+        filter_data.source = None
+        return filter_data
+
+    def copy_export() -> str:
+        path = os.path.join(work_dir, "adjust.xml")
+        shutil.copyfile(export_path, path)
+        return path
+
+    def check_point_operations() -> tuple[RowOrder, list]:
+        n_rows = len(loaded.entry_list)
+        rng = Random(0)
+        operations = []
+        for i in range(N_OPERATIONS):
+            kind = i % 4
+            if kind == 0:
+                operations.append(SwapOperation(rng.randrange(n_rows), rng.randrange(n_rows)))
+            elif kind == 1:
+                operations.append(MoveOperation(rng.randrange(n_rows), rng.randrange(n_rows)))
+            elif kind == 2:
+                rows = rng.sample(range(n_rows), min(10, n_rows))
+                position = rng.randrange(n_rows - len(rows) + 1)
+                operations.append(BlockMoveOperation.to_position(rows, position))
+            elif i % 100 == 3:
+                # NOTE: 並び替えは行数分のメモリを使うため、一部だけにする
+                order = list(range(n_rows))
+                rng.shuffle(order)
+                operations.append(PermutationOperation(array("i", order)))
+        return RowOrder(range(n_rows)), operations
+
+    def check_point_undo_redo(state: tuple[RowOrder, list]) -> None:
+        rows, operations = state
+        check_point = CheckPoint()
+        for operation in operations:
+            operation.apply(rows)
+            check_point.resist_operation(operation)
+        while (operation := check_point.undo_operation()) is not None:
+            operation.apply(rows)
+        while (operation := check_point.redo_operation()) is not None:
+            operation.apply(rows)
+
+    return [
+        Bench("import_xml", lambda _: FilterData().import_xml(xml_path)),
+        Bench("to_table_data", lambda filter_data: filter_data.to_table_data(), fresh_filter_data),
+        Bench("sort_entry_list", sort_entry_list, loaded.snapshot),
+        Bench("export_xml", lambda _: loaded.export_xml(export_path)),
+        Bench("export_xml.shuffled", lambda order: loaded.export_xml(export_path, order), shuffled),
+        Bench("export_xml.serialize", lambda data: data.export_xml(export_path), without_source),
+        Bench("adjuster.minor_adjustment", FilterXmlAdjuster().minor_adjustment, copy_export),
+        Bench("check_point.undo_redo", check_point_undo_redo, check_point_operations),
+        Bench("consolidate", lambda _: plan_consolidation(loaded.entry_list)),
+        # NOTE: プロセスの起動時間を含めないよう、同じプロセスで判定する
+        Bench("mail_replay", lambda _: MailboxReplayer(loaded.entry_list, mbox_path, 1).replay()),
+    ]
+
+
+def _qt_benches(xml_path: str) -> list[Bench]:
+    """offscreenのQtでのテーブル操作"""
+    from PyQt5.QtWidgets import QApplication
+
+    from app.data.filter_data import FilterData
+    from app.ui.table_model import FilterTableModel
+    from app.ui.table_view import DraggableTableView
+    from app.ui.table_widget import DraggableTableWidget
+
+    app = QApplication.instance() or QApplication([])
+    loaded = FilterData(xml_path)
+    table_texts = loaded.to_table_data()
+    n_rows = len(table_texts)
+    rng = Random(0)
+    swaps = [(rng.randrange(n_rows), rng.randrange(n_rows)) for _ in range(N_OPERATIONS)]
+    moves = [
+        (rng.sample(range(n_rows), min(10, n_rows)), rng.randrange(n_rows))
+        for _ in range(N_OPERATIONS // 10)
+    ]
+
+    def create_widget() -> DraggableTableWidget:
+        widget = DraggableTableWidget(
+            HEADER, n_rows, len(HEADER), WIDTHS, edit_enable=False, init_texts=table_texts
+        )
+        app.processEvents()
+        return widget
+
+    def widget_swap(widget: DraggableTableWidget) -> None:
+        for source_row, target_row in swaps:
+            widget.swap(source_row, target_row)
+        app.processEvents()
+
+    def swapped_widget() -> DraggableTableWidget:
+        widget = create_widget()
+        widget_swap(widget)
+        return widget
+
+    def widget_undo_redo(widget: DraggableTableWidget) -> None:
+        while widget.n_undo:
+            widget.undo()
+        while widget.n_redo:
+            widget.redo()
+        app.processEvents()
+
+    def create_view(_=None) -> DraggableTableView:
+        view = DraggableTableView(FilterTableModel(loaded.snapshot(), HEADER), WIDTHS)
+        view.show()
+        app.processEvents()
+        return view
+
+    def view_move_undo_redo(view: DraggableTableView) -> None:
+        for rows, position in moves:
+            view.move_rows(rows, position)
+        while view.n_undo:
+            view.undo()
+        while view.n_redo:
+            view.redo()
+        app.processEvents()
+
+    return [
+        Bench("table_widget.populate", lambda _: create_widget()),
+        Bench("table_widget.swap", widget_swap, create_widget),
+        Bench("table_widget.undo_redo", widget_undo_redo, swapped_widget),
+        Bench("table_view.populate", create_view),
+        Bench("table_view.move_undo_redo", view_move_undo_redo, create_view),
+    ]
+
+
+def _git_revision() -> Union[str, None]:
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{revision}-dirty" if dirty else revision
+
+
+def _metadata(args: argparse.Namespace) -> dict[str, Any]:
+    metadata = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": _git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "sizes": args.sizes,
+        "repeat": args.repeat,
+        "seed": args.seed,
+    }
+    if not args.no_qt:
+        try:
+            from PyQt5.QtCore import QT_VERSION_STR
+
+            metadata["qt"] = QT_VERSION_STR
+        except ImportError:
+            pass
+    return metadata
+
+
+def run(args: argparse.Namespace) -> list[BenchResult]:
+    if not args.no_qt:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for n_entries in args.sizes:
+            xml_path = os.path.join(work_dir, f"filters_{n_entries}.xml")
+            generate_filter_xml(xml_path, n_entries, PropertyMix(), args.seed)
+            mbox_path = os.path.join(work_dir, f"messages_{n_entries}.mbox")
+            generate_mbox(mbox_path, N_MESSAGES, PropertyMix(), args.seed)
+            benches = _data_benches(xml_path, mbox_path, work_dir)
+            if not args.no_qt:
+                try:
+                    benches += _qt_benches(xml_path) if n_entries <= args.qt_max_entries else []
+                except ImportError as e:
+                    print(f"skip Qt benchmarks: {e}", file=sys.stderr)
+                    args.no_qt = True
+            for bench in benches:
+                if args.only and bench.name not in args.only:
+                    continue
+                result = measure(bench, n_entries, args.repeat)
+                results.append(result)
+                peak = (
+                    ""
+                    if result.peak_bytes is None
+                    else f", peak {result.peak_bytes / 2**20:.1f}MiB"
+                )
+                print(f"{bench.name:<28} {n_entries:>7}: median {result.median:.4f}s{peak}")
+    return results
+
+
+def compare(base_path: str, new_path: str, threshold: float) -> int:
+    """2つの計測結果の処理時間(中央値)を比較し、劣化があれば1を返す"""
+    with open(base_path, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    base_results = {(r["name"], r["n_entries"]): r for r in base["results"]}
+
+    print(
+        f"base: {base['metadata'].get('git_revision')}  new: {new['metadata'].get('git_revision')}"
+    )
+    n_regressions = 0
+    for result in new["results"]:
+        base_result = base_results.get((result["name"], result["n_entries"]))
+        if base_result is None or not base_result["median"] or not result["median"]:
+            continue
+        ratio = result["median"] / base_result["median"]
+        regressed = ratio > threshold
+        n_regressions += regressed
+        print(
+            f"{result['name']:<28} {result['n_entries']:>7}: "
+            f"{base_result['median']:.4f}s -> {result['median']:.4f}s (x{ratio:.2f})"
+            + ("  REGRESSION" if regressed else "")
+        )
+    return 1 if n_regressions else 0
+
+
+def main(argv: Union[list[str], None] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.run_bench", description=__doc__.split("\n")[0]
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=list(DEFAULT_SIZES),
+        help=f"entry数(最大{MAX_ENTRIES})",
+    )
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="処理時間の計測回数")
+    parser.add_argument("--seed", type=int, default=0, help="生成するxmlの乱数のシード")
+    parser.add_argument("--only", nargs="+", help="計測する処理の名前(省略時は全て)")
+    parser.add_argument("--no-qt", action="store_true", help="Qtのテーブル操作を計測しない")
+    parser.add_argument(
+        "--qt-max-entries",
+        type=int,
+        default=DEFAULT_QT_MAX_ENTRIES,
+        help="Qtの計測を行う最大のentry数",
+    )
+    parser.add_argument("--output", default="bench_results.json", help="計測結果のJSONの出力先")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("BASE", "NEW"), help="2つの計測結果を比較する"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD, help="劣化とみなす処理時間の倍率"
+    )
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare, args.threshold)
+
+    metadata = _metadata(args)
+    results = run(args)
+    with open(args.output, mode="w", encoding="utf-8") as f:
+        json.dump({"metadata": metadata, "results": [r.to_dict() for r in results]}, f, indent=2)
+    print(f"saved: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
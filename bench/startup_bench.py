@@ -0,0 +1,222 @@
+"""GUIの起動時間(最初のウィンドウが描画されるまで・xmlの一覧がメニューに並ぶまで)を計測し、
+JSONで保存する
+
+毎回新しいプロセスをoffscreenプラットフォームで起動し、-X importtimeでモジュールごとの
+import時間も集計する。最初の描画までに読み込まれてはいけないモジュール(tkinter、xmlの処理等)が
+読み込まれた場合は1を返す。計測結果はbench.run_benchと同じ形式のため、--compareで比較できる。
+
+使い方:
+    python -m bench.startup_bench --repeat 10 --output startup_results.json
+    python -m bench.startup_bench --compare old.json new.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Union
+
+from bench.generate_filters import PropertyMix, generate_filter_xml
+from bench.run_bench import DEFAULT_THRESHOLD, BenchResult, _git_revision, compare
+
+REPO_DIRPATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_REPEAT = 5
+DEFAULT_N_FILES = 5
+DEFAULT_N_ENTRIES = 2000
+# 最初の描画・xmlの一覧の作成を待つ最大時間[s]
+TIMEOUT = 60
+# 最初の描画までに読み込まれてはいけないモジュール
+LAZY_MODULES = (
+    "tkinter",
+    "xml.etree.ElementTree",
+    "app.data.filter_cache",
+    "app.data.filter_data",
+    "app.data.overlap",
+    "app.ui.table_view",
+    "app.ui.worker",
+)
+# 表示するimport時間の上位のモジュール数
+N_TOP_IMPORTS = 15
+
+# 計測用のプロセスで実行するスクリプト
+# NOTE: perf_counterはプロセス間で共通の時計(Linux: CLOCK_MONOTONIC等)のため、
+# 親プロセスで記録した起動時刻との差を起動からの時間とする
+PROBE = """
+import json, sys, time
+from PyQt5.QtCore import QEvent, QObject, QTimer
+from PyQt5.QtWidgets import QApplication
+
+app = QApplication(sys.argv)
+from app.ui.viewer import Viewer
+times = {"import_viewer": time.perf_counter()}
+lazy_modules = sys.argv[1].split(",")
+n_files = int(sys.argv[2])
+
+class FirstPaint(QObject):
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint and "first_paint" not in times:
+            times["first_paint"] = time.perf_counter()
+            times["loaded_modules"] = [m for m in lazy_modules if m in sys.modules]
+        return False
+
+def check_menu():
+    actions = viewer._load_actions.values()
+    if len(actions) >= n_files and all("scanning" not in a.text() for a in actions):
+        times["menu_ready"] = time.perf_counter()
+        app.quit()
+
+viewer = Viewer()
+first_paint = FirstPaint()
+viewer.installEventFilter(first_paint)
+viewer.show()
+timer = QTimer()
+timer.timeout.connect(check_menu)
+timer.start(1)
+QTimer.singleShot(int(sys.argv[3]) * 1000, app.quit)
+app.exec_()
+print(json.dumps(times))
+"""
+
+
+def _parse_importtime(stderr: str) -> dict[str, tuple[int, int]]:
+    """-X importtimeの出力から、モジュールごとの(自身のimport時間, 累計のimport時間)[us]を返す"""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            # 見出しの行
+            continue
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def run_once(work_dir: str, n_files: int) -> tuple[dict[str, Any], dict[str, tuple[int, int]]]:
+    """GUIを1回起動し、起動からの各時点の時間[s]とモジュールごとのimport時間を返す"""
+    env = {**os.environ, "QT_QPA_PLATFORM": "offscreen", "PYTHONPATH": REPO_DIRPATH}
+    args = [sys.executable, "-X", "importtime", "-c", PROBE, ",".join(LAZY_MODULES)]
+    args += [str(n_files), str(TIMEOUT)]
+    start = time.perf_counter()
+    completed = subprocess.run(
+        args, cwd=work_dir, env=env, capture_output=True, text=True, timeout=TIMEOUT + 30
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"startup failed:\n{completed.stderr[-2000:]}")
+    times = json.loads(completed.stdout.strip().splitlines()[-1])
+    for key in ("import_viewer", "first_paint", "menu_ready"):
+        if key in times:
+            times[key] -= start
+    return times, _parse_importtime(completed.stderr)
+
+
+def run(args: argparse.Namespace) -> tuple[list[BenchResult], list[str], list[dict[str, Any]]]:
+    """計測結果・最初の描画までに読み込まれたLAZY_MODULES・import時間の上位を返す"""
+    n_entries = args.n_files * args.n_entries
+    results = {
+        name: BenchResult(f"startup.{name}", n_entries)
+        for name in ("import_viewer", "first_paint", "menu_ready")
+    }
+    loaded_modules = set()
+    import_times: dict[str, list[tuple[int, int]]] = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Viewerはカレントディレクトリのxml_fileフォルダを一覧にする
+        xml_dirpath = os.path.join(work_dir, "xml_file")
+        os.makedirs(xml_dirpath)
+        for i in range(args.n_files):
+            xml_path = os.path.join(xml_dirpath, f"filters_{i}.xml")
+            generate_filter_xml(xml_path, args.n_entries, PropertyMix(), args.seed + i)
+
+        for _ in range(args.repeat):
+            times, imports = run_once(work_dir, args.n_files)
+            for name, result in results.items():
+                if name in times:
+                    result.times.append(times[name])
+            loaded_modules.update(times.get("loaded_modules", ()))
+            for name, value in imports.items():
+                import_times.setdefault(name, []).append(value)
+
+    top_imports = sorted(
+        (
+            {
+                "name": name,
+                "self_us": statistics.median(v[0] for v in values),
+                "cumulative_us": statistics.median(v[1] for v in values),
+            }
+            for name, values in import_times.items()
+        ),
+        key=lambda item: item["self_us"],
+        reverse=True,
+    )[:N_TOP_IMPORTS]
+    return list(results.values()), sorted(loaded_modules), top_imports
+
+
+def main(argv: Union[list[str], None] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.startup_bench", description=__doc__.split("\n")[0]
+    )
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="起動する回数")
+    parser.add_argument(
+        "--n-files", type=int, default=DEFAULT_N_FILES, help="xml_fileフォルダに置くxmlの数"
+    )
+    parser.add_argument(
+        "--n-entries", type=int, default=DEFAULT_N_ENTRIES, help="1つのxmlのentry数"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="生成するxmlの乱数のシード")
+    parser.add_argument("--output", default="startup_results.json", help="計測結果のJSONの出力先")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("BASE", "NEW"), help="2つの計測結果を比較する"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD, help="劣化とみなす処理時間の倍率"
+    )
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare, args.threshold)
+
+    metadata = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": _git_revision(),
+        "python": sys.version.split()[0],
+        "repeat": args.repeat,
+        "n_files": args.n_files,
+        "n_entries": args.n_entries,
+    }
+    results, loaded_modules, top_imports = run(args)
+    for result in results:
+        if result.times:
+            print(f"{result.name:<24}: median {result.median:.3f}s, min {result.min:.3f}s")
+        else:
+            print(f"{result.name:<24}: timed out")
+    print(f"slowest imports (self / cumulative, median of {args.repeat}):")
+    for item in top_imports:
+        print(
+            f"  {item['name']:<40} {item['self_us'] / 1000:>7.1f}ms"
+            f" {item['cumulative_us'] / 1000:>7.1f}ms"
+        )
+
+    with open(args.output, mode="w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "metadata": {**metadata, "loaded_modules": loaded_modules, "imports": top_imports},
+                "results": [r.to_dict() for r in results],
+            },
+            f,
+            indent=2,
+        )
+    print(f"saved: {args.output}")
+
+    if loaded_modules:
+        print(f"imported before the first paint: {', '.join(loaded_modules)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,8 @@
+from app.data.filter_entry import FilterEntry
+
+
+def make_entry(index: int, **properties: str) -> FilterEntry:
+    """テスト用のフィルタを作成する(idはid{index}、プロパティは指定した順)"""
+    return FilterEntry.from_items(
+        "filter", "Mail Filter", f"id{index}", "", properties.keys(), properties.values()
+    )
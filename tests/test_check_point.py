@@ -0,0 +1,131 @@
+import random
+import unittest
+from array import array
+from unittest import mock
+
+from app.data import row_order
+from app.data.check_point import (
+    OPERATION_BASE_BYTES,
+    BlockMoveOperation,
+    CheckPoint,
+    MoveOperation,
+    PermutationOperation,
+    SwapOperation,
+)
+from app.data.row_order import RowOrder
+
+
+def _random_operation(rng: random.Random, n_rows: int):
+    kind = rng.randrange(4)
+    if kind == 0:
+        return SwapOperation(rng.randrange(n_rows), rng.randrange(n_rows))
+    if kind == 1:
+        return MoveOperation(rng.randrange(n_rows), rng.randrange(n_rows))
+    if kind == 2:
+        # 連続していない行もまとめて移動する
+        rows = rng.sample(range(n_rows), rng.randint(1, n_rows // 2))
+        return BlockMoveOperation.to_position(rows, rng.randrange(n_rows - len(rows) + 1))
+    order = list(range(n_rows))
+    rng.shuffle(order)
+    return PermutationOperation(array("i", order), (rng.randrange(3), 0))
+
+
+class OperationTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(row_order, "CHUNK_SIZE", 4)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_row_order_matches_list(self):
+        # RowOrderに適用した結果がlistに適用した結果と一致し、逆操作で元に戻る
+        rng = random.Random(0)
+        n_rows = 40
+        expected = list(range(n_rows))
+        order = RowOrder(expected)
+        for _ in range(500):
+            operation = _random_operation(rng, n_rows)
+            previous = list(expected)
+            operation.apply(expected)
+            operation.apply(order)
+            self.assertEqual(list(order), expected)
+            self.assertEqual(sorted(expected), list(range(n_rows)))
+
+            operation.inverse().apply(expected)
+            operation.inverse().apply(order)
+            self.assertEqual(expected, previous)
+            self.assertEqual(list(order), previous)
+            operation.apply(expected)
+            operation.apply(order)
+
+    def test_block_move_non_contiguous(self):
+        rows = list("abcdefgh")
+        operation = BlockMoveOperation.to_position([6, 1, 4], 2)
+        self.assertEqual(operation.source_rows.tolist(), [1, 4, 6])
+        self.assertEqual(operation.destination_rows.tolist(), [2, 3, 4])
+        operation.apply(rows)
+        self.assertEqual("".join(rows), "acbegdfh")
+        self.assertEqual(operation.permutation(8).tolist(), [0, 2, 1, 4, 6, 3, 5, 7])
+        operation.inverse().apply(rows)
+        self.assertEqual("".join(rows), "abcdefgh")
+
+    def test_permutation_inverse_swaps_sort_indicators(self):
+        operation = PermutationOperation(array("i", [2, 0, 1]), (1, 0), (-1, 0))
+        inverse = operation.inverse()
+        self.assertEqual(inverse.order.tolist(), [1, 2, 0])
+        self.assertEqual((inverse.sort_indicator, inverse.prev_sort_indicator), ((-1, 0), (1, 0)))
+
+
+class CheckPointTest(unittest.TestCase):
+    def test_undo_redo_restores_order(self):
+        rng = random.Random(1)
+        n_rows = 30
+        order = RowOrder(range(n_rows))
+        check_point = CheckPoint(max_depth=None, max_bytes=None)
+        history = [list(order)]
+        for _ in range(100):
+            operation = _random_operation(rng, n_rows)
+            operation.apply(order)
+            check_point.resist_operation(operation)
+            history.append(list(order))
+
+        for expected in reversed(history[:-1]):
+            check_point.undo_operation().apply(order)
+            self.assertEqual(list(order), expected)
+        self.assertIsNone(check_point.undo_operation())
+        for expected in history[1:]:
+            check_point.redo_operation().apply(order)
+            self.assertEqual(list(order), expected)
+        self.assertIsNone(check_point.redo_operation())
+
+    def test_new_operation_discards_redo(self):
+        check_point = CheckPoint()
+        check_point.resist_operation(SwapOperation(0, 1))
+        check_point.resist_operation(SwapOperation(1, 2))
+        check_point.undo_operation()
+        check_point.resist_operation(MoveOperation(0, 2))
+        self.assertEqual((check_point.n_undo, check_point.n_redo), (2, 0))
+        self.assertEqual(check_point.n_bytes, 2 * OPERATION_BASE_BYTES)
+
+    def test_max_bytes_evicts_oldest(self):
+        operations = [PermutationOperation(array("i", range(1000))) for _ in range(5)]
+        max_bytes = 2 * operations[0].nbytes + OPERATION_BASE_BYTES
+        check_point = CheckPoint(max_depth=None, max_bytes=max_bytes)
+        for operation in operations:
+            check_point.resist_operation(operation)
+        self.assertEqual(check_point.n_undo, 2)
+        self.assertLessEqual(check_point.n_bytes, max_bytes)
+        # 新しい操作から順にUndoできる
+        self.assertEqual(check_point.undo_operation(), operations[4].inverse())
+        self.assertEqual(check_point.undo_operation(), operations[3].inverse())
+        self.assertIsNone(check_point.undo_operation())
+
+    def test_max_depth_evicts_oldest(self):
+        check_point = CheckPoint(max_depth=3, max_bytes=None)
+        for row in range(5):
+            check_point.resist_operation(SwapOperation(row, row + 1))
+        self.assertEqual(check_point.n_undo, 3)
+        self.assertEqual(check_point.undo_operation(), SwapOperation(4, 5))
+
+
+if __name__ == "__main__":
+    unittest.main()
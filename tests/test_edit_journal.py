@@ -0,0 +1,111 @@
+import os
+import tempfile
+import unittest
+
+from app.data.check_point import MoveOperation, SwapOperation
+from app.data.edit_journal import EditJournal, journal_path, remove_stale_journals
+
+CONTENT_HASH = "0" * 32
+OTHER_CONTENT_HASH = "1" * 32
+
+
+class JournalPathTest(unittest.TestCase):
+    def test_same_content_at_different_paths(self):
+        # 内容が同じでもパスが違うxmlは、別のジャーナルに記録する
+        with tempfile.TemporaryDirectory() as journal_dir:
+            xml_a = os.path.join("a", "filters.xml")
+            xml_b = os.path.join("b", "filters.xml")
+            path_a = journal_path(CONTENT_HASH, xml_a, journal_dir)
+            path_b = journal_path(CONTENT_HASH, xml_b, journal_dir)
+            self.assertNotEqual(path_a, path_b)
+
+            journal_a = EditJournal(path_a, 3, xml_a)
+            journal_a.append(SwapOperation(0, 1))
+            journal_a.close()
+            journal_b = EditJournal(path_b, 3, xml_b)
+            self.assertEqual(journal_b.recovered_operations, [])
+            journal_b.close()
+
+            journal_a = EditJournal(path_a, 3, xml_a)
+            self.assertEqual(len(journal_a.recovered_operations), 1)
+            journal_a.close()
+
+    def test_same_path(self):
+        path = os.path.join("a", "filters.xml")
+        self.assertEqual(
+            journal_path(CONTENT_HASH, path, "journal"),
+            journal_path(CONTENT_HASH, os.path.abspath(path), "journal"),
+        )
+
+
+class EditJournalTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.journal_dir = self._dir.name
+        self.xml_path = os.path.join(self.journal_dir, "filters.xml")
+        self.path = journal_path(CONTENT_HASH, self.xml_path, self.journal_dir)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _reopen(self, journal: EditJournal) -> EditJournal:
+        journal.close()
+        return EditJournal(self.path, 4, self.xml_path)
+
+    def test_unexported_operations(self):
+        journal = EditJournal(self.path, 4, self.xml_path)
+        journal.append(SwapOperation(0, 3))
+        journal.append(MoveOperation(1, 2))
+        journal = self._reopen(journal)
+        self.assertEqual(journal.n_unexported_operations, 2)
+        self.assertEqual(list(journal.recovered_order()), [3, 2, 1, 0])
+        journal.close()
+
+    def test_exported_operations_are_not_unexported(self):
+        # 出力した並び順までの操作は、出力していない編集として扱わない
+        journal = EditJournal(self.path, 4, self.xml_path)
+        journal.append(SwapOperation(0, 3))
+        journal.mark_exported([3, 1, 2, 0])
+        journal = self._reopen(journal)
+        self.assertEqual(journal.n_unexported_operations, 0)
+
+        journal.append(SwapOperation(1, 2))
+        journal = self._reopen(journal)
+        self.assertEqual(journal.n_unexported_operations, 1)
+        self.assertEqual(list(journal.recovered_order()), [3, 2, 1, 0])
+        journal.close()
+
+    def test_edited_during_export(self):
+        # 出力中に編集した並び順は、出力後の編集として復元できる
+        journal = EditJournal(self.path, 4, self.xml_path)
+        journal.mark_exported([3, 1, 2, 0], [1, 3, 0, 2])
+        journal = self._reopen(journal)
+        self.assertEqual(journal.n_unexported_operations, 1)
+        self.assertEqual(list(journal.recovered_order()), [1, 3, 0, 2])
+        journal.close()
+
+    def test_remove_stale_journals(self):
+        open(self.xml_path, mode="wb").close()
+        # 同じxmlの変更前の内容のジャーナル
+        old_path = journal_path(OTHER_CONTENT_HASH, self.xml_path, self.journal_dir)
+        EditJournal(old_path, 4, self.xml_path).close()
+        # 無くなったxmlのジャーナル
+        removed_xml_path = os.path.join(self.journal_dir, "removed.xml")
+        removed_path = journal_path(CONTENT_HASH, removed_xml_path, self.journal_dir)
+        EditJournal(removed_path, 4, removed_xml_path).close()
+        # 別のxmlのジャーナル
+        other_xml_path = os.path.join(self.journal_dir, "other.xml")
+        open(other_xml_path, mode="wb").close()
+        other_path = journal_path(OTHER_CONTENT_HASH, other_xml_path, self.journal_dir)
+        EditJournal(other_path, 4, other_xml_path).close()
+        EditJournal(self.path, 4, self.xml_path).close()
+
+        self.assertEqual(remove_stale_journals(CONTENT_HASH, self.xml_path, self.journal_dir), 2)
+        self.assertFalse(os.path.exists(old_path))
+        self.assertFalse(os.path.exists(removed_path))
+        self.assertTrue(os.path.exists(other_path))
+        self.assertTrue(os.path.exists(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import random
+import unittest
+
+from factories import make_entry
+
+from app.data.filter_diff import (
+    EntryMove,
+    diff_entries,
+    longest_increasing_subsequence,
+    match_entries,
+    merge_order,
+)
+
+
+def _apply_moves(order: list[int], moves: list[EntryMove]) -> list[int]:
+    """targetのインデックスの並びに移動を適用する"""
+    order = list(order)
+    for move in moves:
+        order.remove(move.index)
+        order.insert(0 if move.after is None else order.index(move.after) + 1, move.index)
+    return order
+
+
+def _lis_length(values: list[int]) -> int:
+    lengths = []
+    for i, value in enumerate(values):
+        lengths.append(1 + max((lengths[j] for j in range(i) if values[j] < value), default=0))
+    return max(lengths, default=0)
+
+
+class MatchEntriesTest(unittest.TestCase):
+    def test_id_then_content(self):
+        base = [make_entry(1, **{"from": "a@x.com"}), make_entry(2, **{"from": "b@x.com"})]
+        target = [
+            # idが同じentryは内容が変わっても対応付ける
+            make_entry(2, **{"from": "c@x.com"}),
+            # idが変わったentryは内容で対応付ける
+            make_entry(3, **{"from": "a@x.com"}),
+        ]
+        self.assertEqual(match_entries(base, target), [(1, 0), (0, 1)])
+        diff = diff_entries(base, target)
+        self.assertEqual(diff.changed, [(1, 0)])
+        self.assertEqual((diff.added, diff.removed), ([], []))
+
+    def test_id_takes_precedence_over_content(self):
+        base = [make_entry(1, subject="foo"), make_entry(2, subject="bar")]
+        target = [make_entry(3, subject="bar"), make_entry(2, subject="foo")]
+        # 内容が同じid3ではなく、idが同じid2を対応付ける
+        self.assertEqual(match_entries(base, target), [(1, 1)])
+
+    def test_duplicate_contents_are_matched_in_order(self):
+        base = [make_entry(index, subject="same") for index in (1, 2)]
+        target = [make_entry(index, subject="same") for index in (3, 4, 5)]
+        diff = diff_entries(base, target)
+        self.assertEqual(diff.matched, [(0, 0), (1, 1)])
+        self.assertEqual(diff.added, [2])
+        self.assertEqual(diff.moves, [])
+
+    def test_added_and_removed(self):
+        base = [make_entry(1, subject="a"), make_entry(2, subject="b")]
+        target = [make_entry(2, subject="b"), make_entry(3, subject="c")]
+        diff = diff_entries(base, target)
+        self.assertEqual(diff.added, [1])
+        self.assertEqual(diff.removed, [0])
+        self.assertEqual(diff.matched, [(1, 0)])
+        self.assertFalse(diff.is_same)
+        self.assertTrue(diff_entries(base, base).is_same)
+
+
+class MovesTest(unittest.TestCase):
+    def test_longest_increasing_subsequence(self):
+        values = [3, 1, 4, 1, 5, 9, 2, 6]
+        positions = longest_increasing_subsequence(values)
+        subsequence = [values[i] for i in positions]
+        self.assertEqual(positions, sorted(positions))
+        self.assertEqual(subsequence, sorted(set(subsequence)))
+        self.assertEqual(len(positions), _lis_length(values))
+        self.assertEqual(longest_increasing_subsequence([]), [])
+
+    def test_minimal_moves(self):
+        rng = random.Random(0)
+        for n_entries in (1, 2, 5, 30):
+            for _ in range(20):
+                base = [make_entry(index, subject=f"s{index}") for index in range(n_entries)]
+                target = list(base)
+                rng.shuffle(target)
+                diff = diff_entries(base, target)
+                base_positions = [base_index for base_index, _ in diff.matched]
+                self.assertEqual(len(diff.moves), n_entries - _lis_length(base_positions))
+                # baseの並び順(targetのインデックス)に移動を適用するとtargetの並び順になる
+                base_order = [
+                    target_index for _, target_index in sorted(diff.matched, key=lambda p: p[0])
+                ]
+                self.assertEqual(_apply_moves(base_order, diff.moves), list(range(n_entries)))
+
+
+class MergeOrderTest(unittest.TestCase):
+    def test_merge_keeps_both_orders(self):
+        mine = [
+            make_entry(3, subject="c"),
+            make_entry(1, subject="a"),
+            make_entry(2, subject="b"),
+            make_entry(9, subject="removed"),
+        ]
+        fresh = [
+            make_entry(7, subject="new first"),
+            make_entry(1, subject="a"),
+            make_entry(8, subject="new after a"),
+            make_entry(2, subject="b"),
+            make_entry(3, subject="c"),
+        ]
+        index_list, n_matched = merge_order(mine, fresh)
+        self.assertEqual(n_matched, 3)
+        # mineの並び順(c, a, b)を保ち、freshにだけあるentryはfreshでの直前のentryの直後に並べる
+        self.assertEqual(index_list, [0, 4, 1, 2, 3])
+
+    def test_random_merge_keeps_relative_order(self):
+        rng = random.Random(1)
+        for _ in range(50):
+            ids = list(range(40))
+            mine_ids = rng.sample(ids, 30)
+            fresh_ids = rng.sample(ids, 30)
+            mine = [make_entry(index, subject=f"s{index}") for index in mine_ids]
+            fresh = [make_entry(index, subject=f"s{index}") for index in fresh_ids]
+            index_list, n_matched = merge_order(mine, fresh)
+
+            self.assertEqual(sorted(index_list), list(range(len(fresh))))
+            merged_ids = [fresh_ids[index] for index in index_list]
+            common = set(mine_ids) & set(fresh_ids)
+            self.assertEqual(n_matched, len(common))
+            # 両方にあるentryはmineの順
+            self.assertEqual(
+                [i for i in merged_ids if i in common], [i for i in mine_ids if i in common]
+            )
+            # freshにだけあるentryは、freshでの直前のentryの直後(同じ直前のentryの間はfreshの順)
+            for position, fresh_index in enumerate(index_list):
+                if fresh_ids[fresh_index] in common:
+                    continue
+                previous = index_list[position - 1] if position else None
+                if fresh_index == 0:
+                    self.assertIsNone(previous)
+                else:
+                    self.assertEqual(previous, fresh_index - 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import tempfile
+import unittest
+
+from app.data.filter_data import FilterData
+from app.data.filter_loader import scan_entry_spans
+
+HEADER = (
+    "<?xml version='1.0' encoding='UTF-8'?>\n"
+    "<feed xmlns='http://www.w3.org/2005/Atom' xmlns:apps='http://schemas.google.com/apps/2006'>\n"
+    "\t<title>Mail Filters</title>\n"
+    "\t<id>tag:mail.google.com,2008:filters:z0000001700000000000</id>\n"
+    "\t<updated>2024-05-01T00:00:00Z</updated>\n"
+    "\t<author>\n"
+    "\t\t<name>Taro</name>\n"
+    "\t\t<email>taro@example.com</email>\n"
+    "\t</author>\n"
+)
+FOOTER = "</feed>"
+
+
+def _entry_xml(index: int, name: str, value: str, title: str = "Mail Filter") -> str:
+    """FilterXmlWriterと同じ書式のentry要素(valueはエスケープ済みの文字列)"""
+    return (
+        "\t<entry>\n"
+        "\t\t<category term='filter'></category>\n"
+        f"\t\t<title>{title}</title>\n"
+        f"\t\t<id>tag:mail.google.com,2008:filter:z{index:019d}</id>\n"
+        "\t\t<updated>2024-05-01T00:00:00Z</updated>\n"
+        "\t\t<content></content>\n"
+        f"\t\t<apps:property name='{name}' value='{value}'/>\n"
+        "\t</entry>\n"
+    )
+
+
+ENTRIES = [
+    _entry_xml(0, "from", "news@example.com"),
+    # 値の中のエスケープされた<entryはentryの開始タグとして扱わない
+    _entry_xml(1, "subject", "&lt;entry&gt; &amp; &quot;invoice&quot;"),
+    _entry_xml(2, "hasTheWord", "a &lt;entry b &lt;/entry&gt;"),
+    _entry_xml(3, "label", "Bills"),
+]
+
+
+class FilterWriterTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.source_path = os.path.join(self._dir.name, "filters.xml")
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _write_source(self, text: str) -> bytes:
+        data = text.encode("utf-8")
+        with open(self.source_path, mode="wb") as f:
+            f.write(data)
+        return data
+
+    def _export(self, filter_data: FilterData, index_list=None) -> bytes:
+        path = os.path.join(self._dir.name, "exported.xml")
+        filter_data.export_xml(path, index_list)
+        with open(path, mode="rb") as f:
+            return f.read()
+
+    def _export_streaming(self, filter_data: FilterData, index_list=None) -> bytes:
+        """読み込み元のバイト列を使わずに、全てのentryを文字列に変換して出力する"""
+        snapshot = filter_data.snapshot(index_list)
+        snapshot.source = None
+        return self._export(snapshot)
+
+    def test_scan_entry_spans(self):
+        source = self._write_source(HEADER + "".join(ENTRIES) + FOOTER)
+        spans = scan_entry_spans(self.source_path)
+        self.assertEqual(len(spans), 2 * len(ENTRIES))
+        for index, entry in enumerate(ENTRIES):
+            self.assertEqual(source[spans[2 * index] : spans[2 * index + 1]], entry.encode())
+        self.assertEqual(source[: spans[0]], HEADER.encode())
+        self.assertEqual(source[spans[-1] :], FOOTER.encode())
+
+    def test_unchanged_and_reordered(self):
+        source = self._write_source(HEADER + "".join(ENTRIES) + FOOTER)
+        filter_data = FilterData(self.source_path)
+        self.assertIsNotNone(filter_data.source)
+
+        self.assertEqual(self._export(filter_data), source)
+        self.assertEqual(self._export_streaming(filter_data), source)
+
+        order = [2, 0, 3, 1]
+        reordered = self._export(filter_data, order)
+        self.assertEqual(reordered, (HEADER + "".join(ENTRIES[i] for i in order) + FOOTER).encode())
+        self.assertEqual(reordered, self._export_streaming(filter_data, order))
+
+    def test_cdata_and_comment(self):
+        # CDATAやコメントは元のバイト列のまま出力する(コメントは直前のentryに含める)
+        entries = list(ENTRIES)
+        entries[1] = _entry_xml(1, "from", "a@example.com", "<![CDATA[Mail & Filter]]>")
+        entries[2] += "\t<!-- bills -->\n\n"
+        source = self._write_source(HEADER + "".join(entries) + FOOTER)
+        filter_data = FilterData(self.source_path)
+        self.assertIsNotNone(filter_data.source)
+        self.assertEqual(filter_data.entry_list[1].title, "Mail & Filter")
+
+        self.assertEqual(self._export(filter_data), source)
+        order = [3, 2, 1, 0]
+        reordered = self._export(filter_data, order)
+        self.assertEqual(reordered, (HEADER + "".join(entries[i] for i in order) + FOOTER).encode())
+        # 文字列に変換し直して出力した場合と、読み込み結果は一致する
+        streaming_path = os.path.join(self._dir.name, "streaming.xml")
+        with open(streaming_path, mode="wb") as f:
+            f.write(self._export_streaming(filter_data, order))
+        with open(self.source_path, mode="wb") as f:
+            f.write(reordered)
+        self.assertEqual(
+            FilterData(self.source_path).entry_list, FilterData(streaming_path).entry_list
+        )
+        self.assertEqual(
+            FilterData(self.source_path).entry_list, [filter_data.entry_list[i] for i in order]
+        )
+
+    def test_entry_tag_in_cdata(self):
+        # CDATA内の<entry>はバイト列の走査では区別できないため、範囲を特定せずに文字列に変換する
+        entries = list(ENTRIES)
+        entries[1] = _entry_xml(1, "from", "a@example.com", "<![CDATA[<entry>]]>")
+        self._write_source(HEADER + "".join(entries) + FOOTER)
+        self.assertIsNone(scan_entry_spans(self.source_path))
+        filter_data = FilterData(self.source_path)
+        self.assertIsNone(filter_data.source)
+        self.assertEqual(filter_data.entry_list[1].title, "<entry>")
+
+        order = [1, 0, 3, 2]
+        entries[1] = _entry_xml(1, "from", "a@example.com", "&lt;entry&gt;")
+        self.assertEqual(
+            self._export(filter_data, order),
+            (HEADER + "".join(entries[i] for i in order) + FOOTER).encode(),
+        )
+
+    def test_changed_source(self):
+        # 読み込み後に元のxmlが変更された場合は、全てのentryを文字列に変換し直す
+        self._write_source(HEADER + "".join(ENTRIES) + FOOTER)
+        filter_data = FilterData(self.source_path)
+        self._write_source(HEADER + FOOTER)
+        order = [3, 1, 2, 0]
+        self.assertEqual(
+            self._export(filter_data, order),
+            (HEADER + "".join(ENTRIES[i] for i in order) + FOOTER).encode(),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
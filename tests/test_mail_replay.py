@@ -0,0 +1,48 @@
+import unittest
+
+from factories import make_entry
+
+from app.data.mail_replay import FILENAME, SUBJECT, FilterMatcher, MailText
+
+
+def _mail(*headers: str, body: str = "body") -> MailText:
+    raw = "\r\n".join((*headers, "", body)).encode("utf-8")
+    return MailText.from_bytes(raw)
+
+
+class MailTextTest(unittest.TestCase):
+    def test_raw_utf8_subject(self):
+        # RFC 6532: エンコードせずにUTF-8で書かれたヘッダー
+        mail = _mail("From: a@example.com", "Subject: 請求書のお知らせ")
+        self.assertIn("請求", mail.tokens(SUBJECT))
+        self.assertNotIn("�", mail.phrase_text(SUBJECT))
+
+    def test_encoded_subject(self):
+        mail = _mail("From: a@example.com", "Subject: =?UTF-8?B?6KuL5rGC5pu4?=")
+        self.assertIn("請求", mail.tokens(SUBJECT))
+
+    def test_raw_utf8_filename(self):
+        mail = _mail(
+            "From: a@example.com",
+            "Content-Type: application/pdf",
+            'Content-Disposition: attachment; filename="請求書.pdf"',
+        )
+        self.assertTrue(mail.has_attachment)
+        self.assertIn("pdf", mail.tokens(FILENAME))
+        self.assertIn("請求", mail.tokens(FILENAME))
+
+
+class FilterMatcherTest(unittest.TestCase):
+    def test_raw_utf8_subject_matches(self):
+        matcher = FilterMatcher(
+            [
+                make_entry(0, subject="請求書", label="Bills"),
+                make_entry(1, subject="領収書", label="Bills"),
+            ]
+        )
+        mail = _mail("From: billing@example.com", "Subject: 請求書のお知らせ")
+        self.assertEqual(matcher.match(mail), (0,))
+
+
+if __name__ == "__main__":
+    unittest.main()
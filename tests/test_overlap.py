@@ -0,0 +1,127 @@
+import random
+import unittest
+
+from factories import make_entry
+
+from app.data.check_point import BlockMoveOperation, MoveOperation, SwapOperation
+from app.data.filter_entry import FilterEntry
+from app.data.overlap import SHADOWED, OverlapAnalyzer
+
+
+def _shadowed_by(entry_list: list[FilterEntry]) -> dict[int, list[int]]:
+    """entry -> そのentryを包含する上のentry(shadowedの注釈)"""
+    analyzer = OverlapAnalyzer(entry_list)
+    analyzer.annotate(range(len(entry_list)))
+    return {
+        index: [
+            overlap.other for overlap in analyzer.annotations(index) if overlap.kind == SHADOWED
+        ]
+        for index in range(len(entry_list))
+    }
+
+
+class OverlapAnalyzerTest(unittest.TestCase):
+    def test_word_and_is_shadowed(self):
+        entry_list = [
+            make_entry(0, hasTheWord="invoice", label="Bills"),
+            make_entry(1, hasTheWord="invoice receipt", label="Bills"),
+            make_entry(2, subject="foo", label="Foo"),
+            make_entry(3, subject="foo bar", label="Foo"),
+        ]
+        shadowed = _shadowed_by(entry_list)
+        self.assertEqual(shadowed[1], [0])
+        self.assertEqual(shadowed[3], [2])
+
+    def test_word_or_is_not_shadowed(self):
+        # いずれかの単語に一致するOR条件は、片方の単語の条件に包含されない
+        entry_list = [
+            make_entry(0, hasTheWord="invoice", label="Bills"),
+            make_entry(1, hasTheWord="invoice OR receipt", label="Bills"),
+            make_entry(2, hasTheWord="invoice | receipt", label="Bills"),
+            make_entry(3, subject="foo", label="Foo"),
+            make_entry(4, subject="{foo bar}", label="Foo"),
+            make_entry(5, subject="foo OR bar", label="Foo"),
+        ]
+        shadowed = _shadowed_by(entry_list)
+        for index in (1, 2, 4, 5):
+            self.assertEqual(shadowed[index], [], index)
+
+    def test_word_or_above_is_not_compared(self):
+        entry_list = [
+            make_entry(0, subject="{foo bar}", label="Foo"),
+            make_entry(1, subject="foo", label="Foo"),
+        ]
+        self.assertEqual(_shadowed_by(entry_list)[1], [])
+
+    def test_lowercase_or_is_a_word(self):
+        entry_list = [
+            make_entry(0, subject="this or that", label="Foo"),
+            make_entry(1, subject="this or that day", label="Foo"),
+            make_entry(2, subject="this that", label="Foo"),
+        ]
+        shadowed = _shadowed_by(entry_list)
+        self.assertEqual(shadowed[1], [0])
+        self.assertEqual(shadowed[2], [])
+
+
+class OverlapUpdateTest(unittest.TestCase):
+    def _random_entry_list(self, rng: random.Random, n_entries: int) -> list[FilterEntry]:
+        entry_list = []
+        for index in range(n_entries):
+            properties = {}
+            if rng.random() < 0.8:
+                properties["from"] = rng.choice(["a@x.com", "b@x.com", "x.com", "c@y.com"])
+            if rng.random() < 0.5:
+                properties["subject"] = rng.choice(["foo", "foo bar", "bar"])
+            properties["label"] = rng.choice(["L1", "L2"])
+            if rng.random() < 0.3:
+                properties[rng.choice(["shouldArchive", "shouldTrash", "shouldStar"])] = "true"
+            entry_list.append(make_entry(index, **properties))
+        return entry_list
+
+    def _random_operation(self, rng: random.Random, n_rows: int):
+        kind = rng.randrange(3)
+        if kind == 0:
+            return SwapOperation(rng.randrange(n_rows), rng.randrange(n_rows))
+        if kind == 1:
+            return MoveOperation(rng.randrange(n_rows), rng.randrange(n_rows))
+        rows = rng.sample(range(n_rows), rng.randint(1, 8))
+        return BlockMoveOperation.to_position(rows, rng.randrange(n_rows - len(rows) + 1))
+
+    def test_update_matches_annotate(self):
+        # 移動した行だけを更新した注釈が、並び順全体から作り直した注釈と一致する
+        rng = random.Random(0)
+        n_entries = 120
+        entry_list = self._random_entry_list(rng, n_entries)
+        analyzer = OverlapAnalyzer(entry_list)
+        order = list(range(n_entries))
+        analyzer.annotate(order)
+        for _ in range(300):
+            # 一部のentryの注釈だけを作成済みにする(作成済みの注釈だけが更新の対象)
+            for entry_index in rng.sample(range(n_entries), 20):
+                analyzer.annotations(entry_index)
+
+            operation = self._random_operation(rng, n_entries)
+            previous = list(order)
+            operation.apply(order)
+            if isinstance(operation, SwapOperation):
+                moved_rows = (operation.source_row, operation.target_row)
+            elif isinstance(operation, MoveOperation):
+                moved_rows = (operation.target_row,)
+            else:
+                moved_rows = operation.destination_rows
+            changed_rows = [row for row in range(n_entries) if order[row] != previous[row]]
+            analyzer.update(order, [order[row] for row in moved_rows], changed_rows)
+
+            expected = OverlapAnalyzer(entry_list)
+            expected.annotate(order)
+            for entry_index in range(n_entries):
+                self.assertEqual(analyzer.position(entry_index), expected.position(entry_index))
+                self.assertEqual(
+                    analyzer.annotations(entry_index), expected.annotations(entry_index)
+                )
+            self.assertEqual(analyzer.order.tolist(), order)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import random
+import unittest
+from unittest import mock
+
+from app.data import row_order
+from app.data.row_order import RowOrder
+
+
+class RowOrderTest(unittest.TestCase):
+    def setUp(self):
+        # NOTE: チャンクの分割・削除が起きるよう、チャンクを小さくする
+        patcher = mock.patch.object(row_order, "CHUNK_SIZE", 4)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assert_same(self, order: RowOrder, expected: list[int]) -> None:
+        self.assertEqual(len(order), len(expected))
+        self.assertEqual(list(order), expected)
+        self.assertEqual(order.to_array().tolist(), expected)
+        # 行番号からの検索(Fenwick木)で全ての行を引けること
+        self.assertEqual([order[row] for row in range(len(expected))], expected)
+
+    def test_random_operations_match_list(self):
+        rng = random.Random(0)
+        expected = list(range(50))
+        order = RowOrder(expected)
+        next_value = len(expected)
+        for _ in range(3000):
+            kind = rng.randrange(6)
+            if kind in (0, 4) and len(expected) > 100:
+                kind = 2
+            if kind == 0 or not expected:
+                row = rng.randint(-len(expected) - 2, len(expected) + 2)
+                expected.insert(row, next_value)
+                order.insert(row, next_value)
+                next_value += 1
+            elif kind == 1:
+                row = rng.randrange(-len(expected), len(expected))
+                self.assertEqual(order.pop(row), expected.pop(row))
+            elif kind == 2:
+                row = rng.randrange(len(expected))
+                del expected[row]
+                del order[row]
+            elif kind == 3:
+                row = rng.randrange(len(expected))
+                expected[row] = order[row] = next_value
+                next_value += 1
+            elif kind == 4:
+                values = list(range(next_value, next_value + rng.randrange(10)))
+                next_value += len(values)
+                expected.extend(values)
+                order.extend(values)
+            else:
+                row = rng.randrange(-len(expected), len(expected))
+                self.assertEqual(order[row], expected[row])
+            self.assert_same(order, expected)
+
+    def test_remove_all_rows_and_insert(self):
+        order = RowOrder(range(20))
+        for _ in range(20):
+            order.pop(0)
+        self.assert_same(order, [])
+        for value in range(10):
+            order.insert(0, value)
+        self.assert_same(order, list(range(9, -1, -1)))
+
+    def test_out_of_range(self):
+        order = RowOrder(range(3))
+        with self.assertRaises(IndexError):
+            order[3]
+        with self.assertRaises(IndexError):
+            order[-4]
+
+    def test_slice(self):
+        order = RowOrder(range(10))
+        self.assertEqual(order[2:5].tolist(), [2, 3, 4])
+        order[:] = range(9, -1, -1)
+        self.assert_same(order, list(range(9, -1, -1)))
+
+
+if __name__ == "__main__":
+    unittest.main()